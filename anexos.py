@@ -0,0 +1,79 @@
+import hashlib
+import os
+import tempfile
+
+# Anexos são guardados em uploads/ pelo SHA-256 do conteúdo ("<hash>.<ext>"):
+# o mesmo comprovante enviado várias vezes ocupa um único arquivo. A tabela
+# anexos conta, via triggers em transacoes, quantas transações usam cada um;
+# um job de OCR ainda em processamento também segura o arquivo.
+#
+# Pôr o arquivo no lugar e apagá-lo acontecem só com o lock de escrita do
+# banco (BEGIN IMMEDIATE): um upload do mesmo conteúdo nunca fica com a
+# referência gravada e o arquivo apagado por uma exclusão concorrente.
+
+TAMANHO_BLOCO = 64 * 1024
+
+def salvar_anexo(conn, file, pasta):
+    # Grava o upload num temporário calculando o hash no caminho (fora do
+    # lock) e o põe no lugar dentro de uma transação BEGIN IMMEDIATE, que
+    # fica aberta: quem chama grava a referência (transação ou job de OCR) e
+    # faz o commit. Devolve (arquivo, sha256).
+    extensao = file.filename.rsplit('.', 1)[1].lower()
+    sha256 = hashlib.sha256()
+    descritor, temporario = tempfile.mkstemp(dir=pasta, suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            for bloco in iter(lambda: file.stream.read(TAMANHO_BLOCO), b''):
+                sha256.update(bloco)
+                destino.write(bloco)
+
+        arquivo = f'{sha256.hexdigest()}.{extensao}'
+        caminho = os.path.join(pasta, arquivo)
+        conn.execute('BEGIN IMMEDIATE')
+        if os.path.exists(caminho):
+            os.remove(temporario)
+        else:
+            os.replace(temporario, caminho)
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    return arquivo, sha256.hexdigest()
+
+# Arquivos consultados por SELECT ... IN (...) de uma vez
+ANEXOS_POR_CONSULTA = 500
+
+def liberar_anexos(conn, arquivos, pasta):
+    # Chamado depois do commit que excluiu as transações (ou quando um job de
+    # OCR termina): remove do disco os anexos que não são mais usados por
+    # nenhuma transação nem por um OCR em andamento. A conferência e a
+    # remoção acontecem na mesma transação BEGIN IMMEDIATE, com uma consulta
+    # por bloco de arquivos e um único commit, seja qual for o tamanho do lote.
+    arquivos = sorted(set(filter(None, arquivos)))
+    if not arquivos:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        livres = []
+        for inicio in range(0, len(arquivos), ANEXOS_POR_CONSULTA):
+            bloco = arquivos[inicio:inicio + ANEXOS_POR_CONSULTA]
+            marcadores = ', '.join('?' * len(bloco))
+            em_uso = {
+                row['arquivo'] for row in conn.execute(f'''
+                    SELECT arquivo FROM anexos WHERE referencias > 0 AND arquivo IN ({marcadores})
+                    UNION
+                    SELECT arquivo FROM ocr_jobs WHERE status = 'processando' AND arquivo IN ({marcadores})
+                ''', bloco + bloco)
+            }
+            livres.extend(arquivo for arquivo in bloco if arquivo not in em_uso)
+        conn.executemany('DELETE FROM anexos WHERE arquivo = ? AND referencias <= 0', [(arquivo,) for arquivo in livres])
+        for arquivo in livres:
+            caminho = os.path.join(pasta, arquivo)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
@@ -1,73 +1,168 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, make_response, send_from_directory, flash, session, g
+from flask import Blueprint, Flask, abort, current_app, render_template, request, jsonify, redirect, url_for, make_response, send_from_directory, flash, session, g, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
-import sqlite3
-import io
+import cProfile
+import hashlib
 import json
+import math
 import os
 import re
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from werkzeug.utils import secure_filename
 from functools import wraps
-import pandas as pd 
-
-# --- Bibliotecas para OCR ---
-try:
-    from PIL import Image
-    import pytesseract
-    from pdf2image import convert_from_path
-    
-    # CONFIGURAÇÃO DO CAMINHO DO TESSERACT - AJUSTE MANUAL
-    # Substitua pelo caminho correto no seu sistema, se necessário
-    # Exemplo para Windows:
-    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-    # Exemplo para Linux (geralmente não precisa se estiver no PATH):
-    # pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
-    
-    # Verificar se o Tesseract está acessível
-    try:
-        pytesseract.get_tesseract_version()
-        TESSERACT_AVAILABLE = True
-        print("✓ Tesseract OCR configurado com sucesso!")
-        print(f"✓ Caminho: {pytesseract.pytesseract.tesseract_cmd}")
-    except Exception as e:
-        TESSERACT_AVAILABLE = False
-        print(f"✗ Erro ao acessar Tesseract: {e}")
-        print("✗ Dica: Verifique se o Tesseract-OCR está instalado e se o caminho no app.py está correto.")
-        
-except ImportError as e:
-    TESSERACT_AVAILABLE = False
-    print(f"✗ Bibliotecas OCR não disponíveis: {e}. Para usar a função de anexo, instale-as com 'pip install pytesseract pillow pdf2image'.")
+import click
+import anexos
+import arquivamento
+import backup as backups
+import database
+import exportacao
+import importacao
+import metricas
+import ocr
+import relatorios_pdf
+from database import get_db
 
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-
-app = Flask(__name__)
-app.secret_key = 'sua_chave_secreta_aqui_troque_por_algo_seguro' # IMPORTANTE: Troque por uma chave segura
+# Rotas e comandos do app; create_app registra tudo numa instância do Flask.
+# pandas, ReportLab e a pilha de OCR só são importados quando uma rota
+# precisa deles (importação, PDF, OCR), não ao carregar este módulo.
+bp = Blueprint('main', __name__, cli_group=None)
 
 # --- Configurações de Upload ---
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+TRANSACOES_POR_PAGINA_MAX = 500
+
+CONFIG_PADRAO = {
+    # Configuração do banco de dados
+    'DATABASE': 'livro_caixa.db',
+    'UPLOAD_FOLDER': UPLOAD_FOLDER,
+    # Banco que recebe as transações dos anos fechados (flask fechar-ano);
+    # caminho relativo à pasta do banco principal
+    'ARQUIVO_DATABASE': 'livro_caixa_arquivo.db',
+
+    # --- Paginação da listagem de transações ---
+    'TRANSACOES_POR_PAGINA': 50,
+
+    # --- Configurações do OCR em segundo plano ---
+    'OCR_WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    'OCR_MAX_PENDENTES': 8,   # jobs na fila antes de recusar novos envios
+    'OCR_TIMEOUT': 60,        # segundos por job
+
+    # --- Snapshots do banco ---
+    'BACKUP_PASTA': 'backups',
+    'BACKUP_MANTER': 7,       # snapshots guardados antes de apagar os mais antigos
+    'BACKUP_INTERVALO': 0,    # segundos entre snapshots automáticos (0 desliga)
+
+    # --- Relatórios em PDF ---
+    'RELATORIOS_CACHE': 'relatorios_cache',
+    'RELATORIO_PDF_LIMITE_SINCRONO': 2000,  # acima disso o PDF é gerado em segundo plano
+
+    # --- Cache do usuário logado ---
+    'USUARIO_CACHE_TTL': 300,
+
+    # --- Busca textual ---
+    'BUSCA_MAX_RESULTADOS': 500,  # correspondências mais recentes ordenadas por relevância
+
+    # --- Lançamento e exclusão em lote ---
+    'LOTE_MAX_TRANSACOES': 1000,  # itens por requisição em /api/transacoes/lote
+
+    # --- Métricas (/metrics) e perfil das requisições ---
+    'SQL_LENTA_MS': 250,            # consultas acima disso são impressas no console
+    'PERFIL_REQUISICOES': False,    # liga o cProfile em cada requisição
+    'PERFIL_ORCAMENTO_MS': 500,     # só grava o perfil das requisições mais lentas que isso
+    'PERFIL_PASTA': 'perfis',
+
+    # --- Segurança e OCR ---
+    # Sem SECRET_KEY, uma chave aleatória é criada na primeira execução e
+    # guardada neste arquivo (relativo à pasta do banco), a mesma para todos
+    # os processos do servidor
+    'SECRET_KEY_ARQUIVO': '.secret_key',
+    'TESSERACT_CMD': None,    # executável do Tesseract; None usa o do PATH
+}
+
+def create_app(config=None):
+    # A configuração vem em camadas, cada uma sobrescrevendo a anterior:
+    # CONFIG_PADRAO; o arquivo .py apontado por LIVRO_CAIXA_CONFIG (chaves em
+    # maiúsculas, ex.: DATABASE = '/var/lib/livro_caixa/livro_caixa.db'); as
+    # variáveis de ambiente LIVRO_CAIXA_<CHAVE> (ex.: LIVRO_CAIXA_OCR_WORKERS=2,
+    # valores em JSON viram números e booleanos); e o dicionário "config".
+    app = Flask(__name__)
+    app.config.from_mapping(CONFIG_PADRAO)
+    if os.environ.get('LIVRO_CAIXA_CONFIG'):
+        app.config.from_envvar('LIVRO_CAIXA_CONFIG')
+    app.config.from_prefixed_env('LIVRO_CAIXA')
+    if config:
+        app.config.update(config)
+
+    if not app.config.get('SECRET_KEY'):
+        app.secret_key = chave_secreta(app.config['DATABASE'], app.config['SECRET_KEY_ARQUIVO'])
+    if app.config['TESSERACT_CMD']:
+        # Os processos do pool de OCR (spawn) herdam o ambiente, não o app
+        os.environ['TESSERACT_CMD'] = app.config['TESSERACT_CMD']
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    database.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
+def chave_secreta(caminho_db, arquivo):
+    # Lê a chave do arquivo ou cria uma nova. A chave é gravada num
+    # temporário e ligada ao nome final com os.link, que falha se o arquivo
+    # já existe: workers subindo juntos acabam todos com a mesma chave.
+    caminho = os.path.join(os.path.dirname(os.path.abspath(caminho_db)), arquivo)
+    if not os.path.exists(caminho):
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+        try:
+            with os.fdopen(descritor, 'w') as destino:
+                destino.write(secrets.token_hex(32))
+            os.chmod(temporario, 0o600)
+            os.link(temporario, caminho)
+            print(f"✓ Chave secreta criada em {caminho}")
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporario)
+    with open(caminho) as origem:
+        return origem.read().strip()
+
+def aquecer(app):
+    # Roda em cada worker do servidor de produção, depois do fork e antes da
+    # primeira requisição (gunicorn.conf.py): confere o esquema do banco,
+    # traz as tabelas de resumo para o cache do sistema, compila os
+    # templates e carrega o ReportLab e o Tesseract, que as rotas só
+    # carregariam na primeira vez que fossem usadas.
+    inicio = time.perf_counter()
+    conn = database.connect(app.config['DATABASE'])
+    try:
+        versao = database.schema_version(conn)
+        if versao != len(database.MIGRATIONS):
+            print(f"✗ Esquema do banco na versão {versao}, esperado {len(database.MIGRATIONS)}: rode flask init-db.")
+        for tabela in ('users', 'resumo_mensal', 'saldo_diario', 'versao_usuario'):
+            conn.execute(f'SELECT COUNT(*) FROM {tabela}').fetchone()
+    finally:
+        conn.close()
+    for nome in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nome)
+    relatorios_pdf.estilo_transacoes()
+    ocr.tesseract_disponivel()
+    print(f"✓ Worker {os.getpid()} aquecido em {(time.perf_counter() - inicio) * 1000:.0f} ms")
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 # --------------------------------
 
-# Configuração do banco de dados
-def get_db_connection():
-    conn = sqlite3.connect('livro_caixa.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def init_db():
-    conn = get_db_connection()
+    conn = database.connect(current_app.config['DATABASE'])
     
     # Tabela de usuários
     conn.execute('''
@@ -123,32 +218,230 @@ def init_db():
         conn.executemany('INSERT INTO categorias (nome, tipo, cor) VALUES (?, ?, ?)', categorias_despesa)
     
     conn.commit()
+    database.migrate(conn)
     conn.close()
 
+def consultas_frequentes(conn):
+    # Consultas mais frequentes das rotas, montadas pelas mesmas funções e
+    # constantes que as rotas usam, para conferir os planos de execução
+    periodo = (1, '2024-01-01', '2024-12-31')
+    consultas = []
+    for nome, tipo in (('', 'todos'), (' (tipo)', 'receita')):
+        consultas.append(('api_relatorio_detalhado' + nome, *consulta_relatorio_detalhado(*periodo, tipo)))
+        consultas.append(('relatorio_export' + nome, *exportacao.consulta(*periodo, tipo)))
+        consultas.append(('relatorio_pdf' + nome, *relatorios_pdf.consulta_transacoes(*periodo, tipo, ordenar=True)))
+    consultas.append(('api_relatorio_detalhado (totais)', arquivamento.SQL_TOTAIS_POR_TIPO, periodo + periodo))
+
+    for nome, args in (('', {}), (', tipo', {'tipo': 'despesa'})):
+        condicoes, params = filtros_transacoes(args, 1)
+        consultas.append((f'api_transacoes (stream{nome})', consulta_lista_transacoes(condicoes, limitada=False), params))
+        consultas.append((f'api_transacoes (página{nome})', consulta_lista_transacoes(condicoes + [CONDICAO_CURSOR]), params + ['2024-12-31', 1000, 51]))
+        consultas.append((f'api_busca_transacoes{nome}', consulta_busca(condicoes), ['"mercado"*'] + params + [500]))
+
+    # A importação compara o lote, numa tabela temporária, com as transações do usuário
+    importacao.criar_tabela_importacao(conn)
+    consultas.append(('importar_planilha (duplicadas)', importacao.SQL_DUPLICADAS, {'user_id': 1}))
+    consultas.append(('importar_planilha (inserir)', importacao.SQL_INSERIR, {'user_id': 1}))
+    consultas.append(('api_mudancas_transacoes', SQL_MUDANCAS, (1, 0, 501)))
+    consultas.append(('dashboard (saldo)', SQL_SALDO, (1,)))
+    return consultas
+
+@bp.cli.command('init-db')
+def init_db_command():
+    init_db()
+    conn = database.connect(current_app.config['DATABASE'])
+    print(f"✓ Banco de dados pronto (esquema versão {database.schema_version(conn)}).")
+    conn.close()
+
+@bp.cli.command('reconstruir-resumo')
+def reconstruir_resumo_command():
+    conn = database.connect(current_app.config['DATABASE'])
+    divergencias = database.verify_resumo(conn)
+    print(f"Divergências encontradas antes da reconstrução: {len(divergencias)}")
+    for chave, esperado, atual in divergencias:
+        print(f"  {chave}: esperado {esperado}, encontrado {atual}")
+    database.rebuild_resumo(conn)
+    divergencias = database.verify_resumo(conn)
+    conn.close()
+    if divergencias:
+        print(f"✗ Resumo ainda diverge em {len(divergencias)} chaves após a reconstrução.")
+        raise SystemExit(1)
+    print("✓ Tabelas resumo_mensal e saldo_diario reconstruídas e conferidas com transacoes.")
+
+@bp.cli.command('verificar-planos')
+def verificar_planos_command():
+    conn = database.connect(current_app.config['DATABASE'])
+    consultas = consultas_frequentes(conn)
+    problemas = database.query_plan_scans(conn, consultas)
+    conn.close()
+    for nome, detalhe in problemas:
+        print(f"✗ {nome}: {detalhe}")
+    if problemas:
+        raise SystemExit(1)
+    print(f"✓ Nenhuma das {len(consultas)} consultas frequentes faz varredura completa.")
+
+@bp.cli.command('fechar-ano')
+@click.argument('ano')
+def fechar_ano_command(ano):
+    # Move as transações do ano para o banco de arquivo; o banco principal
+    # fica só com os totais do ano e deixa de aceitar lançamentos nele
+    conn = database.connect(current_app.config['DATABASE'])
+    try:
+        quantidade = arquivamento.fechar_ano(conn, ano, current_app.config['ARQUIVO_DATABASE'])
+    except ValueError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    finally:
+        conn.close()
+    print(f"✓ {ano} fechado: {quantidade} transações movidas para {current_app.config['ARQUIVO_DATABASE']}.")
+
+@bp.cli.command('backup')
+def backup_command():
+    criados = backups.criar_snapshot(current_app.config['DATABASE'], current_app.config['BACKUP_PASTA'], current_app.config['BACKUP_MANTER'])
+    for criado in criados:
+        print(f"✓ Snapshot gravado em {criado}")
+    if not criados:
+        print("✓ Nenhuma alteração desde o último snapshot.")
+
+@bp.cli.command('verificar-backup')
+@click.argument('arquivo')
+def verificar_backup_command(arquivo):
+    problemas = backups.verificar_snapshot(arquivo)
+    for problema in problemas:
+        print(f"✗ {problema}")
+    if problemas:
+        raise SystemExit(1)
+    print(f"✓ {arquivo} e os snapshots dos bancos de arquivo que vão com ele estão íntegros (PRAGMA integrity_check).")
+
+@bp.cli.command('restaurar-backup')
+@click.argument('arquivo')
+def restaurar_backup_command(arquivo):
+    problemas = backups.restaurar(arquivo, current_app.config['DATABASE'])
+    for problema in problemas:
+        print(f"✗ {problema}")
+    if problemas:
+        print("✗ Restauração cancelada ou incompleta.")
+        raise SystemExit(1)
+    print(f"✓ Banco (e bancos de arquivo) restaurados de {arquivo} e conferidos com PRAGMA integrity_check.")
+
+@bp.cli.command('atribuir-transacoes')
+@click.argument('usuario')
+def atribuir_transacoes_command(usuario):
+    # Transações sem dono (de um banco migrado antes de haver usuários
+    # cadastrados) passam para o usuário informado
+    conn = database.connect(current_app.config['DATABASE'])
+    try:
+        user = conn.execute('SELECT id FROM users WHERE username = ?', (usuario,)).fetchone()
+        if user is None:
+            print(f"✗ Usuário {usuario} não encontrado.")
+            raise SystemExit(1)
+        cursor = conn.execute('UPDATE transacoes SET user_id = ? WHERE user_id IS NULL', (user['id'],))
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"✓ {cursor.rowcount} transações atribuídas a {usuario}.")
+
+# --- Métricas e perfil por requisição ---
+
+@bp.before_app_request
+def iniciar_medicao():
+    # Registrado antes de load_logged_in_user: a consulta do usuário entra
+    # no tempo de SQL da requisição
+    g.metricas = {'inicio': time.perf_counter(), 'consultas': 0, 'sql': 0.0, 'perfil': None}
+    if current_app.config['PERFIL_REQUISICOES']:
+        perfil = cProfile.Profile()
+        perfil.enable()
+        g.metricas['perfil'] = perfil
+
+@bp.after_app_request
+def agendar_medicao(response):
+    medicao = g.get('metricas')
+    if medicao is None:
+        return response
+    # A rota é o padrão da URL ("/api/transacoes/<int:id>"), não o caminho,
+    # para o número de séries não crescer com os ids
+    rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+    metodo, status, config = request.method, str(response.status_code), current_app.config
+    # Respostas em streaming só terminam depois do after_request; a medição
+    # fecha quando o servidor termina de enviar a resposta
+    response.call_on_close(lambda: registrar_requisicao(medicao, metodo, rota, status, config))
+    return response
+
+def registrar_requisicao(medicao, metodo, rota, status, config):
+    duracao = time.perf_counter() - medicao['inicio']
+    perfil = medicao['perfil']
+    if perfil is not None:
+        perfil.disable()
+    metricas.observar('livro_caixa_requisicao_segundos', duracao, rota=rota, metodo=metodo, status=status)
+    metricas.observar('livro_caixa_requisicao_sql_segundos', medicao['sql'], rota=rota)
+    metricas.incrementar('livro_caixa_requisicao_consultas_total', medicao['consultas'], rota=rota)
+    if perfil is not None and duracao * 1000 >= config['PERFIL_ORCAMENTO_MS']:
+        metricas.gravar_perfil(perfil, config['PERFIL_PASTA'], metodo, rota, duracao)
+
+@bp.route('/metrics')
+def metrics():
+    # Formato texto do Prometheus; cada processo do servidor tem as suas
+    # métricas (o Prometheus soma as instâncias)
+    return current_app.response_class(metricas.texto_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # --- Rotas de Autenticação e Sessão ---
 
-@app.before_request
+# Usuários já carregados, por id: cada requisição autenticada consultaria a
+# tabela users só para preencher g.user. LRU limitado a USUARIOS_CACHE_MAX
+# entradas, cada uma válida por USUARIO_CACHE_TTL segundos (o TTL também
+# limita o tempo que outro processo do servidor leva para ver uma mudança).
+USUARIOS_CACHE_MAX = 256
+usuarios_cache = OrderedDict()
+usuarios_cache_lock = threading.Lock()
+
+def obter_usuario(user_id):
+    agora = time.monotonic()
+    with usuarios_cache_lock:
+        item = usuarios_cache.get(user_id)
+        if item is not None and item[0] > agora:
+            usuarios_cache.move_to_end(user_id)
+            return item[1]
+
+    row = get_db().execute('SELECT id, username FROM users WHERE id = ?', (user_id,)).fetchone()
+    if row is None:
+        return None
+    user = dict(row)
+    with usuarios_cache_lock:
+        usuarios_cache[user_id] = (agora + current_app.config['USUARIO_CACHE_TTL'], user)
+        usuarios_cache.move_to_end(user_id)
+        while len(usuarios_cache) > USUARIOS_CACHE_MAX:
+            usuarios_cache.popitem(last=False)
+    return user
+
+def invalidar_usuario(user_id):
+    with usuarios_cache_lock:
+        usuarios_cache.pop(user_id, None)
+
+@bp.before_app_request
 def load_logged_in_user():
+    # Arquivos estáticos não usam o usuário: nem consulta o cache
+    if request.endpoint == 'static':
+        return
     user_id = session.get('user_id')
     if user_id is None:
         g.user = None
     else:
-        g.user = get_db_connection().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        g.user = obter_usuario(user_id)
 
 def login_required(view):
     @wraps(view)
     def wrapped_view(**kwargs):
         if g.user is None:
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return view(**kwargs)
     return wrapped_view
 
-@app.route('/register', methods=('GET', 'POST'))
+@bp.route('/register', methods=('GET', 'POST'))
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db_connection()
+        db = get_db()
         error = None
 
         if not username:
@@ -164,18 +457,18 @@ def register():
                 error = f"Usuário {username} já está registrado."
             else:
                 flash("Cadastro realizado com sucesso! Faça o login.", "success")
-                return redirect(url_for("login"))
+                return redirect(url_for("main.login"))
         
         flash(error, 'danger')
 
     return render_template('register.html')
 
-@app.route('/login', methods=('GET', 'POST'))
+@bp.route('/login', methods=('GET', 'POST'))
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db_connection()
+        db = get_db()
         error = None
         user = db.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
 
@@ -187,56 +480,70 @@ def login():
         if error is None:
             session.clear()
             session['user_id'] = user['id']
-            return redirect(url_for('index'))
+            invalidar_usuario(user['id'])
+            return redirect(url_for('main.index'))
 
         flash(error, 'danger')
 
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
+    if session.get('user_id') is not None:
+        invalidar_usuario(session['user_id'])
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # --- Rotas da Aplicação ---
 
-@app.route('/uploads/<filename>')
+@bp.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
-@app.route('/')
+@bp.route('/')
 @login_required
 def index():
     return render_template('index.html')
 
-@app.route('/lancamentos')
+@bp.route('/lancamentos')
 @login_required
 def lancamentos():
     return render_template('lancamentos.html')
 
-@app.route('/relatorios')
+@bp.route('/relatorios')
 @login_required
 def relatorios():
     return render_template('relatorios.html')
 
-@app.route('/backup')
+@bp.route('/backup')
 @login_required
 def backup():
     try:
-        db_filename = 'livro_caixa.db'
-        root_dir = os.path.dirname(os.path.abspath(__file__))
-        return send_from_directory(directory=root_dir, path=db_filename, as_attachment=True)
+        # Cópia consistente feita com a API de backup do SQLite, só com os
+        # dados de quem pediu, enviada compactada e apagada ao fim do
+        # download; com anos fechados, um .zip que leva também o banco de
+        # arquivo. O banco inteiro só sai pela CLI (flask backup).
+        copia, formato = backups.preparar_download(current_app.config['DATABASE'], g.user['id'])
+        momento = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if formato == 'zip':
+            response = current_app.response_class(backups.gerar_pedacos(copia, remover=True), mimetype='application/zip')
+            nome = f"livro_caixa_{momento}.zip"
+        else:
+            response = current_app.response_class(backups.gerar_gzip(copia, remover=True), mimetype='application/gzip')
+            nome = f"livro_caixa_{momento}.db.gz"
+        response.headers['Content-Disposition'] = f'attachment; filename={nome}'
+        return response
     except Exception as e:
         flash(f'Erro ao gerar o backup: {str(e)}', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
 # --- API e Rotas de Funcionalidades ---
 
-@app.route('/api/ocr/processar', methods=['POST'])
+@bp.route('/api/ocr/processar', methods=['POST'])
 @login_required
 def processar_ocr():
-    if not TESSERACT_AVAILABLE:
+    if not ocr.tesseract_disponivel():
         return jsonify({'success': False, 'error': 'Recurso OCR não disponível no servidor.'})
 
     if 'anexo' not in request.files:
@@ -247,347 +554,800 @@ def processar_ocr():
         return jsonify({'success': False, 'error': 'Arquivo inválido ou não permitido.'})
 
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        inicio = time.perf_counter()
+        conn = get_db()
+        pasta = current_app.config['UPLOAD_FOLDER']
+        filename, sha256 = anexos.salvar_anexo(conn, file, pasta)
+        metricas.observar('livro_caixa_ocr_etapa_segundos', time.perf_counter() - inicio, etapa='salvar')
+        filepath = os.path.join(pasta, filename)
 
-        text = ''
-        if filename.lower().endswith('.pdf'):
-            try:
-                pages = convert_from_path(filepath, 200)
-                for page in pages:
-                    text += pytesseract.image_to_string(page, lang='por') + '\n'
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'Erro ao processar PDF: {str(e)}'})
-        else:
-            try:
-                text = pytesseract.image_to_string(Image.open(filepath), lang='por')
-            except Exception as e:
-                return jsonify({'success': False, 'error': f'Erro ao processar imagem: {str(e)}'})
-        
-        matches = re.findall(r'(\d+[.,]\d{2})', text)
-        valor_encontrado = 0.0
-        if matches:
-            max_valor = 0
-            for match in matches:
-                try:
-                    valor_numerico = float(match.replace(',', '.'))
-                    if valor_numerico > max_valor:
-                        max_valor = valor_numerico
-                except ValueError:
-                    continue
-            valor_encontrado = max_valor
+        # Documento já lido antes com os mesmos parâmetros: responde na hora.
+        # O arquivo só serve ao OCR (o formulário envia o anexo de novo ao
+        # salvar a transação); sai do disco se nenhuma transação o usa.
+        chave = ocr.chave_cache(sha256)
+        valor = ocr.obter_cache(conn, chave)
+        if valor is not None:
+            conn.commit()
+            anexos.liberar_anexos(conn, [filename], pasta)
+            return jsonify({'success': True, 'valor': valor, 'cache': True})
 
-        return jsonify({
-            'success': True, 
-            'valor': valor_encontrado
-        })
+        # O OCR roda num pool de processos; o cliente acompanha o job em
+        # /api/ocr/jobs/<id>. O job segura o arquivo até terminar.
+        job_id = ocr.criar_job(conn, filename, g.user['id'])
+        caminho_db = current_app.config['DATABASE']
+        try:
+            ocr.submeter(
+                filepath, current_app.config['OCR_TIMEOUT'], current_app.config['OCR_WORKERS'], current_app.config['OCR_MAX_PENDENTES'],
+                ao_concluir=lambda future: ocr.registrar_resultado(caminho_db, pasta, job_id, chave, future)
+            )
+        except ocr.FilaCheia as e:
+            conn.execute('DELETE FROM ocr_jobs WHERE id = ? AND user_id = ?', (job_id, g.user['id']))
+            conn.commit()
+            anexos.liberar_anexos(conn, [filename], pasta)
+            return jsonify({'success': False, 'error': str(e)})
+
+        return jsonify({'success': True, 'job_id': job_id})
     except Exception as e:
         return jsonify({'success': False, 'error': f'Erro ao processar o arquivo: {str(e)}'})
 
-@app.route('/api/transacoes', methods=['GET', 'POST'])
+@bp.route('/api/ocr/jobs/<job_id>')
+@login_required
+def api_ocr_job(job_id):
+    job = ocr.obter_job(get_db(), job_id, g.user['id'], current_app.config['OCR_TIMEOUT'])
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job de OCR não encontrado.'})
+    return jsonify({'success': True, **job})
+
+def filtros_transacoes(args, user_id):
+    # Toda consulta começa pelo usuário: é a primeira coluna dos índices
+    condicoes = ['user_id = ?']
+    params = [user_id]
+    tipo = args.get('tipo')
+    if tipo in ('receita', 'despesa'):
+        condicoes.append('tipo = ?')
+        params.append(tipo)
+    if args.get('categoria'):
+        condicoes.append('categoria = ?')
+        params.append(args['categoria'])
+    if args.get('data_inicio'):
+        condicoes.append('data >= ?')
+        params.append(args['data_inicio'])
+    if args.get('data_fim'):
+        condicoes.append('data <= ?')
+        params.append(args['data_fim'])
+    return condicoes, params
+
+# Paginação por cursor (keyset): só as linhas depois de "data,id" da última
+# linha da página anterior
+CONDICAO_CURSOR = '(data, id) < (?, ?)'
+
+def consulta_lista_transacoes(condicoes, limitada=True):
+    # Transações filtradas (filtros_transacoes), das mais recentes para as
+    # mais antigas; limitada recebe o tamanho da página como último parâmetro
+    query = f"SELECT * FROM transacoes WHERE {' AND '.join(condicoes)} ORDER BY data DESC, id DESC"
+    return query + ' LIMIT ?' if limitada else query
+
+def gerar_json_transacoes(cursor, lote=500):
+    # Gera um array JSON aos pedaços, lendo o cursor em lotes
+    yield '['
+    primeiro = True
+    while True:
+        linhas = cursor.fetchmany(lote)
+        if not linhas:
+            break
+        pedaco = ','.join(json.dumps(dict(row), ensure_ascii=False) for row in linhas)
+        yield pedaco if primeiro else ',' + pedaco
+        primeiro = False
+    yield ']'
+
+@bp.route('/api/transacoes', methods=['GET', 'POST'])
 @login_required
 def api_transacoes():
-    conn = get_db_connection()
+    conn = get_db()
     if request.method == 'GET':
-        transacoes = conn.execute('SELECT * FROM transacoes ORDER BY data DESC, id DESC').fetchall()
-        result = [dict(row) for row in transacoes]
-        conn.close()
-        return jsonify(result)
+        condicoes, params = filtros_transacoes(request.args, g.user['id'])
+
+        # Modo streaming: devolve todas as transações filtradas sem montá-las em memória
+        if request.args.get('stream') in ('1', 'true'):
+            cursor = conn.execute(consulta_lista_transacoes(condicoes, limitada=False), params)
+            return current_app.response_class(stream_with_context(gerar_json_transacoes(cursor)), mimetype='application/json')
+
+        limite = request.args.get('limite', current_app.config['TRANSACOES_POR_PAGINA'], type=int)
+        limite = max(1, min(limite, TRANSACOES_POR_PAGINA_MAX))
+
+        # Lido antes da página: uma mudança feita entre as duas consultas
+        # volta na próxima sincronização (aplicá-la de novo não tem efeito)
+        seq = ultimo_seq(conn, g.user['id'])
+
+        # Paginação por cursor (keyset): o cursor é "data,id" da última linha da página anterior
+        pagina_cursor = request.args.get('cursor')
+        if pagina_cursor:
+            try:
+                cursor_data, cursor_id = pagina_cursor.split(',')
+                cursor_id = int(cursor_id)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Cursor de paginação inválido.'})
+            condicoes.append(CONDICAO_CURSOR)
+            params.extend([cursor_data, cursor_id])
+
+        transacoes = conn.execute(consulta_lista_transacoes(condicoes), params + [limite + 1]).fetchall()
+
+        proximo_cursor = None
+        if len(transacoes) > limite:
+            transacoes = transacoes[:limite]
+            proximo_cursor = f"{transacoes[-1]['data']},{transacoes[-1]['id']}"
+
+        return jsonify({
+            'transacoes': [dict(row) for row in transacoes],
+            'proximo_cursor': proximo_cursor,
+            'seq': seq
+        })
     
     elif request.method == 'POST':
+        anexo_filename = None
         try:
             data = request.form
-            anexo_filename = None
             if 'anexo' in request.files:
                 file = request.files['anexo']
                 if file and file.filename and allowed_file(file.filename):
-                    anexo_filename = secure_filename(f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], anexo_filename))
+                    # Abre a transação que grava a referência ao anexo
+                    anexo_filename, _ = anexos.salvar_anexo(conn, file, current_app.config['UPLOAD_FOLDER'])
 
             conn.execute(
-                'INSERT INTO transacoes (descricao, valor, tipo, categoria, data, forma_pagamento, anexo, observacoes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                (data['descricao'], data['valor'], data['tipo'], data['categoria'], data['data'], data.get('forma_pagamento'), anexo_filename, data.get('observacoes'))
+                'INSERT INTO transacoes (user_id, descricao, valor, tipo, categoria, data, forma_pagamento, anexo, observacoes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (g.user['id'], data['descricao'], data['valor'], data['tipo'], data['categoria'], data['data'], data.get('forma_pagamento'), anexo_filename, data.get('observacoes'))
             )
             conn.commit()
-            conn.close()
             return jsonify({'success': True, 'message': 'Transação adicionada com sucesso!'})
         except Exception as e:
-            conn.close()
+            # Um anexo recém-gravado sem transação não fica no disco
+            conn.rollback()
+            if anexo_filename:
+                anexos.liberar_anexos(conn, [anexo_filename], current_app.config['UPLOAD_FOLDER'])
             return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/transacoes/<int:id>', methods=['DELETE'])
+# --- Sincronização incremental (registro de mudanças) ---
+
+def ultimo_seq(conn, user_id):
+    row = conn.execute('SELECT MAX(seq) AS seq FROM mudancas WHERE user_id = ?', (user_id,)).fetchone()
+    return row['seq'] or 0
+
+SQL_MUDANCAS = '''
+    SELECT mudancas.seq, mudancas.transacao_id, mudancas.excluida, transacoes.*
+    FROM mudancas LEFT JOIN transacoes ON transacoes.id = mudancas.transacao_id
+    WHERE mudancas.user_id = ? AND mudancas.seq > ?
+    ORDER BY mudancas.seq LIMIT ?
+'''
+
+@bp.route('/api/transacoes/mudancas')
+@login_required
+def api_mudancas_transacoes():
+    # Transações incluídas ou alteradas e ids excluídos depois de "desde"
+    # (o seq recebido da lista ou da sincronização anterior), em ordem de seq.
+    # Com "mais": true, o cliente repete a chamada a partir do novo seq.
+    conn = get_db()
+    user_id = g.user['id']
+    desde = request.args.get('desde', type=int)
+    if desde is None or desde < 0:
+        return jsonify({'success': False, 'error': 'Informe o seq da última sincronização em "desde".'}), 400
+    limite = max(1, min(request.args.get('limite', TRANSACOES_POR_PAGINA_MAX, type=int), TRANSACOES_POR_PAGINA_MAX))
+
+    # Um seq à frente do banco (ex.: banco restaurado de um snapshot) não
+    # serve de ponto de partida: o cliente recarrega a lista inteira
+    atual = ultimo_seq(conn, user_id)
+    if desde > atual:
+        return jsonify({'recarregar': True, 'seq': atual, 'transacoes': [], 'excluidas': [], 'mais': False})
+
+    linhas = conn.execute(SQL_MUDANCAS, (user_id, desde, limite + 1)).fetchall()
+    mais = len(linhas) > limite
+    linhas = linhas[:limite]
+
+    transacoes, excluidas = [], []
+    for linha in linhas:
+        if linha['excluida']:
+            excluidas.append(linha['transacao_id'])
+        else:
+            transacao = dict(linha)
+            for coluna in ('seq', 'transacao_id', 'excluida'):
+                del transacao[coluna]
+            transacoes.append(transacao)
+    return jsonify({
+        'recarregar': False,
+        'seq': linhas[-1]['seq'] if linhas else desde,
+        'transacoes': transacoes,
+        'excluidas': excluidas,
+        'mais': mais
+    })
+
+def expressao_busca(texto):
+    # Monta a consulta FTS5 a partir do texto digitado: cada palavra vira um
+    # termo entre aspas (sem operadores do FTS5 vindos do usuário) buscado
+    # como prefixo, e todas precisam aparecer
+    palavras = re.findall(r'\w+', texto)
+    if not palavras:
+        return None
+    return ' '.join(f'"{palavra}"*' for palavra in palavras[:10])
+
+def consulta_busca(condicoes):
+    # As correspondências mais recentes da busca (expressao_busca), já com os
+    # filtros de filtros_transacoes; o último parâmetro é quantas
+    return f'''
+        SELECT transacoes.id, busca.rank AS relevancia
+        FROM (SELECT rowid, rank FROM transacoes_busca WHERE transacoes_busca MATCH ?) busca
+        JOIN transacoes ON transacoes.id = busca.rowid
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY busca.rowid DESC LIMIT ?
+    '''
+
+@bp.route('/api/transacoes/busca')
+@login_required
+def api_busca_transacoes():
+    # Busca textual com os mesmos filtros e o mesmo formato de resposta de
+    # /api/transacoes, ordenada por relevância. O cursor é "relevancia,id"
+    # da última linha da página anterior.
+    #
+    # O bm25 custa por linha encontrada; para responder em milissegundos
+    # mesmo com termos que aparecem em boa parte do livro, só as
+    # BUSCA_MAX_RESULTADOS correspondências mais recentes (já com os filtros
+    # aplicados) são ordenadas por relevância. Para chegar às mais antigas,
+    # basta filtrar por período.
+    expressao = expressao_busca(request.args.get('q', ''))
+    if expressao is None:
+        return jsonify({'success': False, 'error': 'Informe o texto da busca.'}), 400
+
+    condicoes, params = filtros_transacoes(request.args, g.user['id'])
+    params = [expressao] + params + [current_app.config['BUSCA_MAX_RESULTADOS']]
+    limite = request.args.get('limite', current_app.config['TRANSACOES_POR_PAGINA'], type=int)
+    limite = max(1, min(limite, TRANSACOES_POR_PAGINA_MAX))
+
+    pagina = ''
+    pagina_cursor = request.args.get('cursor')
+    if pagina_cursor:
+        try:
+            cursor_relevancia, cursor_id = pagina_cursor.split(',')
+            params.extend([float(cursor_relevancia), int(cursor_id)])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Cursor de paginação inválido.'}), 400
+        pagina = 'WHERE (encontradas.relevancia, encontradas.id) > (?, ?)'
+
+    try:
+        transacoes = get_db().execute(f'''
+            SELECT transacoes.*, encontradas.relevancia
+            FROM ({consulta_busca(condicoes)}) encontradas
+            JOIN transacoes ON transacoes.id = encontradas.id
+            {pagina}
+            ORDER BY encontradas.relevancia, encontradas.id LIMIT ?
+        ''', params + [limite + 1]).fetchall()
+    except sqlite3.OperationalError as e:
+        return jsonify({'success': False, 'error': f'Busca inválida: {e}'}), 400
+
+    proximo_cursor = None
+    if len(transacoes) > limite:
+        transacoes = transacoes[:limite]
+        proximo_cursor = f"{transacoes[-1]['relevancia']!r},{transacoes[-1]['id']}"
+
+    return jsonify({
+        'transacoes': [dict(row) for row in transacoes],
+        'proximo_cursor': proximo_cursor
+    })
+
+@bp.route('/api/transacoes/<int:id>', methods=['DELETE'])
 @login_required
 def api_excluir_transacao(id):
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        transacao = conn.execute('SELECT anexo FROM transacoes WHERE id = ?', (id,)).fetchone()
-        if transacao and transacao['anexo']:
-            anexo_path = os.path.join(app.config['UPLOAD_FOLDER'], transacao['anexo'])
-            if os.path.exists(anexo_path):
-                os.remove(anexo_path)
-        
-        conn.execute('DELETE FROM transacoes WHERE id = ?', (id,))
+        # Só apaga transações do próprio usuário
+        transacao = conn.execute('SELECT anexo FROM transacoes WHERE id = ? AND user_id = ?', (id, g.user['id'])).fetchone()
+        if transacao is None:
+            return jsonify({'success': False, 'error': 'Transação não encontrada.'})
+
+        conn.execute('DELETE FROM transacoes WHERE id = ? AND user_id = ?', (id, g.user['id']))
         conn.commit()
-        conn.close()
+
+        # O arquivo só é apagado quando nenhuma outra transação aponta para ele
+        if transacao['anexo']:
+            anexos.liberar_anexos(conn, [transacao['anexo']], current_app.config['UPLOAD_FOLDER'])
         return jsonify({'success': True, 'message': 'Transação excluída com sucesso!'})
     except Exception as e:
-        conn.close()
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/relatorios/saldo')
+# --- Lançamento e exclusão em lote (JSON) ---
+# O lote inteiro é validado antes de qualquer escrita e gravado numa única
+# transação do SQLite: um commit (e um fsync) por lote, não por linha.
+
+def validar_transacao(item):
+    # Devolve (valores, None) prontos para o INSERT ou (None, motivo)
+    if not isinstance(item, dict):
+        return None, 'Cada transação deve ser um objeto JSON.'
+    descricao = str(item.get('descricao') or '').strip()
+    categoria = str(item.get('categoria') or '').strip()
+    tipo = str(item.get('tipo') or '').strip().lower()
+    data = data_valida(item.get('data'))
+    try:
+        valor = round(float(item.get('valor')), 2)
+    except (TypeError, ValueError):
+        valor = None
+    if data is None:
+        return None, 'Data inválida! Use o formato AAAA-MM-DD.'
+    if valor is None or not math.isfinite(valor):
+        return None, 'Valor inválido.'
+    if not descricao:
+        return None, 'Descrição vazia.'
+    if tipo not in ('receita', 'despesa'):
+        return None, 'Tipo deve ser "receita" ou "despesa".'
+    if not categoria:
+        return None, 'Categoria vazia.'
+    return (descricao, valor, tipo, categoria, data, item.get('forma_pagamento') or None, item.get('observacoes') or None), None
+
+def ler_lote(chave):
+    # Lista enviada em {"<chave>": [...]}; devolve (lista, erro)
+    corpo = request.get_json(silent=True)
+    itens = corpo.get(chave) if isinstance(corpo, dict) else None
+    if not isinstance(itens, list) or not itens:
+        return None, f'Envie um JSON com a lista "{chave}".'
+    limite = current_app.config['LOTE_MAX_TRANSACOES']
+    if len(itens) > limite:
+        return None, f'Lote grande demais: no máximo {limite} itens por requisição.'
+    return itens, None
+
+@bp.route('/api/transacoes/lote', methods=['POST'])
 @login_required
-def api_saldo():
-    conn = get_db_connection()
-    receitas = conn.execute('SELECT SUM(valor) as total FROM transacoes WHERE tipo = "receita"').fetchone()['total'] or 0
-    despesas = conn.execute('SELECT SUM(valor) as total FROM transacoes WHERE tipo = "despesa"').fetchone()['total'] or 0
-    saldo = receitas - despesas
-    conn.close()
-    return jsonify({'receitas': receitas, 'despesas': despesas, 'saldo': saldo})
+def api_lancar_lote():
+    itens, erro = ler_lote('transacoes')
+    if erro:
+        return jsonify({'success': False, 'error': erro}), 400
+
+    conn = get_db()
+    user_id = g.user['id']
+    fechados = arquivamento.anos_fechados(conn)
+    linhas, erros = [], []
+    for indice, item in enumerate(itens):
+        valores, motivo = validar_transacao(item)
+        if not motivo and valores[4][:4] in fechados:
+            motivo = f'O ano {valores[4][:4]} já foi fechado e não aceita lançamentos.'
+        if motivo:
+            erros.append({'indice': indice, 'motivo': motivo})
+        else:
+            linhas.append((user_id,) + valores)
+    if erros:
+        return jsonify({'success': False, 'error': 'Nenhuma transação foi gravada: corrija os itens inválidos.', 'erros': erros}), 400
+
+    try:
+        conn.executemany(
+            'INSERT INTO transacoes (user_id, descricao, valor, tipo, categoria, data, forma_pagamento, observacoes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            linhas
+        )
+        # Com AUTOINCREMENT e o lock de escrita desta transação, os ids do
+        # lote são consecutivos e terminam no valor atual da sequência
+        ultimo = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transacoes'").fetchone()['seq']
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+    return jsonify({
+        'success': True,
+        'message': f'{len(linhas)} transações adicionadas com sucesso!',
+        'ids': list(range(ultimo - len(linhas) + 1, ultimo + 1))
+    })
 
-@app.route('/api/relatorios/mensal')
+@bp.route('/api/transacoes/lote', methods=['DELETE'])
 @login_required
-def api_mensal():
-    conn = get_db_connection()
+def api_excluir_lote():
+    itens, erro = ler_lote('ids')
+    if erro:
+        return jsonify({'success': False, 'error': erro}), 400
+    if not all(isinstance(id, int) and not isinstance(id, bool) for id in itens):
+        return jsonify({'success': False, 'error': 'Os ids devem ser números inteiros.'}), 400
+
+    conn = get_db()
+    user_id = g.user['id']
+    ids = sorted(set(itens))
+    # Só apaga transações do próprio usuário; se algum id não for dele (ou
+    # não existir), nada é apagado
+    anexos_lote = {
+        row['id']: row['anexo'] for row in conn.execute(
+            f"SELECT id, anexo FROM transacoes WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))})", [user_id] + ids
+        )
+    }
+    faltando = [id for id in ids if id not in anexos_lote]
+    if faltando:
+        return jsonify({'success': False, 'error': 'Transações não encontradas; nada foi excluído.', 'ids_nao_encontrados': faltando}), 400
+
+    try:
+        conn.executemany('DELETE FROM transacoes WHERE id = ? AND user_id = ?', [(id, user_id) for id in ids])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+
+    anexos.liberar_anexos(conn, anexos_lote.values(), current_app.config['UPLOAD_FOLDER'])
+    return jsonify({'success': True, 'message': f'{len(ids)} transações excluídas com sucesso!', 'excluidas': len(ids)})
+
+SQL_SALDO = 'SELECT tipo, ROUND(SUM(total), 2) as total FROM resumo_mensal WHERE user_id = ? GROUP BY tipo'
+
+def calcular_saldo(conn, user_id):
+    totais = {row['tipo']: row['total'] for row in conn.execute(SQL_SALDO, (user_id,))}
+    receitas = totais.get('receita') or 0
+    despesas = totais.get('despesa') or 0
+    saldo = round(receitas - despesas, 2)
+    return {'receitas': receitas, 'despesas': despesas, 'saldo': saldo}
+
+def calcular_mensal(conn, user_id):
     query = """
         SELECT 
-            strftime('%Y-%m', data) as mes,
-            SUM(CASE WHEN tipo = 'receita' THEN valor ELSE 0 END) as receitas,
-            SUM(CASE WHEN tipo = 'despesa' THEN valor ELSE 0 END) as despesas
-        FROM transacoes
+            mes,
+            ROUND(SUM(CASE WHEN tipo = 'receita' THEN total ELSE 0 END), 2) as receitas,
+            ROUND(SUM(CASE WHEN tipo = 'despesa' THEN total ELSE 0 END), 2) as despesas
+        FROM resumo_mensal
+        WHERE user_id = ?
         GROUP BY mes ORDER BY mes DESC LIMIT 12
     """
-    resultados = conn.execute(query).fetchall()
-    conn.close()
+    resultados = conn.execute(query, (user_id,)).fetchall()
     dados = [dict(row) for row in resultados]
     # Calcula o saldo para cada mês
     for item in dados:
-        item['saldo'] = item['receitas'] - item['despesas']
-    return jsonify(dados[::-1]) # Inverte para ordem cronológica
+        item['saldo'] = round(item['receitas'] - item['despesas'], 2)
+    return dados[::-1] # Inverte para ordem cronológica
+
+def calcular_categorias(conn, user_id):
+    resultados = conn.execute("SELECT tipo, categoria, ROUND(SUM(total), 2) as total FROM resumo_mensal WHERE user_id = ? GROUP BY tipo, categoria ORDER BY total DESC", (user_id,)).fetchall()
+    return {
+        'receitas': [{'categoria': row['categoria'], 'total': row['total']} for row in resultados if row['tipo'] == 'receita'],
+        'despesas': [{'categoria': row['categoria'], 'total': row['total']} for row in resultados if row['tipo'] == 'despesa']
+    }
+
+@bp.route('/api/relatorios/saldo')
+@login_required
+def api_saldo():
+    return jsonify(calcular_saldo(get_db(), g.user['id']))
 
-@app.route('/api/relatorios/categorias')
+@bp.route('/api/relatorios/mensal')
+@login_required
+def api_mensal():
+    return jsonify(calcular_mensal(get_db(), g.user['id']))
+
+@bp.route('/api/relatorios/categorias')
 @login_required
 def api_categorias():
-    conn = get_db_connection()
-    receitas = conn.execute("SELECT categoria, SUM(valor) as total FROM transacoes WHERE tipo = 'receita' GROUP BY categoria ORDER BY total DESC").fetchall()
-    despesas = conn.execute("SELECT categoria, SUM(valor) as total FROM transacoes WHERE tipo = 'despesa' GROUP BY categoria ORDER BY total DESC").fetchall()
-    conn.close()
+    return jsonify(calcular_categorias(get_db(), g.user['id']))
+
+def saldo_em(conn, user_id, dia):
+    # Saldo ao fim do dia: último dia com movimento até ele, pela chave
+    # primária (user_id, dia) de saldo_diario
+    row = conn.execute(
+        'SELECT saldo FROM saldo_diario WHERE user_id = ? AND dia <= ? ORDER BY dia DESC LIMIT 1', (user_id, dia)
+    ).fetchone()
+    return row['saldo'] if row else 0
+
+def data_valida(texto):
+    try:
+        return datetime.strptime(texto, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+@bp.route('/api/relatorios/saldo-acumulado')
+@login_required
+def api_saldo_acumulado():
+    # ?data=AAAA-MM-DD devolve o saldo ao fim daquele dia; sem "data", a
+    # série do saldo acumulado nos dias com movimento entre data_inicio e
+    # data_fim (os dois opcionais), com o saldo anterior ao período
+    conn = get_db()
+    user_id = g.user['id']
+    parametros = {nome: request.args.get(nome) for nome in ('data', 'data_inicio', 'data_fim') if request.args.get(nome)}
+    datas = {nome: data_valida(valor) for nome, valor in parametros.items()}
+    if None in datas.values():
+        return jsonify({'success': False, 'error': 'Data inválida! Use o formato AAAA-MM-DD.'}), 400
+
+    if 'data' in datas:
+        database.atualizar_saldo_diario(conn, user_id, ate=datas['data'])
+        return jsonify({'data': datas['data'], 'saldo': saldo_em(conn, user_id, datas['data'])})
+
+    data_inicio, data_fim = datas.get('data_inicio'), datas.get('data_fim')
+    database.atualizar_saldo_diario(conn, user_id, ate=data_fim)
+    saldo_inicial = 0
+    if data_inicio:
+        anterior = conn.execute(
+            'SELECT saldo FROM saldo_diario WHERE user_id = ? AND dia < ? ORDER BY dia DESC LIMIT 1', (user_id, data_inicio)
+        ).fetchone()
+        saldo_inicial = anterior['saldo'] if anterior else 0
+    serie = [
+        {'data': row['dia'], 'movimento': row['movimento'], 'saldo': row['saldo']}
+        for row in conn.execute(
+            'SELECT dia, movimento, saldo FROM saldo_diario WHERE user_id = ? AND dia BETWEEN ? AND ? ORDER BY dia',
+            (user_id, data_inicio or '', data_fim or '9999-12-31')
+        )
+    ]
     return jsonify({
-        'receitas': [dict(row) for row in receitas],
-        'despesas': [dict(row) for row in despesas]
+        'saldo_inicial': saldo_inicial,
+        'saldo_final': serie[-1]['saldo'] if serie else saldo_inicial,
+        'serie': serie
     })
 
-@app.route('/api/relatorios/detalhado')
+# --- Cache do dashboard (por usuário, invalidado pela versão dos dados dele) ---
+# Guarda o último dashboard de cada usuário, em LRU limitado a DASHBOARD_CACHE_MAX.
+# Acertos e falhas vão para o /metrics (livro_caixa_dashboard_cache_total).
+DASHBOARD_CACHE_MAX = 256
+dashboard_cache = OrderedDict()
+dashboard_cache_lock = threading.Lock()
+
+@bp.route('/api/dashboard')
+@login_required
+def api_dashboard():
+    conn = get_db()
+    user_id = g.user['id']
+    versao = database.data_version(conn, user_id)
+
+    with dashboard_cache_lock:
+        em_cache = dashboard_cache.get(user_id)
+        if em_cache and em_cache['versao'] == versao:
+            dashboard_cache.move_to_end(user_id)
+            corpo, etag, status_cache = em_cache['corpo'], em_cache['etag'], 'HIT'
+        else:
+            corpo = None
+
+    if corpo is None:
+        payload = {
+            'versao': versao,
+            'saldo': calcular_saldo(conn, user_id),
+            'mensal': calcular_mensal(conn, user_id),
+            'categorias': calcular_categorias(conn, user_id)
+        }
+        corpo = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        etag = hashlib.sha256(corpo).hexdigest()[:32]
+        status_cache = 'MISS'
+        with dashboard_cache_lock:
+            dashboard_cache[user_id] = {'versao': versao, 'corpo': corpo, 'etag': etag}
+            dashboard_cache.move_to_end(user_id)
+            while len(dashboard_cache) > DASHBOARD_CACHE_MAX:
+                dashboard_cache.popitem(last=False)
+
+    metricas.incrementar('livro_caixa_dashboard_cache_total', resultado=status_cache.lower())
+    response = current_app.response_class(corpo, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['X-Cache'] = status_cache
+    return response.make_conditional(request)
+
+def consulta_relatorio_detalhado(user_id, data_inicio, data_fim, tipo, tabela='transacoes'):
+    query = f'SELECT * FROM {tabela} WHERE user_id = ? AND data BETWEEN ? AND ?'
+    params = [user_id, data_inicio, data_fim]
+
+    if tipo != 'todos':
+        query += ' AND tipo = ?'
+        params.append(tipo)
+
+    query += ' ORDER BY data DESC, id DESC'
+    return query, params
+
+@bp.route('/api/relatorios/detalhado')
 @login_required
 def api_relatorio_detalhado():
     data_inicio = request.args.get('data_inicio')
     data_fim = request.args.get('data_fim')
     tipo = request.args.get('tipo', 'todos')
     
-    conn = get_db_connection()
-    
-    query = 'SELECT * FROM transacoes WHERE data BETWEEN ? AND ?'
-    params = [data_inicio, data_fim]
-    
-    if tipo != 'todos':
-        query += ' AND tipo = ?'
-        params.append(tipo)
+    conn = get_db()
     
-    query += ' ORDER BY data DESC, id DESC'
+    # Períodos que tocam anos fechados leem também as linhas do arquivo
+    fonte = arquivamento.fonte_transacoes(conn, data_inicio, data_fim)
+    query, params = consulta_relatorio_detalhado(g.user['id'], data_inicio, data_fim, tipo, fonte)
     transacoes = conn.execute(query, params).fetchall()
     
-    totais_query = 'SELECT tipo, COUNT(*) as quantidade, SUM(valor) as total FROM transacoes WHERE data BETWEEN ? AND ? GROUP BY tipo'
-    totais_params = [data_inicio, data_fim]
-    
-    totais_result = conn.execute(totais_query, totais_params).fetchall()
-    
-    totais = {'receita': {'quantidade': 0, 'total': 0}, 'despesa': {'quantidade': 0, 'total': 0}}
-    for row in totais_result:
-        totais[row['tipo']] = {'quantidade': row['quantidade'], 'total': row['total'] or 0}
-    
-    conn.close()
+    totais = arquivamento.totais_por_tipo(conn, g.user['id'], data_inicio, data_fim)
     
     return jsonify({
         'transacoes': [dict(t) for t in transacoes],
         'totais': totais
     })
 
-@app.route('/relatorio/pdf')
+@bp.route('/relatorio/export')
 @login_required
-def relatorio_pdf():
+def relatorio_export():
+    # Exporta as transações do relatório em CSV (opcionalmente com gzip) ou
+    # XLSX, lendo o cursor aos pedaços: a memória usada não depende do número
+    # de linhas
     data_inicio = request.args.get('data_inicio')
     data_fim = request.args.get('data_fim')
     tipo = request.args.get('tipo', 'todos')
-    
-    conn = get_db_connection()
-    
-    query = 'SELECT data, descricao, categoria, tipo, valor FROM transacoes WHERE data BETWEEN ? AND ?'
-    params = [data_inicio, data_fim]
-    
-    if tipo != 'todos':
-        query += ' AND tipo = ?'
-        params.append(tipo)
-    
-    query += ' ORDER BY data DESC'
-    transacoes = conn.execute(query, params).fetchall()
-    
-    # Calcula totais para o período
-    totais_query = "SELECT tipo, SUM(valor) as total FROM transacoes WHERE data BETWEEN ? AND ? GROUP BY tipo"
-    totais_result = conn.execute(totais_query, (data_inicio, data_fim)).fetchall()
-
-    receitas = 0
-    despesas = 0
-    for row in totais_result:
-        if row['tipo'] == 'receita':
-            receitas = row['total'] or 0
-        elif row['tipo'] == 'despesa':
-            despesas = row['total'] or 0
-    saldo = receitas - despesas
-    conn.close()
-    
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=30)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('CustomTitle', parent=styles['h1'], alignment=1, spaceAfter=20)
-    
-    elements.append(Paragraph(f'Relatório Financeiro', title_style))
-    elements.append(Paragraph(f"<b>Período:</b> {datetime.strptime(data_inicio, '%Y-%m-%d').strftime('%d/%m/%Y')} a {datetime.strptime(data_fim, '%Y-%m-%d').strftime('%d/%m/%Y')}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Tipo:</b> {tipo.capitalize()}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Tabela de Resumo
-    resumo_data = [
-        ['Total de Receitas:', f'R$ {receitas:,.2f}'],
-        ['Total de Despesas:', f'R$ {despesas:,.2f}'],
-        ['Saldo do Período:', f'R$ {saldo:,.2f}']
-    ]
-    resumo_table = Table(resumo_data, colWidths=['*', 120])
-    resumo_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BACKGROUND', (0, 0), (0, 0), colors.Color(0.2, 0.4, 0.6)), # Azul para Receita
-        ('BACKGROUND', (0, 1), (0, 1), colors.Color(0.8, 0.2, 0.2)), # Vermelho para Despesa
-        ('BACKGROUND', (0, 2), (0, 2), colors.Color(0.5, 0.5, 0.5)), # Cinza para Saldo
-        ('TEXTCOLOR', (0,0), (0,2), colors.white),
-    ]))
-    elements.append(resumo_table)
-    elements.append(Spacer(1, 20))
-    
-    if transacoes:
-        table_header = ['Data', 'Descrição', 'Categoria', 'Tipo', 'Valor (R$)']
-        table_data = [table_header] + [[datetime.strptime(t['data'], '%Y-%m-%d').strftime('%d/%m/%Y'), t['descricao'], t['categoria'], t['tipo'].capitalize(), f"{t['valor']:,.2f}"] for t in transacoes]
-        
-        transacoes_table = Table(table_data, colWidths=[60, '*', 100, 60, 80])
-        transacoes_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ALIGN', (-1, 1), (-1, -1), 'RIGHT'), # Alinha a coluna de valor à direita
-        ]))
-        elements.append(transacoes_table)
+    formato = request.args.get('formato', 'csv')
+    compactar = request.args.get('gzip') in ('1', 'true')
+
+    if not data_inicio or not data_fim:
+        return jsonify({'success': False, 'error': 'Informe o período do relatório.'}), 400
+    if formato not in ('csv', 'xlsx'):
+        return jsonify({'success': False, 'error': 'Formato inválido! Use csv ou xlsx.'}), 400
+
+    conn = get_db()
+    fonte = arquivamento.fonte_transacoes(conn, data_inicio, data_fim)
+    query, params = exportacao.consulta(g.user['id'], data_inicio, data_fim, tipo, fonte)
+    cursor = conn.execute(query, params)
+    nome = f'transacoes_{data_inicio}_a_{data_fim}'
+
+    if formato == 'xlsx':
+        response = current_app.response_class(
+            exportacao.gerar_xlsx(cursor),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename={nome}.xlsx'
+        return response
+
+    pedacos = stream_with_context(exportacao.gerar_csv(cursor))
+    if compactar:
+        response = current_app.response_class(exportacao.comprimir(pedacos), mimetype='application/gzip')
+        response.headers['Content-Disposition'] = f'attachment; filename={nome}.csv.gz'
     else:
-        elements.append(Paragraph('Nenhuma transação encontrada para o período.', styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=relatorio_{data_inicio}_a_{data_fim}.pdf'
-    
+        response = current_app.response_class(pedacos, mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={nome}.csv'
     return response
 
+def filtros_relatorio_pdf(args):
+    return args.get('data_inicio'), args.get('data_fim'), args.get('tipo', 'todos')
+
+def enviar_pdf(caminho, data_inicio, data_fim):
+    return send_from_directory(
+        os.path.abspath(os.path.dirname(caminho)), os.path.basename(caminho), mimetype='application/pdf',
+        download_name=f'relatorio_{data_inicio}_a_{data_fim}.pdf'
+    )
+
+def preparar_relatorio_pdf(conn, user_id, data_inicio, data_fim, tipo):
+    # Devolve o status do PDF: 'concluido' com o caminho no cache quando ele
+    # já existe (ou é pequeno e foi gerado agora), ou o status do job de fundo
+    # disparado para um período com muitas transações.
+    pasta = current_app.config['RELATORIOS_CACHE']
+    chave = relatorios_pdf.chave_cache(conn, user_id, data_inicio, data_fim, tipo)
+    caminho = relatorios_pdf.caminho_cache(pasta, chave)
+    if os.path.exists(caminho):
+        # A chave vem do id de quem pediu; PDFs de antes da migração 14 ganham dono aqui
+        if relatorios_pdf.obter_geracao(conn, chave, user_id) is None:
+            relatorios_pdf.registrar_concluido(conn, chave, user_id, None)
+        return {'chave': chave, 'status': 'concluido', 'caminho': caminho}
+
+    linhas = relatorios_pdf.contar_transacoes(conn, user_id, data_inicio, data_fim, tipo)
+    if linhas <= current_app.config['RELATORIO_PDF_LIMITE_SINCRONO']:
+        caminho = relatorios_pdf.salvar_no_cache(conn, pasta, chave, user_id, data_inicio, data_fim, tipo)
+        relatorios_pdf.registrar_concluido(conn, chave, user_id, linhas)
+        return {'chave': chave, 'status': 'concluido', 'caminho': caminho}
+
+    if relatorios_pdf.iniciar_geracao(conn, chave, user_id, linhas, caminho):
+        argumentos = (current_app.config['DATABASE'], pasta, chave, user_id, data_inicio, data_fim, tipo)
+        threading.Thread(target=relatorios_pdf.executar_geracao, args=argumentos, daemon=True).start()
+    geracao = relatorios_pdf.obter_geracao(conn, chave, user_id)
+    return {
+        'chave': chave, 'status': geracao['status'], 'erro': geracao['erro'], 'linhas': geracao['linhas'],
+        'caminho': caminho
+    }
+
+@bp.route('/relatorio/pdf')
+@login_required
+def relatorio_pdf():
+    data_inicio, data_fim, tipo = filtros_relatorio_pdf(request.args)
+    relatorio = preparar_relatorio_pdf(get_db(), g.user['id'], data_inicio, data_fim, tipo)
+
+    # O PDF pode ter saído do cache entre a consulta e o envio
+    if relatorio['status'] == 'concluido' and os.path.exists(relatorio['caminho']):
+        return enviar_pdf(relatorio['caminho'], data_inicio, data_fim)
+    if relatorio['status'] == 'concluido':
+        flash('O relatório saiu do cache; peça o PDF de novo.', 'warning')
+    elif relatorio['status'] == 'erro':
+        flash(f"Erro ao gerar o relatório: {relatorio['erro']}", 'danger')
+    else:
+        flash(f"O relatório tem {relatorio['linhas']} transações e está sendo gerado em segundo plano. "
+              'Use "Exportar PDF" na página de relatórios para baixá-lo quando estiver pronto.', 'info')
+    return redirect(url_for('main.relatorios'))
+
+@bp.route('/api/relatorios/pdf', methods=['POST'])
+@login_required
+def api_relatorio_pdf():
+    # Prepara o PDF (do cache, na hora ou em segundo plano); o cliente repete
+    # a chamada até o status ser 'concluido' e então baixa pela url
+    data_inicio, data_fim, tipo = filtros_relatorio_pdf(request.form or request.get_json(silent=True) or {})
+    if not data_inicio or not data_fim:
+        return jsonify({'success': False, 'error': 'Informe o período do relatório.'})
+
+    try:
+        relatorio = preparar_relatorio_pdf(get_db(), g.user['id'], data_inicio, data_fim, tipo)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Erro ao gerar o relatório: {str(e)}'})
+
+    if relatorio['status'] == 'erro':
+        return jsonify({'success': False, 'error': f"Erro ao gerar o relatório: {relatorio['erro']}"})
+
+    resposta = {'success': True, 'status': relatorio['status'], 'linhas': relatorio.get('linhas')}
+    if relatorio['status'] == 'concluido':
+        resposta['url'] = url_for('main.baixar_relatorio_pdf', chave=relatorio['chave'], data_inicio=data_inicio, data_fim=data_fim)
+    return jsonify(resposta)
+
+@bp.route('/relatorio/pdf/<chave>')
+@login_required
+def baixar_relatorio_pdf(chave):
+    # Só o dono baixa o relatório: a chave sozinha não dá acesso
+    chave = secure_filename(chave)
+    if relatorios_pdf.obter_geracao(get_db(), chave, g.user['id']) is None:
+        abort(404)
+    caminho = relatorios_pdf.caminho_cache(current_app.config['RELATORIOS_CACHE'], chave)
+    if not os.path.exists(caminho):
+        flash('O relatório expirou; gere-o novamente.', 'warning')
+        return redirect(url_for('main.relatorios'))
+    return enviar_pdf(caminho, request.args.get('data_inicio'), request.args.get('data_fim'))
+
 # ROTA DE IMPORTAÇÃO CORRIGIDA E ROBUSTA
-@app.route('/importar_planilha', methods=['POST'])
+@bp.route('/importar_planilha', methods=['POST'])
 @login_required
 def importar_planilha():
+    # Clientes que aceitam JSON (a página de lançamentos) recebem o id da
+    # importação na hora e acompanham o progresso em /api/importacoes/<id>;
+    # um envio de formulário comum espera o fim e recebe a mensagem via flash.
+    responder_json = request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html
+
+    def erro(mensagem):
+        if responder_json:
+            return jsonify({'success': False, 'error': mensagem})
+        flash(mensagem, 'danger')
+        return redirect(url_for('main.lancamentos'))
+
     if 'planilha' not in request.files:
-        flash('Nenhum arquivo selecionado!', 'danger')
-        return redirect(url_for('lancamentos'))
+        return erro('Nenhum arquivo selecionado!')
 
     file = request.files['planilha']
 
-    if file.filename == '' or not file.filename.endswith('.xlsx'):
-        flash('Arquivo inválido! Por favor, envie um arquivo .xlsx.', 'danger')
-        return redirect(url_for('lancamentos'))
+    if file.filename == '' or not importacao.extensao_permitida(file.filename):
+        return erro('Arquivo inválido! Por favor, envie um arquivo .xlsx, .csv ou .csv.gz.')
 
     try:
-        df = pd.read_excel(file, dtype={'Valor': float})
+        # O arquivo vai para o disco em vez de ficar em memória; a leitura é feita em lotes
+        nome = secure_filename(file.filename) or 'planilha.xlsx'
+        descritor, caminho = tempfile.mkstemp(suffix=f'_{nome}')
+        with os.fdopen(descritor, 'wb') as destino:
+            shutil.copyfileobj(file.stream, destino)
 
-        colunas_obrigatorias = ['Data', 'Descricao', 'Valor', 'Tipo', 'Categoria']
-        for coluna in colunas_obrigatorias:
-            if coluna not in df.columns:
-                flash(f'A coluna obrigatória "{coluna}" não foi encontrada na planilha.', 'danger')
-                return redirect(url_for('lancamentos'))
+        importacao_id = uuid.uuid4().hex
+        importacao.criar_importacao(get_db(), importacao_id, nome, g.user['id'])
+        argumentos = (current_app.config['DATABASE'], g.user['id'], importacao_id, caminho, nome)
 
-        conn = get_db_connection()
-        transacoes_importadas = 0
-        transacoes_ignoradas = 0
+        if responder_json:
+            threading.Thread(target=importacao.executar_importacao, args=argumentos, daemon=True).start()
+            return jsonify({'success': True, 'id': importacao_id})
 
-        for index, row in df.iterrows():
-            try:
-                # Validação e limpeza dos dados de cada linha
-                data = pd.to_datetime(row['Data']).strftime('%Y-%m-%d')
-                descricao = str(row['Descricao']).strip()
-                valor = round(float(row['Valor']), 2)
-                tipo = str(row['Tipo']).lower().strip()
-                categoria = str(row['Categoria']).strip()
-
-                if tipo not in ['receita', 'despesa']:
-                    transacoes_ignoradas += 1
-                    continue
-
-                # VERIFICA SE JÁ EXISTE UMA TRANSAÇÃO IDÊNTICA
-                existe = conn.execute(
-                    'SELECT id FROM transacoes WHERE data = ? AND descricao = ? AND valor = ? AND tipo = ?',
-                    (data, descricao, valor, tipo)
-                ).fetchone()
-
-                if existe:
-                    transacoes_ignoradas += 1
-                    continue # Pula para a próxima linha se a transação já existir
-
-                # INSERE A NOVA TRANSAÇÃO
-                conn.execute(
-                    'INSERT INTO transacoes (data, descricao, valor, tipo, categoria) VALUES (?, ?, ?, ?, ?)',
-                    (data, descricao, valor, tipo, categoria)
-                )
-                transacoes_importadas += 1
-            
-            except (ValueError, TypeError, KeyError):
-                # Se uma linha tiver dados inválidos (ex: texto em 'Valor', coluna faltando), ignora e continua
-                transacoes_ignoradas += 1
-                continue
+        importacao.executar_importacao(*argumentos)
+        resultado = importacao.obter_importacao(get_db(), importacao_id, g.user['id'])
+        if resultado['status'] == 'erro':
+            return erro(f"Ocorreu um erro ao processar a planilha: {resultado['erro']}")
 
-        conn.commit()
-        conn.close()
-        
+        transacoes_importadas = resultado['importadas']
         mensagem = f'{transacoes_importadas} transações importadas com sucesso!'
-        if transacoes_ignoradas > 0:
-            mensagem += f' {transacoes_ignoradas} foram ignoradas por já existirem ou conterem dados inválidos.'
+        if resultado['rejeitadas']:
+            mensagem += f" {resultado['rejeitadas']} foram ignoradas por já existirem ou conterem dados inválidos:"
+            mensagem += ' ' + '; '.join(f"linha {r['linha']}: {r['motivo']}" for r in resultado['relatorio'][:10])
+            if resultado['rejeitadas'] > 10:
+                mensagem += f" (e mais {resultado['rejeitadas'] - 10})."
         
         flash(mensagem, 'success' if transacoes_importadas > 0 else 'warning')
 
     except Exception as e:
-        flash(f'Ocorreu um erro ao processar a planilha: {e}', 'danger')
+        return erro(f'Ocorreu um erro ao processar a planilha: {e}')
 
-    return redirect(url_for('lancamentos'))
+    return redirect(url_for('main.lancamentos'))
+
+@bp.route('/api/importacoes/<importacao_id>')
+@login_required
+def api_importacao(importacao_id):
+    resultado = importacao.obter_importacao(get_db(), importacao_id, g.user['id'])
+    if resultado is None:
+        return jsonify({'success': False, 'error': 'Importação não encontrada.'})
+    return jsonify({'success': True, **resultado})
 
 
 # --- Inicialização ---
 
+# Servidor de desenvolvimento (um processo, com reloader). Em produção, no
+# Linux, use o gunicorn com wsgi.py e gunicorn.conf.py.
 if __name__ == '__main__':
     print("Iniciando Livro Caixa Financeiro...")
-    init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app = create_app()
+    with app.app_context():
+        init_db()
+    # Com debug=True o reloader roda o app num processo filho; só ele agenda
+    if app.config['BACKUP_INTERVALO'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        backups.iniciar_agendamento(app.config['DATABASE'], app.config['BACKUP_PASTA'],
+                                    app.config['BACKUP_MANTER'], app.config['BACKUP_INTERVALO'])
+    app.run(debug=True, host='0.0.0.0', port=5000)
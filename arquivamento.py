@@ -0,0 +1,229 @@
+import os
+import re
+from datetime import date
+
+import database
+
+# Fechamento de ano: as transações de um ano encerrado saem do banco
+# principal (quente) para um banco de arquivo (frio), e o banco principal
+# guarda só os totais já calculados daquele ano (resumo_arquivado, por mês e
+# categoria, e totais_arquivados, por dia e tipo). Dashboard, saldo
+# acumulado e totais dos relatórios leem esses totais; o arquivo só é
+# anexado (ATTACH) quando um relatório precisa das linhas de um ano fechado.
+#
+# Caminhos relativos do arquivo são relativos à pasta do banco principal.
+
+# Quantas vezes repetir a cópia se o ano receber alterações no meio dela
+TENTATIVAS_FECHAMENTO = 3
+
+def intervalo_ano(ano):
+    # Datas do ano: [AAAA-01-01, AAAA+1-01-01). Os limites são datas
+    # completas porque transacoes.data é DATE (afinidade numérica): um "2021"
+    # sozinho viraria o inteiro 2021 na comparação.
+    return f'{ano}-01-01', f'{int(ano) + 1}-01-01'
+
+def resolver_arquivo(caminho_db, arquivo):
+    if os.path.isabs(arquivo):
+        return arquivo
+    return os.path.join(os.path.dirname(os.path.abspath(caminho_db)), arquivo)
+
+def caminho_arquivo(conn, arquivo):
+    principal = next(row['file'] for row in conn.execute('PRAGMA database_list') if row['name'] == 'main')
+    return resolver_arquivo(principal, arquivo)
+
+def arquivos_fechados(conn):
+    # Bancos de arquivo citados em anos_fechados, como gravados (relativos à
+    # pasta do banco principal); vazio num banco de antes da migração 13
+    existe = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'anos_fechados'").fetchone()
+    if existe is None:
+        return []
+    return [row[0] for row in conn.execute('SELECT DISTINCT arquivo FROM anos_fechados ORDER BY arquivo')]
+
+def anexar(conn, arquivo, criar=False):
+    # Anexa o banco de arquivo à conexão (uma vez só) e devolve o nome do esquema
+    caminho = os.path.abspath(caminho_arquivo(conn, arquivo))
+    anexados = {row['file']: row['name'] for row in conn.execute('PRAGMA database_list')}
+    if caminho in anexados:
+        return anexados[caminho]
+    if not criar and not os.path.exists(caminho):
+        raise FileNotFoundError(f'Banco de arquivo não encontrado: {caminho}')
+    esquema = f'arquivo_{len(anexados)}'
+    conn.execute(f"ATTACH DATABASE ? AS {esquema}", (caminho,))
+    return esquema
+
+def colunas_transacoes(conn, esquema='main'):
+    return [row['name'] for row in conn.execute(f'PRAGMA {esquema}.table_info(transacoes)')]
+
+def selecionar_colunas(conn, esquema, colunas):
+    # Colunas acrescentadas ao banco principal depois do fechamento vêm
+    # como NULL das linhas arquivadas
+    existentes = set(colunas_transacoes(conn, esquema))
+    return ', '.join(coluna if coluna in existentes else f'NULL AS {coluna}' for coluna in colunas)
+
+def fonte_transacoes(conn, data_inicio, data_fim):
+    # Expressão para o FROM das consultas de relatório: "transacoes" quando o
+    # período não toca nenhum ano fechado; senão a união com as linhas
+    # arquivadas. Os filtros do WHERE externo são levados pelo SQLite para
+    # dentro de cada lado da união (e usam os índices de cada banco).
+    arquivos = [
+        row['arquivo'] for row in conn.execute(
+            'SELECT DISTINCT arquivo FROM anos_fechados WHERE ano BETWEEN substr(?, 1, 4) AND substr(?, 1, 4)',
+            (data_inicio or '0000', data_fim or '9999')
+        )
+    ]
+    if not arquivos:
+        return 'transacoes'
+    colunas = colunas_transacoes(conn)
+    partes = [f"SELECT {', '.join(colunas)} FROM main.transacoes"]
+    for arquivo in arquivos:
+        esquema = anexar(conn, arquivo)
+        partes.append(f'SELECT {selecionar_colunas(conn, esquema, colunas)} FROM {esquema}.transacoes')
+    return f"({' UNION ALL '.join(partes)})"
+
+# Quantidade e total por tipo no período, somando as transações do banco
+# principal com os totais diários dos anos fechados (sem anexar o arquivo)
+SQL_TOTAIS_POR_TIPO = '''
+    SELECT tipo, SUM(quantidade) AS quantidade, ROUND(SUM(total), 2) AS total FROM (
+        SELECT tipo, COUNT(*) AS quantidade, SUM(valor) AS total
+        FROM transacoes WHERE user_id = ? AND data BETWEEN ? AND ? GROUP BY tipo
+        UNION ALL
+        SELECT tipo, quantidade, total FROM totais_arquivados WHERE user_id = ? AND dia BETWEEN ? AND ?
+    ) GROUP BY tipo
+'''
+
+def totais_por_tipo(conn, user_id, data_inicio, data_fim):
+    totais = {'receita': {'quantidade': 0, 'total': 0}, 'despesa': {'quantidade': 0, 'total': 0}}
+    for row in conn.execute(SQL_TOTAIS_POR_TIPO, (user_id, data_inicio, data_fim, user_id, data_inicio, data_fim)):
+        totais[row['tipo']] = {'quantidade': row['quantidade'], 'total': row['total'] or 0}
+    return totais
+
+def anos_fechados(conn):
+    return {row['ano'] for row in conn.execute('SELECT ano FROM anos_fechados')}
+
+# --- Fechamento ---
+
+def preparar_arquivo(conn, esquema):
+    # A tabela do arquivo tem as mesmas colunas de transacoes, sem triggers;
+    # colunas novas do banco principal são acrescentadas a cada fechamento
+    colunas = colunas_transacoes(conn)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {esquema}.transacoes AS SELECT * FROM main.transacoes WHERE 0')
+    existentes = set(colunas_transacoes(conn, esquema))
+    for coluna in colunas:
+        if coluna not in existentes:
+            conn.execute(f'ALTER TABLE {esquema}.transacoes ADD COLUMN {coluna}')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {esquema}.idx_arquivo_id ON transacoes (id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {esquema}.idx_arquivo_usuario_data ON transacoes (user_id, data, id)')
+    conn.commit()
+    return colunas
+
+def copiar_para_arquivo(conn, esquema, colunas, ano):
+    # Transação só no arquivo: refaz a cópia do ano do zero (descarta o que
+    # sobrou de uma tentativa interrompida, ainda não valendo como fechada)
+    inicio, fim = intervalo_ano(ano)
+    lista = ', '.join(colunas)
+    conn.execute(f'DELETE FROM {esquema}.transacoes WHERE data >= ? AND data < ?', (inicio, fim))
+    conn.execute(f'''
+        INSERT INTO {esquema}.transacoes ({lista})
+        SELECT {lista} FROM main.transacoes WHERE data >= ? AND data < ?
+    ''', (inicio, fim))
+    conn.commit()
+
+def copia_confere(conn, esquema, colunas, ano):
+    inicio, fim = intervalo_ano(ano)
+    lista = ', '.join(colunas)
+    filtro = 'WHERE data >= ? AND data < ?'
+    quantidade_principal = conn.execute(f'SELECT COUNT(*) FROM main.transacoes {filtro}', (inicio, fim)).fetchone()[0]
+    quantidade_arquivo = conn.execute(f'SELECT COUNT(*) FROM {esquema}.transacoes {filtro}', (inicio, fim)).fetchone()[0]
+    diferentes = conn.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT {lista} FROM main.transacoes {filtro}
+            EXCEPT
+            SELECT {lista} FROM {esquema}.transacoes {filtro}
+        )
+    ''', (inicio, fim, inicio, fim)).fetchone()[0]
+    return quantidade_principal == quantidade_arquivo and diferentes == 0, quantidade_principal
+
+def mover_ano(conn, esquema, ano, arquivo, quantidade):
+    # Dentro da transação do banco principal: guarda os totais do ano, apaga
+    # as linhas (os triggers descontam resumo_mensal, saldo_diario, anexos,
+    # busca) e repõe os totais do ano a partir dos arquivados
+    inicio, fim = intervalo_ano(ano)
+    periodo = (inicio, fim)
+    usuario = database.USUARIO_RESUMO.format(linha='')
+    conn.execute(f'''
+        INSERT INTO resumo_arquivado (user_id, mes, tipo, categoria, quantidade, total)
+        SELECT {usuario}, {database.MES_RESUMO.format(data='data')} AS mes, tipo, categoria, COUNT(*), ROUND(SUM(valor), 2)
+        FROM main.transacoes WHERE data >= ? AND data < ? GROUP BY 1, mes, tipo, categoria
+    ''', periodo)
+    conn.execute(f'''
+        INSERT INTO totais_arquivados (user_id, dia, tipo, quantidade, total)
+        SELECT {usuario}, {database.DIA_SALDO.format(data='data')} AS dia, tipo, COUNT(*), ROUND(SUM(valor), 2)
+        FROM main.transacoes WHERE data >= ? AND data < ? GROUP BY 1, dia, tipo
+    ''', periodo)
+
+    conn.execute('DELETE FROM main.transacoes WHERE data >= ? AND data < ?', periodo)
+
+    meses = (inicio[:7], fim[:7])
+    conn.execute('DELETE FROM resumo_mensal WHERE mes >= ? AND mes < ?', meses)
+    conn.execute('''
+        INSERT INTO resumo_mensal (user_id, mes, tipo, categoria, quantidade, total)
+        SELECT user_id, mes, tipo, categoria, quantidade, total FROM resumo_arquivado WHERE mes >= ? AND mes < ?
+    ''', meses)
+    # O saldo acumulado desses dias já está marcado para recálculo em
+    # saldo_pendente pelos triggers de exclusão
+    conn.execute('DELETE FROM saldo_diario WHERE dia >= ? AND dia < ?', periodo)
+    conn.execute(f'''
+        INSERT INTO saldo_diario (user_id, dia, quantidade, movimento)
+        SELECT user_id, dia, SUM(quantidade), ROUND(SUM({database.MOVIMENTO_ARQUIVADO}), 2)
+        FROM totais_arquivados WHERE dia >= ? AND dia < ? GROUP BY user_id, dia
+    ''', periodo)
+    # As transações arquivadas continuam usando os seus anexos
+    conn.execute(f'''
+        INSERT INTO anexos (arquivo, referencias)
+        SELECT anexo, COUNT(*) FROM {esquema}.transacoes WHERE data >= ? AND data < ? AND anexo IS NOT NULL GROUP BY anexo
+        ON CONFLICT (arquivo) DO UPDATE SET referencias = referencias + excluded.referencias
+    ''', periodo)
+
+    conn.execute('INSERT INTO anos_fechados (ano, arquivo, quantidade) VALUES (?, ?, ?)', (ano, arquivo, quantidade))
+
+def fechar_ano(conn, ano, arquivo, compactar=True):
+    # Devolve quantas transações foram arquivadas. Com o banco principal em
+    # WAL, uma transação que escreve nos dois bancos não é atômica entre
+    # eles; por isso o arquivo é gravado (e confirmado) primeiro e só depois,
+    # numa transação do banco principal que confere a cópia, as linhas saem
+    # dele. Uma interrupção no meio deixa o ano aberto, com as linhas ainda
+    # no banco principal.
+    ano = str(ano)
+    if not re.fullmatch(r'\d{4}', ano):
+        raise ValueError('Informe o ano com quatro dígitos.')
+    if int(ano) >= date.today().year:
+        raise ValueError(f'{ano} ainda não terminou; só anos encerrados podem ser fechados.')
+    if ano in anos_fechados(conn):
+        raise ValueError(f'{ano} já está fechado.')
+
+    esquema = anexar(conn, arquivo, criar=True)
+    colunas = preparar_arquivo(conn, esquema)
+    for _ in range(TENTATIVAS_FECHAMENTO):
+        copiar_para_arquivo(conn, esquema, colunas, ano)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            confere, quantidade = copia_confere(conn, esquema, colunas, ano)
+            if not confere:
+                # Alguém alterou o ano entre a cópia e o lock: copia de novo
+                conn.rollback()
+                continue
+            mover_ano(conn, esquema, ano, arquivo, quantidade)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        break
+    else:
+        raise RuntimeError(f'As transações de {ano} mudaram durante o fechamento; tente de novo.')
+
+    conn.execute(f'DETACH DATABASE {esquema}')
+    if compactar:
+        # Devolve ao sistema as páginas liberadas: o banco principal (e os
+        # snapshots feitos dele) encolhem de fato
+        conn.execute('VACUUM')
+    return quantidade
@@ -0,0 +1,405 @@
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from datetime import datetime
+
+import arquivamento
+import database
+
+# A cópia é feita em passos de PAGINAS_POR_PASSO páginas, com uma pausa entre
+# eles: quem escreve no banco consegue o lock entre um passo e outro em vez
+# de esperar a cópia inteira terminar
+PAGINAS_POR_PASSO = 256
+PAUSA_ENTRE_PASSOS = 0.005
+
+# Uma escrita de outra conexão no meio da cópia faz o SQLite recomeçá-la do
+# zero. Depois de tantos recomeços a cópia é feita num passo só: em WAL isso
+# é uma única transação de leitura, que também não bloqueia quem escreve.
+MAX_RECOMECOS = 5
+
+# Pedaços lidos da cópia ao comprimi-la
+TAMANHO_PEDACO = 256 * 1024
+
+PREFIXO_SNAPSHOT = 'livro_caixa_'
+EXTENSAO_SNAPSHOT = '.db.gz'
+
+# --- Cópia consistente ---
+
+class CopiaRecomecada(Exception):
+    pass
+
+def contar_recomecos():
+    # Callback de progresso do backup: as páginas restantes só aumentam
+    # quando a cópia recomeçou
+    estado = {'restantes': None, 'recomecos': 0}
+
+    def progresso(status, restantes, total):
+        if estado['restantes'] is not None and restantes > estado['restantes']:
+            estado['recomecos'] += 1
+            if estado['recomecos'] > MAX_RECOMECOS:
+                raise CopiaRecomecada()
+        estado['restantes'] = restantes
+
+    return progresso
+
+def copiar_banco(caminho_db, destino):
+    # sqlite3.Connection.backup lê um instantâneo consistente do banco, com o
+    # que estiver no WAL, mesmo com outras conexões escrevendo. Um banco que
+    # sumiu (ex.: o de arquivo) é erro, não uma cópia vazia.
+    if not os.path.exists(caminho_db):
+        raise FileNotFoundError(f'Banco não encontrado: {caminho_db}')
+    origem = database.connect(caminho_db)
+    copia = sqlite3.connect(destino)
+    try:
+        try:
+            origem.backup(copia, pages=PAGINAS_POR_PASSO, progress=contar_recomecos(), sleep=PAUSA_ENTRE_PASSOS)
+        except CopiaRecomecada:
+            origem.backup(copia, pages=-1)
+        # A cópia herda o modo WAL do original; como arquivo avulso ela deve
+        # ser autossuficiente, sem depender de um -wal ao lado
+        copia.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        copia.close()
+        origem.close()
+
+def copiar_para_temporario(caminho_db):
+    descritor, destino = tempfile.mkstemp(suffix='.db')
+    os.close(descritor)
+    try:
+        copiar_banco(caminho_db, destino)
+    except Exception:
+        os.remove(destino)
+        raise
+    return destino
+
+def abrir_leitura(caminho):
+    return sqlite3.connect(f'file:{os.path.abspath(caminho)}?mode=ro', uri=True)
+
+def verificar_integridade(caminho):
+    # Devolve a lista de problemas do PRAGMA integrity_check (vazia se o banco
+    # está íntegro)
+    conn = abrir_leitura(caminho)
+    try:
+        resultado = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        conn.close()
+    return [] if resultado == ['ok'] else resultado
+
+# --- Download compactado ---
+
+# Estado de jobs e caches, que não faz sentido numa cópia baixada e diria
+# quais documentos e relatórios os outros usuários processaram
+TABELAS_DESCARTADAS_NO_DOWNLOAD = ('ocr_jobs', 'ocr_cache', 'importacoes', 'relatorios_pdf')
+
+def filtrar_usuario(caminho, user_id):
+    # Deixa na cópia (nunca no banco em uso) só os dados de um usuário: o
+    # download pelo navegador não pode levar as transações e os hashes de
+    # senha dos outros. As transações saem primeiro, pelos triggers; depois
+    # as demais tabelas com user_id. O VACUUM no fim reescreve o arquivo sem
+    # as páginas liberadas, que ainda teriam os dados apagados. Serve também
+    # para a cópia de um banco de arquivo, que só tem a tabela transacoes.
+    conn = database.connect(caminho)
+    try:
+        conn.execute('DELETE FROM transacoes WHERE user_id IS NOT ?', (user_id,))
+        tabelas = [row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        for tabela in tabelas:
+            if tabela in TABELAS_DESCARTADAS_NO_DOWNLOAD:
+                conn.execute(f'DELETE FROM {tabela}')
+            elif tabela != 'transacoes' and 'user_id' in {row['name'] for row in conn.execute(f'PRAGMA table_info({tabela})')}:
+                conn.execute(f'DELETE FROM {tabela} WHERE user_id IS NOT ?', (user_id,))
+        if 'users' in tabelas:
+            conn.execute('DELETE FROM users WHERE id != ?', (user_id,))
+        if 'anexos' in tabelas:
+            conn.execute('DELETE FROM anexos WHERE referencias <= 0')
+        if 'transacoes_busca' in tabelas:
+            # O índice FTS5 guarda os termos apagados até ser reconstruído
+            conn.execute("INSERT INTO transacoes_busca (transacoes_busca) VALUES ('rebuild')")
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+def preparar_download(caminho_db, user_id):
+    # Cópia só com os dados do usuário, num arquivo temporário que quem chama
+    # envia e apaga. Devolve (caminho, 'gz') com o banco principal, que vai
+    # compactado por gerar_gzip; com anos fechados, (caminho, 'zip') com o
+    # banco principal e os bancos de arquivo, onde estão as transações
+    # desses anos.
+    conn = database.connect(caminho_db)
+    try:
+        arquivos = arquivamento.arquivos_fechados(conn)
+    finally:
+        conn.close()
+
+    copias = []
+    try:
+        for origem, nome in [(caminho_db, os.path.basename(caminho_db))] + [
+            (arquivamento.resolver_arquivo(caminho_db, arquivo), os.path.basename(arquivo)) for arquivo in arquivos
+        ]:
+            copia = copiar_para_temporario(origem)
+            copias.append((copia, nome))
+            filtrar_usuario(copia, user_id)
+        if not arquivos:
+            return copias.pop()[0], 'gz'
+
+        descritor, destino = tempfile.mkstemp(suffix='.zip')
+        os.close(descritor)
+        try:
+            with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as pacote:
+                for copia, nome in copias:
+                    pacote.write(copia, nome)
+        except Exception:
+            os.remove(destino)
+            raise
+        return destino, 'zip'
+    finally:
+        for copia, _ in copias:
+            os.remove(copia)
+
+def gerar_pedacos(caminho, remover=False):
+    # Envia um arquivo já compactado aos pedaços
+    try:
+        with open(caminho, 'rb') as arquivo:
+            yield from iter(lambda: arquivo.read(TAMANHO_PEDACO), b'')
+    finally:
+        if remover:
+            os.remove(caminho)
+
+def gerar_gzip(caminho, remover=False):
+    # Comprime o arquivo aos pedaços enquanto ele é enviado
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        with open(caminho, 'rb') as arquivo:
+            while True:
+                pedaco = arquivo.read(TAMANHO_PEDACO)
+                if not pedaco:
+                    break
+                dados = compressor.compress(pedaco)
+                if dados:
+                    yield dados
+        yield compressor.flush()
+    finally:
+        if remover:
+            os.remove(caminho)
+
+# --- Snapshots em disco, com rotação ---
+
+def hash_arquivo(caminho):
+    sha256 = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for pedaco in iter(lambda: arquivo.read(TAMANHO_PEDACO), b''):
+            sha256.update(pedaco)
+    return sha256.hexdigest()
+
+def prefixo_arquivo(arquivo):
+    # Snapshots de um banco de arquivo: "<nome dele sem .db>_<data>_<hora>_<hash>.db.gz"
+    return os.path.splitext(os.path.basename(arquivo))[0] + '_'
+
+def listar_snapshots(pasta, prefixo=PREFIXO_SNAPSHOT):
+    # Do mais novo para o mais antigo; logo depois do prefixo vem a data e
+    # hora, o que separa "livro_caixa_2024..." de "livro_caixa_arquivo_2024..."
+    if not os.path.isdir(pasta):
+        return []
+    nomes = [
+        nome for nome in os.listdir(pasta)
+        if nome.startswith(prefixo) and nome[len(prefixo):][:1].isdigit() and nome.endswith(EXTENSAO_SNAPSHOT)
+    ]
+    return [os.path.join(pasta, nome) for nome in sorted(nomes, reverse=True)]
+
+def hash_do_snapshot(caminho):
+    # livro_caixa_<data>_<hora>_<hash>.db.gz
+    return os.path.basename(caminho)[:-len(EXTENSAO_SNAPSHOT)].rsplit('_', 1)[-1]
+
+def momento_do_snapshot(caminho):
+    # "<data>_<hora>" do nome do snapshot, ou None num arquivo com outro nome
+    partes = os.path.basename(caminho)[:-len(EXTENSAO_SNAPSHOT)].rsplit('_', 3)
+    if len(partes) == 4 and partes[1].isdigit() and partes[2].isdigit():
+        return f'{partes[1]}_{partes[2]}'
+    return None
+
+def snapshot_do_arquivo(pasta, arquivo, momento):
+    # O snapshot de um banco de arquivo que acompanha um snapshot do principal
+    # feito em "momento": o mais novo que não é posterior a ele
+    for caminho in listar_snapshots(pasta, prefixo_arquivo(arquivo)):
+        if momento is None or momento_do_snapshot(caminho) <= momento:
+            return caminho
+    return None
+
+def gravar_snapshot(caminho_db, pasta, prefixo, momento):
+    # Grava um snapshot compactado do banco, se o conteúdo mudou desde o
+    # último com o mesmo prefixo; devolve o caminho ou None
+    copia = copiar_para_temporario(caminho_db)
+    try:
+        problemas = verificar_integridade(copia)
+        if problemas:
+            raise sqlite3.DatabaseError(f'Cópia do banco corrompida: {problemas[0]}')
+
+        conteudo = hash_arquivo(copia)[:16]
+        snapshots = listar_snapshots(pasta, prefixo)
+        if snapshots and hash_do_snapshot(snapshots[0]) == conteudo:
+            return None
+
+        destino = os.path.join(pasta, f'{prefixo}{momento}_{conteudo}{EXTENSAO_SNAPSHOT}')
+        descritor, temporario = tempfile.mkstemp(suffix='.tmp', dir=pasta)
+        try:
+            with os.fdopen(descritor, 'wb') as saida, gzip.GzipFile(fileobj=saida, mode='wb') as compactado, open(copia, 'rb') as entrada:
+                shutil.copyfileobj(entrada, compactado, TAMANHO_PEDACO)
+            os.replace(temporario, destino)
+        except Exception:
+            os.remove(temporario)
+            raise
+        return destino
+    finally:
+        os.remove(copia)
+
+def criar_snapshot(caminho_db, pasta, manter):
+    # Grava o snapshot do banco principal e, com a mesma data e hora no nome,
+    # o de cada banco de arquivo (anos fechados); apaga os snapshots do
+    # principal além de "manter". Cada banco só ganha snapshot novo se mudou:
+    # um banco de arquivo só muda ao fechar um ano. Devolve os snapshots
+    # criados (vazio se não havia mudanças).
+    #
+    # O principal é copiado primeiro: o fechamento grava o arquivo antes de
+    # tirar as linhas do principal, então um arquivo copiado depois nunca
+    # está atrás dele.
+    os.makedirs(pasta, exist_ok=True)
+    momento = datetime.now().strftime('%Y%m%d_%H%M%S')
+    criados = [gravar_snapshot(caminho_db, pasta, PREFIXO_SNAPSHOT, momento)]
+
+    conn = database.connect(caminho_db)
+    try:
+        arquivos = arquivamento.arquivos_fechados(conn)
+    finally:
+        conn.close()
+    for arquivo in arquivos:
+        criados.append(gravar_snapshot(arquivamento.resolver_arquivo(caminho_db, arquivo), pasta, prefixo_arquivo(arquivo), momento))
+
+    principais = listar_snapshots(pasta)
+    for antigo in principais[max(1, manter):]:
+        os.remove(antigo)
+    # De cada banco de arquivo fica o snapshot mais novo e os que acompanham
+    # algum snapshot do principal ainda guardado
+    for arquivo in arquivos:
+        usados = {snapshot_do_arquivo(pasta, arquivo, momento_do_snapshot(principal)) for principal in principais[:max(1, manter)]}
+        for antigo in listar_snapshots(pasta, prefixo_arquivo(arquivo))[1:]:
+            if antigo not in usados:
+                os.remove(antigo)
+    return [criado for criado in criados if criado]
+
+def descompactar(snapshot):
+    # Snapshots .gz viram um .db temporário; um .db comum é usado direto
+    if not snapshot.endswith('.gz'):
+        return snapshot, False
+    descritor, destino = tempfile.mkstemp(suffix='.db')
+    with os.fdopen(descritor, 'wb') as saida, gzip.open(snapshot, 'rb') as entrada:
+        shutil.copyfileobj(entrada, saida, TAMANHO_PEDACO)
+    return destino, True
+
+def snapshots_de_arquivo(snapshot, caminho):
+    # Para cada banco de arquivo citado no snapshot (já descompactado em
+    # "caminho"): (arquivo, snapshot dele na mesma pasta ou None)
+    conn = abrir_leitura(caminho)
+    try:
+        arquivos = arquivamento.arquivos_fechados(conn)
+    finally:
+        conn.close()
+    pasta = os.path.dirname(os.path.abspath(snapshot))
+    momento = momento_do_snapshot(snapshot)
+    return [(arquivo, snapshot_do_arquivo(pasta, arquivo, momento)) for arquivo in arquivos]
+
+def verificar_snapshot(snapshot):
+    # Confere o snapshot e os dos bancos de arquivo que vão com ele
+    caminho, temporario = descompactar(snapshot)
+    try:
+        problemas = verificar_integridade(caminho)
+        if problemas:
+            return problemas
+        for arquivo, snapshot_arquivo in snapshots_de_arquivo(snapshot, caminho):
+            if snapshot_arquivo is None:
+                problemas.append(f'Snapshot do banco de arquivo {arquivo} não encontrado junto de {snapshot}.')
+                continue
+            caminho_arquivo, temporario_arquivo = descompactar(snapshot_arquivo)
+            try:
+                problemas.extend(f'{snapshot_arquivo}: {problema}' for problema in verificar_integridade(caminho_arquivo))
+            finally:
+                if temporario_arquivo:
+                    os.remove(caminho_arquivo)
+        return problemas
+    finally:
+        if temporario:
+            os.remove(caminho)
+
+def copiar_de_volta(caminho, caminho_db):
+    # Copia com a própria API de backup, que respeita os locks e o WAL do
+    # banco em uso
+    origem = abrir_leitura(caminho)
+    destino = database.connect(caminho_db)
+    try:
+        origem.backup(destino, pages=PAGINAS_POR_PASSO, sleep=PAUSA_ENTRE_PASSOS)
+        # O snapshot foi gravado em modo DELETE; o banco em uso volta ao WAL
+        destino.execute('PRAGMA journal_mode = WAL')
+        problemas = [row[0] for row in destino.execute('PRAGMA integrity_check')]
+    finally:
+        destino.close()
+        origem.close()
+    return [] if problemas == ['ok'] else problemas
+
+def restaurar(snapshot, caminho_db):
+    # Restaura o banco principal junto com os bancos de arquivo dos anos
+    # fechados nele (os snapshots feitos com ele, na mesma pasta). Tudo é
+    # conferido antes de tocar em qualquer banco; os de arquivo são
+    # restaurados primeiro, para o principal nunca citar um ano que falta.
+    temporarios = []
+    try:
+        caminho, temporario = descompactar(snapshot)
+        if temporario:
+            temporarios.append(caminho)
+        problemas = verificar_integridade(caminho)
+        if problemas:
+            return problemas
+
+        restauracoes = []
+        for arquivo, snapshot_arquivo in snapshots_de_arquivo(snapshot, caminho):
+            if snapshot_arquivo is None:
+                return [f'Snapshot do banco de arquivo {arquivo} não encontrado junto de {snapshot}.']
+            caminho_arquivo, temporario_arquivo = descompactar(snapshot_arquivo)
+            if temporario_arquivo:
+                temporarios.append(caminho_arquivo)
+            problemas = verificar_integridade(caminho_arquivo)
+            if problemas:
+                return [f'{snapshot_arquivo}: {problema}' for problema in problemas]
+            restauracoes.append((caminho_arquivo, arquivamento.resolver_arquivo(caminho_db, arquivo)))
+        restauracoes.append((caminho, caminho_db))
+
+        for origem, destino in restauracoes:
+            problemas = copiar_de_volta(origem, destino)
+            if problemas:
+                return [f'{destino}: {problema}' for problema in problemas]
+        return []
+    finally:
+        for temporario in temporarios:
+            os.remove(temporario)
+
+def iniciar_agendamento(caminho_db, pasta, manter, intervalo):
+    # Thread de fundo que cria um snapshot a cada "intervalo" segundos
+    def executar():
+        while True:
+            time.sleep(intervalo)
+            try:
+                for criado in criar_snapshot(caminho_db, pasta, manter):
+                    print(f"✓ Snapshot do banco gravado em {criado}")
+            except Exception as e:
+                print(f"✗ Erro ao gravar snapshot do banco: {e}")
+
+    thread = threading.Thread(target=executar, name='backup-agendado', daemon=True)
+    thread.start()
+    return thread
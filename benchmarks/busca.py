@@ -0,0 +1,94 @@
+# Mede /api/transacoes/busca (FTS5) num livro caixa grande: gera as
+# transações de alguns usuários e cronometra buscas comuns, raras e por
+# prefixo, primeira página e páginas seguintes.
+#
+# Uso: python benchmarks/busca.py [--linhas 1000000] [--usuarios 4] [--repeticoes 20]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacao
+import database
+
+DESCRICOES = [
+    'Mercado Extra', 'Supermercado Pão de Açúcar', 'Conta de Água', 'Conta de Luz', 'Aluguel',
+    'Farmácia São João', 'Posto Ipiranga', 'Padaria', 'Restaurante', 'Uber', 'Salário', 'Freelance',
+    'Condomínio', 'Internet', 'Academia', 'Cinema', 'Livraria Cultura', 'Açougue', 'Feira', 'IPVA',
+]
+CATEGORIAS = ['Alimentação', 'Moradia', 'Transporte', 'Saúde', 'Educação', 'Lazer', 'Outros']
+OBSERVACOES = [None, None, None, 'pago via pix', 'cartão de crédito', 'parcelado em 3x', 'reembolsável']
+
+BUSCAS = ['mercado', 'agua', 'farmacia sao', 'reembolsavel', 'cond', 'livraria cultura']
+
+def gerar_transacoes(linhas, usuarios, semente=42):
+    aleatorio = random.Random(semente)
+    for i in range(linhas):
+        yield (
+            i % usuarios + 1,
+            f'{aleatorio.choice(DESCRICOES)} {aleatorio.randrange(1000)}',
+            round(aleatorio.uniform(1, 5000), 2),
+            aleatorio.choice(['receita', 'despesa']),
+            aleatorio.choice(CATEGORIAS),
+            f'20{aleatorio.randrange(15, 25)}-{aleatorio.randrange(1, 13):02d}-{aleatorio.randrange(1, 29):02d}',
+            aleatorio.choice(OBSERVACOES),
+        )
+
+def preparar_banco(caminho, linhas, usuarios):
+    app = aplicacao.create_app({'DATABASE': caminho, 'TESTING': True})
+    with app.app_context():
+        aplicacao.init_db()
+    conn = database.connect(caminho)
+    conn.executemany(
+        'INSERT INTO users (username, password) VALUES (?, ?)',
+        [(f'usuario{i}', '') for i in range(1, usuarios + 1)]
+    )
+    inicio = time.perf_counter()
+    conn.executemany(
+        'INSERT INTO transacoes (user_id, descricao, valor, tipo, categoria, data, observacoes) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        gerar_transacoes(linhas, usuarios)
+    )
+    conn.commit()
+    conn.execute("INSERT INTO transacoes_busca (transacoes_busca) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    print(f'{linhas} transações inseridas (com o índice de busca) em {time.perf_counter() - inicio:.1f}s')
+    return app
+
+def medir(cliente, busca, repeticoes, paginas=1):
+    tempos = []
+    for _ in range(repeticoes):
+        cursor = None
+        inicio = time.perf_counter()
+        for _ in range(paginas):
+            parametros = {'q': busca, **({'cursor': cursor} if cursor else {})}
+            resposta = cliente.get('/api/transacoes/busca', query_string=parametros).get_json()
+            cursor = resposta['proximo_cursor']
+            if not cursor:
+                break
+        tempos.append((time.perf_counter() - inicio) * 1000 / paginas)
+    return statistics.median(tempos), len(resposta['transacoes'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=1000000)
+    parser.add_argument('--usuarios', type=int, default=4)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        app = preparar_banco(os.path.join(pasta, 'bench.db'), args.linhas, args.usuarios)
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao['user_id'] = 1
+
+        print(f'{"busca":<20} {"1ª página":>12} {"5 páginas":>12}')
+        for busca in BUSCAS:
+            primeira, _ = medir(cliente, busca, args.repeticoes)
+            seguintes, _ = medir(cliente, busca, max(1, args.repeticoes // 4), paginas=5)
+            print(f'{busca:<20} {primeira:>9.1f} ms {seguintes:>9.1f} ms/página')
@@ -0,0 +1,186 @@
+# Teste de carga do servidor de produção: sobe o gunicorn (wsgi.py e
+# gunicorn.conf.py) com 1, 2, 4... workers sobre um livro caixa sintético
+# (benchmarks/gerador.py) e dispara as rotas de leitura mais usadas a partir
+# de vários processos clientes, cada um com a sua conexão keep-alive. Mostra,
+# para cada número de workers, requisições por segundo, latência p50/p95 e o
+# ganho sobre o primeiro.
+#
+# Uso: python benchmarks/carga.py [--workers 1,2,4] [--threads 4] [--clientes 16]
+#                                 [--duracao 10] [--linhas 100000 | --banco BANCO]
+#                                 [--porta 5055]
+#
+# Com --banco as rotas rodam num banco já gerado (o usuário "benchmark" do
+# gerador, cuja senha passa a ser "benchmark").
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from werkzeug.security import generate_password_hash
+
+import database
+import gerador
+
+SENHA = 'benchmark'
+
+# Tempo máximo para o servidor subir e aquecer todos os workers
+ESPERA_SERVIDOR = 120
+
+def preparar_banco(args, pasta):
+    caminho = args.banco or os.path.join(pasta, 'carga.db')
+    if not args.banco:
+        print(f'Gerando {args.linhas} transações...')
+        gerador.criar_banco(caminho, args.linhas)
+    conn = database.connect(caminho)
+    try:
+        user_id = gerador.obter_usuario(conn, 'benchmark')
+        conn.execute('UPDATE users SET password = ? WHERE id = ?', (generate_password_hash(SENHA), user_id))
+        conn.commit()
+        ultima = conn.execute('SELECT MAX(data) FROM transacoes WHERE user_id = ?', (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+    return caminho, date.fromisoformat(ultima[:10]) if ultima else date.today()
+
+def definir_rotas(ultima):
+    # Rotas de leitura do dia a dia: dashboard, listagem, busca e relatórios
+    periodo = f'data_inicio={ultima - timedelta(days=30)}&data_fim={ultima}'
+    return [
+        '/api/dashboard',
+        '/api/transacoes',
+        '/api/transacoes/busca?q=mercado',
+        '/api/relatorios/mensal',
+        '/api/relatorios/categorias',
+        f'/api/relatorios/detalhado?{periodo}&tipo=todos',
+        f'/api/relatorios/saldo-acumulado?data={ultima - timedelta(days=180)}',
+    ]
+
+# --- Servidor ---
+
+def iniciar_servidor(args, caminho, pasta, workers, log):
+    env = dict(
+        os.environ,
+        PYTHONUNBUFFERED='1',
+        LIVRO_CAIXA_DATABASE=caminho,
+        LIVRO_CAIXA_UPLOAD_FOLDER=os.path.join(pasta, 'uploads'),
+        LIVRO_CAIXA_RELATORIOS_CACHE=os.path.join(pasta, 'relatorios_cache'),
+        LIVRO_CAIXA_PERFIL_PASTA=os.path.join(pasta, 'perfis'),
+        LIVRO_CAIXA_BIND=f'127.0.0.1:{args.porta}',
+        LIVRO_CAIXA_WORKERS=str(workers),
+        LIVRO_CAIXA_THREADS=str(args.threads),
+    )
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'wsgi:app'], cwd=RAIZ, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    # Pronto quando todos os workers terminaram o aquecimento
+    limite = time.monotonic() + ESPERA_SERVIDOR
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'O gunicorn terminou ao iniciar; veja {log.name}')
+        with open(log.name, encoding='utf-8', errors='replace') as saida:
+            if saida.read().count('aquecido em') >= workers:
+                return processo
+        time.sleep(0.2)
+    parar_servidor(processo)
+    raise RuntimeError(f'O gunicorn não subiu em {ESPERA_SERVIDOR}s; veja {log.name}')
+
+def parar_servidor(processo):
+    processo.send_signal(signal.SIGTERM)
+    processo.wait(timeout=60)
+
+def entrar(porta):
+    # Faz login pelo formulário e devolve o cookie da sessão
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    corpo = urllib.parse.urlencode({'username': 'benchmark', 'password': SENHA})
+    conexao.request('POST', '/login', corpo, {'Content-Type': 'application/x-www-form-urlencoded'})
+    resposta = conexao.getresponse()
+    resposta.read()
+    conexao.close()
+    cookie = resposta.getheader('Set-Cookie')
+    if resposta.status != 302 or not cookie:
+        raise RuntimeError(f'Login falhou (HTTP {resposta.status}).')
+    return cookie.split(';', 1)[0]
+
+# --- Clientes ---
+
+def executar_cliente(parametros):
+    # Um processo cliente: percorre as rotas em ciclo até acabar o tempo;
+    # devolve (latências das respostas 200, erros)
+    porta, cookie, rotas, duracao, indice = parametros
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+    tempos, erros = [], 0
+    fim = time.perf_counter() + duracao
+    while time.perf_counter() < fim:
+        rota = rotas[indice % len(rotas)]
+        indice += 1
+        inicio = time.perf_counter()
+        try:
+            conexao.request('GET', rota, headers={'Cookie': cookie})
+            resposta = conexao.getresponse()
+            resposta.read()
+        except (OSError, http.client.HTTPException):
+            erros += 1
+            conexao.close()
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+            continue
+        if resposta.status == 200:
+            tempos.append(time.perf_counter() - inicio)
+        else:
+            erros += 1
+    conexao.close()
+    return tempos, erros
+
+def medir(args, cookie, rotas):
+    parametros = [(args.porta, cookie, rotas, args.duracao, indice) for indice in range(args.clientes)]
+    with multiprocessing.Pool(args.clientes) as clientes:
+        resultados = clientes.map(executar_cliente, parametros)
+    tempos = [tempo for tempos_cliente, _ in resultados for tempo in tempos_cliente]
+    erros = sum(erros_cliente for _, erros_cliente in resultados)
+    if len(tempos) < 2:
+        return len(tempos) / args.duracao, None, None, erros
+    cortes = statistics.quantiles(tempos, n=100, method='inclusive')
+    return len(tempos) / args.duracao, cortes[49], cortes[94], erros
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4', help='números de workers a medir, separados por vírgula')
+    parser.add_argument('--threads', type=int, default=4, help='threads por worker')
+    parser.add_argument('--clientes', type=int, default=16, help='processos clientes simultâneos')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos de carga por número de workers')
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--banco', help='banco já gerado (em vez de gerar um novo)')
+    parser.add_argument('--porta', type=int, default=5055)
+    args = parser.parse_args()
+    contagens = [int(n) for n in args.workers.split(',')]
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho, ultima = preparar_banco(args, pasta)
+        rotas = definir_rotas(ultima)
+        resultados = []
+        for workers in contagens:
+            with open(os.path.join(pasta, f'gunicorn_{workers}.log'), 'w+') as log:
+                processo = iniciar_servidor(args, caminho, pasta, workers, log)
+                try:
+                    cookie = entrar(args.porta)
+                    resultados.append((workers,) + medir(args, cookie, rotas))
+                finally:
+                    parar_servidor(processo)
+
+    print(f'{args.clientes} clientes, {args.threads} threads por worker, {args.duracao:g}s por medição, '
+          f'{len(rotas)} rotas, {os.cpu_count()} núcleos')
+    print(f'{"workers":>7} {"req/s":>9} {"p50":>9} {"p95":>9} {"erros":>6} {"ganho":>6}')
+    base = resultados[0][1] or 1
+    for workers, vazao, p50, p95, erros in resultados:
+        p50_texto = f'{p50 * 1000:.1f} ms' if p50 is not None else '-'
+        p95_texto = f'{p95 * 1000:.1f} ms' if p95 is not None else '-'
+        print(f'{workers:>7} {vazao:>9,.0f} {p50_texto:>9} {p95_texto:>9} {erros:>6} {vazao / base:>5.2f}x')
@@ -0,0 +1,153 @@
+# Gera um livro caixa sintético, reproduzível pela semente, para os
+# benchmarks: N transações (de mil a dez milhões) distribuídas pelas
+# categorias que app.init_db cadastra, com descrições, valores, formas de
+# pagamento e frequências próximas das de um livro real (muitas despesas
+# pequenas, poucas receitas maiores).
+#
+# Uso: python benchmarks/gerador.py BANCO [--linhas 100000] [--semente 42]
+#                                        [--usuario benchmark] [--anos 5] [--ate 2024-12-31]
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+# Por categoria: peso (frequência relativa dentro do tipo), faixa de valores
+# e descrições típicas
+PERFIS = {
+    ('Salário', 'receita'): (3, (2500, 12000), ['Salário', 'Adiantamento salarial', '13º salário', 'Férias']),
+    ('Freelance', 'receita'): (3, (150, 4000), ['Projeto freelance', 'Consultoria', 'Serviço prestado', 'Aula particular']),
+    ('Investimentos', 'receita'): (2, (5, 1500), ['Rendimento CDB', 'Dividendos', 'Juros poupança', 'Resgate Tesouro Direto']),
+    ('Vendas', 'receita'): (2, (20, 2500), ['Venda Mercado Livre', 'Venda OLX', 'Venda de equipamento']),
+    ('Outros', 'receita'): (1, (10, 800), ['Reembolso', 'Presente', 'Cashback', 'Restituição IR']),
+    ('Alimentação', 'despesa'): (30, (5, 650), ['Supermercado Extra', 'Mercado Pão de Açúcar', 'Padaria', 'Restaurante', 'iFood', 'Açougue', 'Feira', 'Lanchonete']),
+    ('Moradia', 'despesa'): (8, (60, 3500), ['Aluguel', 'Condomínio', 'Conta de Luz', 'Conta de Água', 'Internet', 'Gás', 'IPTU']),
+    ('Transporte', 'despesa'): (12, (4, 450), ['Posto Ipiranga', 'Uber', '99', 'Estacionamento', 'Pedágio', 'Bilhete Único', 'IPVA']),
+    ('Saúde', 'despesa'): (5, (15, 900), ['Farmácia São João', 'Drogasil', 'Consulta médica', 'Plano de saúde', 'Exame laboratorial']),
+    ('Educação', 'despesa'): (3, (30, 1800), ['Mensalidade escolar', 'Livraria Cultura', 'Curso online', 'Material escolar']),
+    ('Lazer', 'despesa'): (8, (15, 700), ['Cinema', 'Netflix', 'Spotify', 'Bar', 'Show', 'Viagem', 'Academia']),
+    ('Outros', 'despesa'): (4, (5, 500), ['Presente', 'Doação', 'Tarifa bancária', 'Assinatura', 'Diversos']),
+}
+
+# Proporção de receitas entre as transações
+FRACAO_RECEITAS = 0.12
+
+FORMAS_PAGAMENTO = ['Pix', 'Cartão de Crédito', 'Cartão de Débito', 'Dinheiro', 'Transferência', 'Boleto', None]
+PESOS_FORMAS = [30, 30, 15, 8, 7, 6, 4]
+
+OBSERVACOES = ['pago via app', 'parcelado', 'reembolsável', 'dividido com a família', 'promoção', 'nota fiscal no e-mail']
+FRACAO_OBSERVACOES = 0.15
+
+# Transações inseridas por transação do banco
+TAMANHO_LOTE = 50000
+
+def carregar_categorias(conn):
+    # As categorias vêm do próprio banco (cadastradas por app.init_db); as que
+    # não têm perfil aqui usam o de "Outros" do mesmo tipo
+    categorias = {'receita': [], 'despesa': []}
+    for row in conn.execute('SELECT nome, tipo FROM categorias ORDER BY id'):
+        perfil = PERFIS.get((row['nome'], row['tipo']), PERFIS[('Outros', row['tipo'])])
+        categorias[row['tipo']].append((row['nome'], perfil))
+    if not categorias['receita'] or not categorias['despesa']:
+        raise ValueError('O banco não tem categorias de receita e de despesa; rode app.init_db antes.')
+    return categorias
+
+def gerar_transacoes(categorias, linhas, semente=42, anos=5, ate=date(2024, 12, 31), user_id=None):
+    # Gera tuplas (user_id, descricao, valor, tipo, categoria, data,
+    # forma_pagamento, observacoes) espalhadas pelos "anos" que terminam em "ate"
+    aleatorio = random.Random(semente)
+    dias = anos * 365
+    inicio = ate - timedelta(days=dias - 1)
+    escolhas = {
+        tipo: ([nome for nome, _ in lista], [perfil for _, perfil in lista], [perfil[0] for _, perfil in lista])
+        for tipo, lista in categorias.items()
+    }
+
+    for _ in range(linhas):
+        tipo = 'receita' if aleatorio.random() < FRACAO_RECEITAS else 'despesa'
+        nomes, perfis, pesos = escolhas[tipo]
+        indice = aleatorio.choices(range(len(nomes)), weights=pesos)[0]
+        _, (minimo, maximo), descricoes = perfis[indice]
+        # Valores concentrados perto do mínimo, como num extrato de verdade
+        valor = round(minimo + (maximo - minimo) * aleatorio.random() ** 3, 2)
+        yield (
+            user_id,
+            aleatorio.choice(descricoes),
+            valor,
+            tipo,
+            nomes[indice],
+            (inicio + timedelta(days=aleatorio.randrange(dias))).isoformat(),
+            aleatorio.choices(FORMAS_PAGAMENTO, weights=PESOS_FORMAS)[0],
+            aleatorio.choice(OBSERVACOES) if aleatorio.random() < FRACAO_OBSERVACOES else None,
+        )
+
+def obter_usuario(conn, username):
+    # Usuário dono das transações geradas; criado com senha vazia (não faz
+    # login pelo formulário, os benchmarks usam a sessão direto)
+    row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    if row:
+        return row['id']
+    cursor = conn.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, ''))
+    conn.commit()
+    return cursor.lastrowid
+
+def preencher(conn, linhas, semente=42, anos=5, ate=date(2024, 12, 31), user_id=None, progresso=None):
+    # Insere as transações em lotes de TAMANHO_LOTE, cada lote numa transação;
+    # os triggers mantêm resumo_mensal e o índice de busca em dia
+    categorias = carregar_categorias(conn)
+    transacoes = gerar_transacoes(categorias, linhas, semente, anos, ate, user_id)
+    inseridas = 0
+    while inseridas < linhas:
+        lote = [next(transacoes) for _ in range(min(TAMANHO_LOTE, linhas - inseridas))]
+        conn.executemany('''
+            INSERT INTO transacoes (user_id, descricao, valor, tipo, categoria, data, forma_pagamento, observacoes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', lote)
+        conn.commit()
+        inseridas += len(lote)
+        if progresso:
+            progresso(inseridas)
+    conn.execute('PRAGMA optimize')
+    return inseridas
+
+def criar_banco(caminho, linhas, semente=42, anos=5, ate=date(2024, 12, 31), username='benchmark', progresso=None):
+    # Cria (ou completa) o esquema com app.init_db e preenche o banco;
+    # devolve o id do usuário dono das transações
+    import app as aplicacao
+
+    # O gerador não grava anexos; a pasta de uploads fica ao lado do banco
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    app = aplicacao.create_app({'DATABASE': caminho, 'UPLOAD_FOLDER': pasta})
+    with app.app_context():
+        aplicacao.init_db()
+    conn = database.connect(caminho)
+    try:
+        user_id = obter_usuario(conn, username)
+        preencher(conn, linhas, semente, anos, ate, user_id, progresso)
+    finally:
+        conn.close()
+    return user_id
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('banco')
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--usuario', default='benchmark')
+    parser.add_argument('--anos', type=int, default=5)
+    parser.add_argument('--ate', type=date.fromisoformat, default=date(2024, 12, 31))
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+
+    def progresso(inseridas):
+        decorrido = time.perf_counter() - inicio
+        print(f'\r{inseridas:>10} / {args.linhas} transações ({inseridas / decorrido:,.0f} linhas/s)', end='', flush=True)
+
+    user_id = criar_banco(args.banco, args.linhas, args.semente, args.anos, args.ate, args.usuario, progresso)
+    print(f'\n✓ {args.linhas} transações geradas para {args.usuario} (id {user_id}) em {time.perf_counter() - inicio:.1f}s')
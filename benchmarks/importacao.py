@@ -0,0 +1,106 @@
+# Compara a importação antiga (iterrows + SELECT/INSERT por linha) com a
+# importação vetorizada de importacao.importar_lote, em linhas por segundo.
+#
+# Uso: python benchmarks/importacao.py [--linhas 50000]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import importacao
+
+CATEGORIAS = {
+    'receita': ['Salário', 'Freelance', 'Investimentos', 'Vendas', 'Outros'],
+    'despesa': ['Alimentação', 'Moradia', 'Transporte', 'Saúde', 'Educação', 'Lazer', 'Outros'],
+}
+
+def gerar_planilha(linhas, semente=42):
+    aleatorio = random.Random(semente)
+    registros = []
+    for i in range(linhas):
+        tipo = aleatorio.choice(['receita', 'despesa'])
+        registros.append({
+            'Data': pd.Timestamp('2020-01-01') + pd.Timedelta(days=aleatorio.randrange(1800)),
+            'Descricao': f'Lançamento {i % (linhas // 2 or 1)}',
+            'Valor': round(aleatorio.uniform(1, 5000), 2),
+            'Tipo': tipo.capitalize(),
+            'Categoria': aleatorio.choice(CATEGORIAS[tipo]),
+        })
+    # Algumas linhas inválidas e repetidas, como numa exportação real
+    for i in range(0, linhas, 50):
+        registros[i]['Valor'] = 'n/d'
+    for i in range(1, linhas, 97):
+        registros[i] = dict(registros[i - 1])
+    return pd.DataFrame(registros)
+
+def importar_antigo(conn, df):
+    # Cópia do laço original de importar_planilha, mantida só para comparação
+    importadas = 0
+    for index, row in df.iterrows():
+        try:
+            data = pd.to_datetime(row['Data']).strftime('%Y-%m-%d')
+            descricao = str(row['Descricao']).strip()
+            valor = round(float(row['Valor']), 2)
+            tipo = str(row['Tipo']).lower().strip()
+            categoria = str(row['Categoria']).strip()
+            if tipo not in ['receita', 'despesa']:
+                continue
+            existe = conn.execute(
+                'SELECT id FROM transacoes WHERE data = ? AND descricao = ? AND valor = ? AND tipo = ?',
+                (data, descricao, valor, tipo)
+            ).fetchone()
+            if existe:
+                continue
+            conn.execute(
+                'INSERT INTO transacoes (data, descricao, valor, tipo, categoria) VALUES (?, ?, ?, ?, ?)',
+                (data, descricao, valor, tipo, categoria)
+            )
+            importadas += 1
+        except (ValueError, TypeError, KeyError):
+            continue
+    return importadas
+
+def importar_vetorizado(conn, df):
+    importadas, rejeitadas = importacao.importar_lote(conn, 1, df)
+    return importadas
+
+def medir(nome, funcao, df):
+    with tempfile.TemporaryDirectory() as pasta:
+        conn = database.connect(os.path.join(pasta, 'bench.db'))
+        conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, password TEXT NOT NULL)')
+        conn.execute("INSERT INTO users (username, password) VALUES ('benchmark', '')")
+        conn.execute('''
+            CREATE TABLE transacoes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                descricao TEXT NOT NULL, valor REAL NOT NULL, tipo TEXT NOT NULL,
+                categoria TEXT NOT NULL, data DATE NOT NULL, forma_pagamento TEXT,
+                anexo TEXT, observacoes TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        database.migrate(conn)
+        inicio = time.perf_counter()
+        importadas = funcao(conn, df)
+        conn.commit()
+        duracao = time.perf_counter() - inicio
+        conn.close()
+    print(f'{nome:<12} {importadas:>8} importadas em {duracao:8.3f}s  ->  {len(df) / duracao:10.0f} linhas/s')
+    return importadas
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=50000)
+    args = parser.parse_args()
+
+    df = gerar_planilha(args.linhas)
+    antes = medir('antes', importar_antigo, df)
+    depois = medir('depois', importar_vetorizado, df)
+    if antes != depois:
+        print(f'✗ Resultados diferentes: {antes} x {depois}')
+        sys.exit(1)
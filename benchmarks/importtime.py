@@ -0,0 +1,65 @@
+# Mede o tempo de importação do app com "python -X importtime" e confere que
+# as dependências pesadas (pandas, ReportLab, OCR) não são carregadas na
+# inicialização, só quando uma rota precisa delas.
+#
+# Sai com código 1 se alguma delas for importada ou se o tempo total passar
+# do limite, para servir de guarda contra regressões.
+#
+# Uso: python benchmarks/importtime.py [--limite-ms 500] [--mais-lentos 15]
+import argparse
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CARREGAMENTO_SOB_DEMANDA = ('pandas', 'numpy', 'reportlab', 'pytesseract', 'pdf2image', 'PIL', 'openpyxl')
+
+def medir():
+    # Processo novo, sem .pyc de outra versão atrapalhando: cada linha do
+    # stderr é "import time: <próprio us> | <acumulado us> | <módulo>"
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app; app.create_app()'],
+        cwd=RAIZ, capture_output=True, text=True
+    )
+    if resultado.returncode != 0:
+        print(resultado.stderr)
+        sys.exit(resultado.returncode)
+
+    modulos = []
+    for linha in resultado.stderr.splitlines():
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        _, proprio, acumulado, nome = (parte.strip() for parte in linha.replace('import time:', '|').split('|'))
+        modulos.append((nome.strip(), int(proprio), int(acumulado)))
+    return modulos
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limite-ms', type=float, default=500)
+    parser.add_argument('--mais-lentos', type=int, default=15)
+    args = parser.parse_args()
+
+    modulos = medir()
+    total_ms = sum(proprio for _, proprio, _ in modulos) / 1000
+    print(f'{len(modulos)} módulos importados em {total_ms:.1f} ms')
+    print()
+    print(f'{"acumulado (ms)":>15}  módulo de primeiro nível')
+    raizes = [(nome, acumulado) for nome, _, acumulado in modulos if '.' not in nome]
+    for nome, acumulado in sorted(raizes, key=lambda item: item[1], reverse=True)[:args.mais_lentos]:
+        print(f'{acumulado / 1000:15.1f}  {nome}')
+
+    carregados = sorted({
+        nome.split('.')[0] for nome, _, _ in modulos
+        if nome.split('.')[0] in CARREGAMENTO_SOB_DEMANDA
+    })
+    falhou = False
+    if carregados:
+        print(f'\n✗ Importados na inicialização (deveriam ser sob demanda): {", ".join(carregados)}')
+        falhou = True
+    if total_ms > args.limite_ms:
+        print(f'\n✗ Importação levou {total_ms:.1f} ms, acima do limite de {args.limite_ms:.0f} ms')
+        falhou = True
+    if falhou:
+        sys.exit(1)
+    print('\n✓ Nenhuma dependência pesada carregada na inicialização.')
@@ -0,0 +1,84 @@
+# Compara o lançamento e a exclusão linha a linha (POST /api/transacoes e
+# DELETE /api/transacoes/<id>, um commit por transação) com os endpoints em
+# lote (/api/transacoes/lote, um commit por lote), em transações por segundo.
+#
+# Uso: python benchmarks/lote.py [--transacoes 2000] [--lote 500] [--base 100000]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacao
+import database
+import gerador
+
+def gerar_itens(quantidade, semente=7):
+    aleatorio = random.Random(semente)
+    return [
+        {
+            'descricao': f'Lançamento integrado {i}',
+            'valor': round(aleatorio.uniform(1, 900), 2),
+            'tipo': aleatorio.choice(['receita', 'despesa']),
+            'categoria': 'Outros',
+            'data': f'2024-{aleatorio.randrange(1, 13):02d}-{aleatorio.randrange(1, 29):02d}',
+            'forma_pagamento': 'Pix',
+        }
+        for i in range(quantidade)
+    ]
+
+def cronometrar(funcao):
+    inicio = time.perf_counter()
+    funcao()
+    return time.perf_counter() - inicio
+
+def linha_a_linha(cliente, banco, itens):
+    tempo_insercao = cronometrar(lambda: [cliente.post('/api/transacoes', data=item) for item in itens])
+    ids = [row[0] for row in banco.execute("SELECT id FROM transacoes WHERE descricao LIKE 'Lançamento integrado %'")]
+    tempo_exclusao = cronometrar(lambda: [cliente.delete(f'/api/transacoes/{id}') for id in ids])
+    return tempo_insercao, tempo_exclusao
+
+def em_lote(cliente, itens, tamanho):
+    lotes = [itens[i:i + tamanho] for i in range(0, len(itens), tamanho)]
+    ids = []
+
+    def inserir():
+        for lote in lotes:
+            ids.extend(cliente.post('/api/transacoes/lote', json={'transacoes': lote}).get_json()['ids'])
+
+    def excluir():
+        for i in range(0, len(ids), tamanho):
+            cliente.delete('/api/transacoes/lote', json={'ids': ids[i:i + tamanho]})
+
+    return cronometrar(inserir), cronometrar(excluir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transacoes', type=int, default=2000)
+    parser.add_argument('--lote', type=int, default=500)
+    parser.add_argument('--base', type=int, default=100000, help='transações já existentes no banco')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'bench.db')
+        user_id = gerador.criar_banco(caminho, args.base)
+        app = aplicacao.create_app({'DATABASE': caminho, 'UPLOAD_FOLDER': pasta, 'LOTE_MAX_TRANSACOES': max(args.lote, 1000)})
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao['user_id'] = user_id
+        banco = database.connect(caminho)
+        itens = gerar_itens(args.transacoes)
+
+        resultados = {
+            'linha a linha': linha_a_linha(cliente, banco, itens),
+            f'lote de {args.lote}': em_lote(cliente, itens, args.lote),
+        }
+        banco.close()
+
+        print(f'{args.transacoes} transações sobre um banco com {args.base}')
+        print(f'{"modo":<16} {"inserção":>16} {"exclusão":>16}')
+        for modo, (insercao, exclusao) in resultados.items():
+            print(f'{modo:<16} {args.transacoes / insercao:>11,.0f} tx/s {args.transacoes / exclusao:>11,.0f} tx/s')
@@ -0,0 +1,79 @@
+# Mede o OCR de uma pasta de comprovantes com e sem o pré-processamento de
+# ocr.preprocessar: tempo por imagem, tamanho da imagem entregue ao Tesseract
+# e se o valor extraído confere com o esperado.
+#
+# Os valores esperados vêm de um CSV opcional "arquivo;valor" (ex.:
+# "cupo0.jpg;9,99"); sem ele, só os tempos são comparados.
+#
+# Uso: python benchmarks/ocr_imagens.py [pasta] [--esperados valores.csv] [--repeticoes 3]
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocr
+from PIL import Image
+
+EXTENSOES = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
+def ler_esperados(caminho):
+    if not caminho:
+        return {}
+    with open(caminho, encoding='utf-8-sig', newline='') as arquivo:
+        return {
+            linha[0].strip(): ocr.converter_valor(linha[1].strip())
+            for linha in csv.reader(arquivo, delimiter=';') if len(linha) >= 2
+        }
+
+def medir(caminho, etapas, repeticoes, timeout):
+    # Média de algumas execuções; a primeira também aquece o cache de disco
+    ocr.PARAMETROS_OCR['preprocessamento'] = etapas
+    with Image.open(caminho) as imagem:
+        tamanho = ocr.preprocessar(imagem).size
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        valor = ocr.processar_arquivo(caminho, timeout)
+        tempos.append(time.perf_counter() - inicio)
+    return valor, sum(tempos) / len(tempos), tamanho
+
+def situacao(valor, esperado):
+    if esperado is None:
+        return '-'
+    return 'ok' if abs(valor - esperado) < 0.005 else 'ERRO'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pasta', nargs='?', default='uploads')
+    parser.add_argument('--esperados')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--timeout', type=int, default=120)
+    args = parser.parse_args()
+
+    if not ocr.tesseract_disponivel():
+        print('✗ Tesseract indisponível; ajuste TESSERACT_CMD em ocr.py.')
+        sys.exit(1)
+
+    esperados = ler_esperados(args.esperados)
+    completo = ','.join(ocr.ETAPAS_PREPROCESSAMENTO)
+    arquivos = sorted(nome for nome in os.listdir(args.pasta) if nome.lower().endswith(EXTENSOES))
+
+    totais = {'sem': [0.0, 0], 'com': [0.0, 0]}
+    print(f'{"arquivo":<28} {"":>4} {"tamanho":>11} {"tempo":>8} {"valor":>10} {"confere":>8}')
+    for nome in arquivos:
+        caminho = os.path.join(args.pasta, nome)
+        esperado = esperados.get(nome)
+        for rotulo, etapas in (('sem', ''), ('com', completo)):
+            valor, duracao, (largura, altura) = medir(caminho, etapas, args.repeticoes, args.timeout)
+            confere = situacao(valor, esperado)
+            totais[rotulo][0] += duracao
+            totais[rotulo][1] += confere == 'ok'
+            print(f'{nome:<28} {rotulo:>4} {largura:>5}x{altura:<5} {duracao:7.2f}s {valor:>10.2f} {confere:>8}')
+
+    print()
+    for rotulo, (duracao, acertos) in totais.items():
+        resumo = f'{acertos}/{len(esperados)} valores conferem' if esperados else 'sem valores esperados'
+        print(f'{rotulo} pré-processamento: {duracao:7.2f}s no total, {resumo}')
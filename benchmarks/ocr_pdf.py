@@ -0,0 +1,106 @@
+# Compara o OCR de PDF antigo (todas as páginas rasterizadas de uma vez e lidas
+# em sequência) com ocr.processar_pdf (uma página por vez, em paralelo, com
+# camada de texto e parada antecipada). Mede latência e pico de memória (RSS).
+#
+# Cada medição roda num processo novo, para que o pico de memória de uma não
+# contamine a outra. Precisa do Tesseract e do Poppler instalados.
+#
+# Uso: python benchmarks/ocr_pdf.py [--paginas 20] [--escaneado]
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def gerar_pdf(caminho, paginas, escaneado):
+    # Um extrato com itens em todas as páginas e o total só na última. Com
+    # --escaneado cada página vira imagem, sem camada de texto.
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    largura, altura = A4
+    pdf = canvas.Canvas(caminho, pagesize=A4)
+    total = 0.0
+    for pagina in range(1, paginas + 1):
+        y = altura - 60
+        for item in range(40):
+            valor = round(10 + (pagina * 40 + item) % 97 * 1.37, 2)
+            total += valor
+            pdf.drawString(50, y, f'Item {pagina}.{item:02d}')
+            pdf.drawRightString(largura - 50, y, f'{valor:.2f}'.replace('.', ','))
+            y -= 18
+        if pagina == paginas:
+            pdf.setFont('Helvetica-Bold', 14)
+            pdf.drawString(50, 60, 'VALOR TOTAL R$ ' + f'{total:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.'))
+        pdf.showPage()
+    pdf.save()
+
+    if escaneado:
+        from pdf2image import convert_from_path
+        imagens = convert_from_path(caminho, 150)
+        imagens[0].save(caminho, save_all=True, append_images=imagens[1:])
+        for imagem in imagens:
+            imagem.close()
+    return round(total, 2)
+
+def ocr_antigo(caminho, timeout):
+    # Cópia do fluxo original de processar_ocr, mantida só para comparação
+    from pdf2image import convert_from_path
+
+    import ocr
+
+    pytesseract = ocr._pytesseract()
+    imagens = convert_from_path(caminho, 200)
+    texto = ''
+    for imagem in imagens:
+        texto += pytesseract.image_to_string(imagem, lang='por', timeout=timeout)
+    return ocr.extrair_valor(texto)
+
+def ocr_novo(caminho, timeout):
+    import ocr
+
+    return ocr.processar_pdf(caminho, time.monotonic() + timeout)
+
+def pico_rss_mb():
+    # ru_maxrss é em KB no Linux; inclui os subprocessos pdftoppm/tesseract
+    proprio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return proprio / 1024, filhos / 1024
+
+def executar(nome, caminho, timeout, fila):
+    funcao = {'antes': ocr_antigo, 'depois': ocr_novo}[nome]
+    inicio = time.perf_counter()
+    valor = funcao(caminho, timeout)
+    duracao = time.perf_counter() - inicio
+    fila.put((valor, duracao) + pico_rss_mb())
+
+def medir(nome, caminho, timeout):
+    contexto = multiprocessing.get_context('spawn')
+    fila = contexto.Queue()
+    processo = contexto.Process(target=executar, args=(nome, caminho, timeout, fila))
+    processo.start()
+    valor, duracao, proprio, filhos = fila.get()
+    processo.join()
+    print(f'{nome:<8} valor {valor:>12.2f}  em {duracao:7.2f}s  |  pico RSS {proprio:7.1f} MB (processo) {filhos:7.1f} MB (filhos)')
+    return valor
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paginas', type=int, default=20)
+    parser.add_argument('--escaneado', action='store_true', help='PDF só com imagens, sem camada de texto')
+    parser.add_argument('--timeout', type=int, default=600)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'extrato.pdf')
+        esperado = gerar_pdf(caminho, args.paginas, args.escaneado)
+        print(f'PDF com {args.paginas} páginas, total esperado {esperado:.2f}')
+        medir('antes', caminho, args.timeout)
+        depois = medir('depois', caminho, args.timeout)
+        if abs(depois - esperado) > 0.01:
+            print(f'✗ Valor extraído diferente do esperado: {depois:.2f}')
+            sys.exit(1)
@@ -0,0 +1,307 @@
+# Mede as rotas do app com o cliente de testes do Flask sobre um livro caixa
+# sintético (benchmarks/gerador.py): latência p50/p95/p99, pico de memória
+# (RSS) durante cada rota e linhas processadas por segundo. O resultado vai
+# para um arquivo JSON, para comparar uma execução com outra.
+#
+# Uso: python benchmarks/rotas.py [--linhas 100000 | --banco BANCO] [--repeticoes 30]
+#                                 [--dias 30] [--linhas-importacao 1000]
+#                                 [--saida resultado.json] [--comparar anterior.json]
+#
+# Com --banco as rotas rodam num banco já gerado (o usuário "benchmark" do
+# gerador); a medição de /importar_planilha acrescenta transações a ele.
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacao
+import database
+import gerador
+
+# Rotas pesadas (PDF, importação) repetem menos vezes
+FRACAO_REPETICOES_PESADAS = 0.2
+
+INTERVALO_AMOSTRAGEM_RSS = 0.005
+
+# --- Memória ---
+
+def rss_atual():
+    # RSS do processo em bytes; None fora do Linux
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def rss_maximo():
+    # ru_maxrss é em KB no Linux e em bytes no macOS
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+def medir_pico_rss(funcao):
+    # Executa "funcao" amostrando o RSS numa thread; devolve (resultado, pico
+    # em bytes). Sem /proc, cai no pico do processo inteiro (ru_maxrss).
+    if rss_atual() is None:
+        resultado = funcao()
+        return resultado, rss_maximo()
+
+    pico = [rss_atual()]
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.wait(INTERVALO_AMOSTRAGEM_RSS):
+            pico[0] = max(pico[0], rss_atual())
+
+    amostrador = threading.Thread(target=amostrar, daemon=True)
+    amostrador.start()
+    try:
+        resultado = funcao()
+    finally:
+        parar.set()
+        amostrador.join()
+    return resultado, max(pico[0], rss_atual())
+
+# --- Estatísticas ---
+
+def percentis(tempos):
+    if len(tempos) == 1:
+        return tempos[0], tempos[0], tempos[0]
+    cortes = statistics.quantiles(tempos, n=100, method='inclusive')
+    return cortes[49], cortes[94], cortes[98]
+
+def resumir(url, tempos, linhas, pico_rss, status):
+    p50, p95, p99 = percentis(tempos)
+    media = statistics.fmean(tempos)
+    return {
+        'url': url,
+        'repeticoes': len(tempos),
+        'status': sorted(status),
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+        'media_ms': round(media * 1000, 3),
+        'max_ms': round(max(tempos) * 1000, 3),
+        'linhas_por_requisicao': linhas,
+        'linhas_por_s': round(linhas / media, 1) if linhas and media else None,
+        'rss_pico_mb': round(pico_rss / 2 ** 20, 1),
+    }
+
+# --- Rotas ---
+
+def contar_transacoes_json(resposta):
+    corpo = resposta.get_json()
+    return len(corpo['transacoes'] if isinstance(corpo, dict) else corpo)
+
+def contar_linhas_csv(resposta):
+    # Menos o cabeçalho
+    return resposta.get_data().count(b'\n') - 1
+
+# Marcador nas descrições da planilha de importação, trocado a cada
+# repetição para que nenhuma linha seja ignorada como duplicada
+MARCADOR_IMPORTACAO = b'#LOTE'
+
+def gerar_csv_importacao(categorias, linhas, semente):
+    # Planilha no formato que a própria exportação gera (";" e vírgula decimal)
+    saida = io.StringIO()
+    escritor = csv.writer(saida, delimiter=';')
+    escritor.writerow(['Data', 'Descricao', 'Valor', 'Tipo', 'Categoria'])
+    for _, descricao, valor, tipo, categoria, data, _, _ in gerador.gerar_transacoes(categorias, linhas, semente):
+        escritor.writerow([data, f'{descricao} {MARCADOR_IMPORTACAO.decode()}', f'{valor:.2f}'.replace('.', ','), tipo.capitalize(), categoria])
+    return saida.getvalue().encode('utf-8')
+
+def definir_rotas(contexto):
+    # (nome, url, pesada, funcao(cliente, repeticao) -> resposta, contar(resposta) -> linhas)
+    inicio, fim = contexto['inicio'], contexto['fim']
+    periodo = f'data_inicio={inicio}&data_fim={fim}'
+    primeira_pagina = contexto['cliente'].get('/api/transacoes').get_json()
+    proxima = f"/api/transacoes?cursor={primeira_pagina['proximo_cursor'] or ''}"
+
+    def get(url):
+        return lambda cliente, _: cliente.get(url)
+
+    def pdf(cliente, _):
+        # PDF gerado do zero: o cache em disco é limpo antes de cada requisição
+        shutil.rmtree(contexto['relatorios_cache'], ignore_errors=True)
+        return cliente.get(f'/relatorio/pdf?{periodo}&tipo=todos')
+
+    planilha_importacao = gerar_csv_importacao(contexto['categorias'], contexto['linhas_importacao'], contexto['semente'])
+
+    def importar(cliente, repeticao):
+        planilha = planilha_importacao.replace(MARCADOR_IMPORTACAO, f'#{time.time_ns()}-{repeticao}'.encode())
+        return cliente.post(
+            '/importar_planilha', data={'planilha': (io.BytesIO(planilha), 'benchmark.csv')},
+            headers={'Accept': 'text/html'}
+        )
+
+    return [
+        ('api_transacoes', '/api/transacoes', False, get('/api/transacoes'), contar_transacoes_json),
+        ('api_transacoes (página seguinte)', proxima, False, get(proxima), contar_transacoes_json),
+        ('api_transacoes (stream)', f'/api/transacoes?stream=1&{periodo}', False,
+         get(f'/api/transacoes?stream=1&{periodo}'), contar_transacoes_json),
+        ('api_transacoes_busca', '/api/transacoes/busca?q=mercado', False,
+         get('/api/transacoes/busca?q=mercado'), contar_transacoes_json),
+        ('api_saldo', '/api/relatorios/saldo', False, get('/api/relatorios/saldo'), None),
+        ('api_mensal', '/api/relatorios/mensal', False, get('/api/relatorios/mensal'), None),
+        ('api_categorias', '/api/relatorios/categorias', False, get('/api/relatorios/categorias'), None),
+        ('api_dashboard', '/api/dashboard', False, get('/api/dashboard'), None),
+        ('api_relatorio_detalhado', f'/api/relatorios/detalhado?{periodo}&tipo=todos', False,
+         get(f'/api/relatorios/detalhado?{periodo}&tipo=todos'), contar_transacoes_json),
+        ('relatorio_export (csv)', f'/relatorio/export?{periodo}', False,
+         get(f'/relatorio/export?{periodo}'), contar_linhas_csv),
+        ('relatorio_pdf', f'/relatorio/pdf?{periodo}&tipo=todos', True, pdf, lambda _: contexto['linhas_periodo']),
+        ('relatorio_pdf (cache)', f'/relatorio/pdf?{periodo}&tipo=todos', False,
+         get(f'/relatorio/pdf?{periodo}&tipo=todos'), lambda _: contexto['linhas_periodo']),
+        # Por último: é a única rota que altera o banco
+        ('importar_planilha', '/importar_planilha', True, importar, lambda _: contexto['linhas_importacao']),
+    ]
+
+def medir_rota(cliente, funcao, contar, repeticoes):
+    # Uma requisição de aquecimento, fora da medição
+    resposta = funcao(cliente, -1)
+    linhas = contar(resposta) if contar else None
+    resposta.close()
+
+    tempos = []
+    status = set()
+
+    def executar():
+        for repeticao in range(repeticoes):
+            inicio = time.perf_counter()
+            resposta = funcao(cliente, repeticao)
+            resposta.get_data()  # respostas em streaming só terminam quando lidas
+            tempos.append(time.perf_counter() - inicio)
+            status.add(resposta.status_code)
+            resposta.close()
+
+    _, pico = medir_pico_rss(executar)
+    return tempos, linhas, pico, status
+
+# --- Execução ---
+
+def preparar(args, pasta):
+    caminho = args.banco or os.path.join(pasta, 'benchmark.db')
+    if not args.banco:
+        print(f'Gerando {args.linhas} transações...')
+        gerador.criar_banco(caminho, args.linhas, args.semente)
+
+    app = aplicacao.create_app({
+        'DATABASE': caminho,
+        'UPLOAD_FOLDER': os.path.join(pasta, 'uploads'),
+        'RELATORIOS_CACHE': os.path.join(pasta, 'relatorios_cache'),
+        # O PDF é medido na própria requisição, nunca em segundo plano
+        'RELATORIO_PDF_LIMITE_SINCRONO': float('inf'),
+    })
+    with app.app_context():
+        aplicacao.init_db()
+
+    conn = database.connect(caminho)
+    user_id = gerador.obter_usuario(conn, 'benchmark')
+    fim = conn.execute('SELECT MAX(data) FROM transacoes WHERE user_id = ?', (user_id,)).fetchone()[0]
+    fim = date.fromisoformat(fim) if fim else date.today()
+    inicio = fim - timedelta(days=args.dias - 1)
+    contexto = {
+        'caminho': caminho,
+        'inicio': inicio.isoformat(),
+        'fim': fim.isoformat(),
+        'categorias': gerador.carregar_categorias(conn),
+        'linhas_importacao': args.linhas_importacao,
+        'semente': args.semente,
+        'relatorios_cache': app.config['RELATORIOS_CACHE'],
+        'total': conn.execute('SELECT COUNT(*) FROM transacoes WHERE user_id = ?', (user_id,)).fetchone()[0],
+        'linhas_periodo': conn.execute(
+            'SELECT COUNT(*) FROM transacoes WHERE user_id = ? AND data BETWEEN ? AND ?',
+            (user_id, inicio.isoformat(), fim.isoformat())
+        ).fetchone()[0],
+    }
+    conn.close()
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = user_id
+    contexto['cliente'] = cliente
+    return contexto
+
+def comparar(resultado, anterior):
+    print(f"\nComparação com a execução de {anterior.get('gerado_em', '?')}:")
+    for nome, rota in resultado['rotas'].items():
+        antes = anterior.get('rotas', {}).get(nome)
+        if not antes:
+            continue
+        variacoes = []
+        for metrica in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if antes[metrica]:
+                variacoes.append(f"{metrica[:3]} {(rota[metrica] / antes[metrica] - 1) * 100:+6.1f}%")
+        print(f"  {nome:<34} {'  '.join(variacoes)}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--banco', help='banco já gerado com benchmarks/gerador.py')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--repeticoes', type=int, default=30)
+    parser.add_argument('--dias', type=int, default=30, help='período dos relatórios, terminando na última transação')
+    parser.add_argument('--linhas-importacao', type=int, default=1000)
+    parser.add_argument('--saida', default=f"rotas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument('--comparar', help='JSON de uma execução anterior')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        contexto = preparar(args, pasta)
+        print(f"{contexto['total']} transações; período dos relatórios {contexto['inicio']} a {contexto['fim']} "
+              f"({contexto['linhas_periodo']} transações)\n")
+        print(f"{'rota':<34} {'p50':>9} {'p95':>9} {'p99':>9} {'linhas/s':>12} {'RSS':>9}")
+
+        rotas = {}
+        for nome, url, pesada, funcao, contar in definir_rotas(contexto):
+            repeticoes = max(1, round(args.repeticoes * FRACAO_REPETICOES_PESADAS)) if pesada else args.repeticoes
+            tempos, linhas, pico, status = medir_rota(contexto['cliente'], funcao, contar, repeticoes)
+            rota = rotas[nome] = resumir(url, tempos, linhas, pico, status)
+            linhas_por_s = f"{rota['linhas_por_s']:,.0f}" if rota['linhas_por_s'] else '-'
+            print(f"{nome:<34} {rota['p50_ms']:>7.1f}ms {rota['p95_ms']:>7.1f}ms {rota['p99_ms']:>7.1f}ms "
+                  f"{linhas_por_s:>12} {rota['rss_pico_mb']:>7.1f}MB")
+
+        tamanho_banco = os.path.getsize(contexto['caminho'])
+
+    resultado = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parametros': {
+            'linhas': contexto['total'],
+            'banco': args.banco,
+            'semente': args.semente,
+            'repeticoes': args.repeticoes,
+            'dias': args.dias,
+            'linhas_periodo': contexto['linhas_periodo'],
+            'linhas_importacao': args.linhas_importacao,
+            'tamanho_banco_mb': round(tamanho_banco / 2 ** 20, 1),
+        },
+        'rotas': rotas,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f'\n✓ Resultado gravado em {args.saida}')
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            comparar(resultado, json.load(arquivo))
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,792 @@
+import re
 import sqlite3
+import time
+from flask import g, current_app
 
-def get_db_connection():
-    conn = sqlite3.connect('livro_caixa.db')
+import metricas
+
+DATABASE = 'livro_caixa.db'
+
+# Tempo (em segundos) que uma conexão espera pelo lock de escrita antes de
+# desistir com "database is locked". Escritores concorrentes entram na fila.
+BUSY_TIMEOUT = 10
+
+# PRAGMAs aplicados a cada nova conexão
+PRAGMAS = (
+    ('journal_mode', 'WAL'),        # leitores não bloqueiam escritores
+    ('synchronous', 'NORMAL'),      # seguro em WAL e bem mais rápido que FULL
+    ('cache_size', -20000),         # ~20 MB de cache de páginas
+    ('mmap_size', 268435456),       # 256 MB de I/O mapeado em memória
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', BUSY_TIMEOUT * 1000),
+)
+
+# Consultas acima deste tempo (em ms) são impressas no console; nas
+# requisições vale a configuração SQL_LENTA_MS do app
+SQL_LENTA_MS = 250
+
+# --- Conexão instrumentada ---
+# Cada consulta mede o tempo gasto dentro do SQLite (execute e leitura das
+# linhas, sem contar o que o código faz entre um fetch e outro) e conta as
+# linhas; ao terminar (cursor esgotado, fechado, reutilizado ou descartado)
+# alimenta as métricas e, se passou do limite, é impressa como lenta.
+
+def registrar_consulta(conn, sql, segundos, linhas):
+    palavra = re.match(r'\s*(\w+)', sql)
+    operacao = palavra.group(1).upper() if palavra else '?'
+    metricas.observar('livro_caixa_sql_segundos', segundos, operacao=operacao)
+    metricas.incrementar('livro_caixa_sql_linhas_total', linhas, operacao=operacao)
+    acumulador = getattr(conn, 'acumulador', None)
+    if acumulador is not None:
+        acumulador['consultas'] += 1
+        acumulador['sql'] += segundos
+    if segundos * 1000 >= getattr(conn, 'lenta_ms', SQL_LENTA_MS):
+        metricas.incrementar('livro_caixa_sql_lentas_total', operacao=operacao)
+        print(f"✗ Consulta lenta ({segundos * 1000:.1f} ms, {linhas} linhas): {' '.join(sql.split())[:500]}")
+
+_proxima_linha = sqlite3.Cursor.__next__
+
+class CursorRastreado(sqlite3.Cursor):
+    _consulta = None  # [sql, segundos, linhas lidas] da consulta em andamento
+
+    def _medir(self, metodo, *args):
+        inicio = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            if self._consulta is not None:
+                self._consulta[1] += time.perf_counter() - inicio
+
+    def _encerrar(self):
+        consulta, self._consulta = self._consulta, None
+        if consulta is not None:
+            sql, segundos, linhas = consulta
+            registrar_consulta(self.connection, sql, segundos, linhas or max(self.rowcount, 0))
+
+    def _iniciar(self, sql, metodo, *args):
+        self._encerrar()
+        self._consulta = [sql, 0.0, 0]
+        return self._medir(metodo, *args)
+
+    def execute(self, sql, parameters=()):
+        return self._iniciar(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._iniciar(sql, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        cursor = self._iniciar(sql_script, super().executescript, sql_script)
+        self._encerrar()
+        return cursor
+
+    def __next__(self):
+        # Chamado uma vez por linha: evita _medir e super() neste caminho
+        inicio = time.perf_counter()
+        try:
+            row = _proxima_linha(self)
+        except StopIteration:
+            self._encerrar()
+            raise
+        consulta = self._consulta
+        if consulta is not None:
+            consulta[1] += time.perf_counter() - inicio
+            consulta[2] += 1
+        return row
+
+    def fetchone(self):
+        row = self._medir(super().fetchone)
+        if row is None:
+            self._encerrar()
+        elif self._consulta is not None:
+            self._consulta[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._medir(super().fetchmany, self.arraysize if size is None else size)
+        if self._consulta is not None:
+            self._consulta[2] += len(rows)
+        if not rows:
+            self._encerrar()
+        return rows
+
+    def fetchall(self):
+        rows = self._medir(super().fetchall)
+        if self._consulta is not None:
+            self._consulta[2] += len(rows)
+        self._encerrar()
+        return rows
+
+    def close(self):
+        self._encerrar()
+        super().close()
+
+    def __del__(self):
+        # Cursor descartado antes de esgotar (ex.: execute(...).fetchone())
+        try:
+            self._encerrar()
+        except Exception:
+            pass
+
+class ConexaoRastreada(sqlite3.Connection):
+    acumulador = None  # dict {'consultas', 'sql'} da requisição, se houver
+    lenta_ms = SQL_LENTA_MS
+
+    # Os atalhos do sqlite3.Connection criam o cursor em C, sem passar pelo
+    # cursor() abaixo; por isso são redefinidos aqui
+    def cursor(self, factory=CursorRastreado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+def connect(path=None):
+    conn = sqlite3.connect(path or DATABASE, timeout=BUSY_TIMEOUT, factory=ConexaoRastreada)
     conn.row_factory = sqlite3.Row
+    for pragma, valor in PRAGMAS:
+        conn.execute(f'PRAGMA {pragma} = {valor}')
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS transacoes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            descricao TEXT NOT NULL,
-            valor REAL NOT NULL,
-            tipo TEXT NOT NULL,
-            categoria TEXT NOT NULL,
-            data DATE NOT NULL
-        )
+# --- Conexão por requisição (guardada em flask.g) ---
+
+def get_db():
+    if 'db' not in g:
+        g.db = connect(current_app.config.get('DATABASE', DATABASE))
+        # Consultas da requisição somam no acumulador criado pelo app.py
+        g.db.acumulador = g.get('metricas')
+        g.db.lenta_ms = current_app.config.get('SQL_LENTA_MS', SQL_LENTA_MS)
+    return g.db
+
+def close_db(e=None):
+    db = g.pop('db', None)
+    if db is not None:
+        if db.in_transaction:
+            db.rollback()
+        db.close()
+
+def init_app(app):
+    app.config.setdefault('DATABASE', DATABASE)
+    app.teardown_appcontext(close_db)
+
+# --- Tabela de resumo (resumo_mensal) ---
+
+# Mês de uma transação; datas fora do padrão caem no prefixo "AAAA-MM"
+MES_RESUMO = "COALESCE(strftime('%Y-%m', {data}), substr({data}, 1, 7))"
+
+# Versão original do resumo, sem user_id: usada só pela migração 3, que não
+# pode mudar depois de publicada
+SQL_AGREGAR_RESUMO_V3 = f'''
+    SELECT {MES_RESUMO.format(data='data')} AS mes, tipo, categoria,
+           COUNT(*) AS quantidade, ROUND(SUM(valor), 2) AS total
+    FROM transacoes GROUP BY mes, tipo, categoria
+'''
+
+SQL_RESUMO_INSERT_V3 = f'''
+    INSERT INTO resumo_mensal (mes, tipo, categoria, quantidade, total)
+    VALUES ({MES_RESUMO.format(data='NEW.data')}, NEW.tipo, NEW.categoria, 1, ROUND(NEW.valor, 2))
+    ON CONFLICT (mes, tipo, categoria) DO UPDATE
+    SET quantidade = quantidade + 1, total = ROUND(total + excluded.total, 2);
+'''
+
+SQL_RESUMO_DELETE_V3 = f'''
+    UPDATE resumo_mensal SET quantidade = quantidade - 1, total = ROUND(total - OLD.valor, 2)
+    WHERE mes = {MES_RESUMO.format(data='OLD.data')} AND tipo = OLD.tipo AND categoria = OLD.categoria;
+    DELETE FROM resumo_mensal
+    WHERE mes = {MES_RESUMO.format(data='OLD.data')} AND tipo = OLD.tipo AND categoria = OLD.categoria
+      AND quantidade <= 0;
+'''
+
+# Resumo por usuário (migração 9 em diante). Transações sem dono (bancos
+# antigos sem nenhum usuário cadastrado) ficam no usuário 0.
+USUARIO_RESUMO = 'IFNULL({linha}user_id, 0)'
+
+SQL_AGREGAR_RESUMO = f'''
+    SELECT {USUARIO_RESUMO.format(linha='')} AS user_id, {MES_RESUMO.format(data='data')} AS mes, tipo, categoria,
+           COUNT(*) AS quantidade, ROUND(SUM(valor), 2) AS total
+    FROM transacoes GROUP BY 1, mes, tipo, categoria
+'''
+
+SQL_RESUMO_INSERT = f'''
+    INSERT INTO resumo_mensal (user_id, mes, tipo, categoria, quantidade, total)
+    VALUES ({USUARIO_RESUMO.format(linha='NEW.')}, {MES_RESUMO.format(data='NEW.data')}, NEW.tipo, NEW.categoria, 1, ROUND(NEW.valor, 2))
+    ON CONFLICT (user_id, mes, tipo, categoria) DO UPDATE
+    SET quantidade = quantidade + 1, total = ROUND(total + excluded.total, 2);
+'''
+
+SQL_RESUMO_DELETE = f'''
+    UPDATE resumo_mensal SET quantidade = quantidade - 1, total = ROUND(total - OLD.valor, 2)
+    WHERE user_id = {USUARIO_RESUMO.format(linha='OLD.')} AND mes = {MES_RESUMO.format(data='OLD.data')}
+      AND tipo = OLD.tipo AND categoria = OLD.categoria;
+    DELETE FROM resumo_mensal
+    WHERE user_id = {USUARIO_RESUMO.format(linha='OLD.')} AND mes = {MES_RESUMO.format(data='OLD.data')}
+      AND tipo = OLD.tipo AND categoria = OLD.categoria AND quantidade <= 0;
+'''
+
+# Busca textual (migração 10 em diante). Numa tabela FTS5 de conteúdo
+# externo a remoção precisa dos mesmos valores que foram indexados.
+SQL_BUSCA_INSERT = '''
+    INSERT INTO transacoes_busca (rowid, descricao, observacoes, categoria)
+    VALUES (NEW.id, NEW.descricao, NEW.observacoes, NEW.categoria);
+'''
+
+SQL_BUSCA_DELETE = '''
+    INSERT INTO transacoes_busca (transacoes_busca, rowid, descricao, observacoes, categoria)
+    VALUES ('delete', OLD.id, OLD.descricao, OLD.observacoes, OLD.categoria);
+'''
+
+SQL_VERSAO_USUARIO = '''
+    INSERT INTO versao_usuario (user_id, versao) VALUES ({usuario}, 1)
+    ON CONFLICT (user_id) DO UPDATE SET versao = versao + 1;
+'''
+
+# Saldo diário (migração 11 em diante): o movimento líquido de cada dia e o
+# saldo acumulado até ele (soma de prefixos). Os triggers só atualizam o
+# movimento e marcam em saldo_pendente o dia mais antigo alterado; o saldo
+# acumulado dali em diante é recalculado na próxima leitura
+# (atualizar_saldo_diario). Lançar no dia de hoje recalcula um dia só;
+# lançar com data retroativa, todos os dias seguintes.
+DIA_SALDO = "COALESCE(date({data}), substr({data}, 1, 10))"
+MOVIMENTO_SALDO = "CASE {linha}tipo WHEN 'receita' THEN {linha}valor WHEN 'despesa' THEN -{linha}valor ELSE 0 END"
+
+SQL_AGREGAR_SALDO = f'''
+    SELECT user_id, dia, quantidade, movimento,
+           ROUND(SUM(movimento) OVER (PARTITION BY user_id ORDER BY dia), 2) AS saldo
+    FROM (
+        SELECT {USUARIO_RESUMO.format(linha='')} AS user_id, {DIA_SALDO.format(data='data')} AS dia,
+               COUNT(*) AS quantidade, ROUND(SUM({MOVIMENTO_SALDO.format(linha='')}), 2) AS movimento
+        FROM transacoes GROUP BY 1, 2
+    )
+'''
+
+SQL_SALDO_PENDENTE = '''
+    INSERT INTO saldo_pendente (user_id, desde) VALUES ({usuario}, {dia})
+    ON CONFLICT (user_id) DO UPDATE SET desde = MIN(desde, excluded.desde);
+'''
+
+SQL_SALDO_INSERT = f'''
+    INSERT INTO saldo_diario (user_id, dia, quantidade, movimento)
+    VALUES ({USUARIO_RESUMO.format(linha='NEW.')}, {DIA_SALDO.format(data='NEW.data')}, 1, ROUND({MOVIMENTO_SALDO.format(linha='NEW.')}, 2))
+    ON CONFLICT (user_id, dia) DO UPDATE
+    SET quantidade = quantidade + 1, movimento = ROUND(movimento + excluded.movimento, 2);
+    {SQL_SALDO_PENDENTE.format(usuario=USUARIO_RESUMO.format(linha='NEW.'), dia=DIA_SALDO.format(data='NEW.data'))}
+'''
+
+SQL_SALDO_DELETE = f'''
+    UPDATE saldo_diario SET quantidade = quantidade - 1, movimento = ROUND(movimento - {MOVIMENTO_SALDO.format(linha='OLD.')}, 2)
+    WHERE user_id = {USUARIO_RESUMO.format(linha='OLD.')} AND dia = {DIA_SALDO.format(data='OLD.data')};
+    DELETE FROM saldo_diario
+    WHERE user_id = {USUARIO_RESUMO.format(linha='OLD.')} AND dia = {DIA_SALDO.format(data='OLD.data')} AND quantidade <= 0;
+    {SQL_SALDO_PENDENTE.format(usuario=USUARIO_RESUMO.format(linha='OLD.'), dia=DIA_SALDO.format(data='OLD.data'))}
+'''
+
+# Refaz a soma de prefixos de um usuário a partir de :desde, partindo do
+# saldo do último dia anterior (:base)
+SQL_SALDO_RECALCULAR = '''
+    UPDATE saldo_diario SET saldo = ROUND(:base + novo.acumulado, 2)
+    FROM (
+        SELECT dia, SUM(movimento) OVER (ORDER BY dia) AS acumulado
+        FROM saldo_diario WHERE user_id = :user_id AND dia >= :desde
+    ) AS novo
+    WHERE saldo_diario.user_id = :user_id AND saldo_diario.dia = novo.dia
+'''
+
+# Registro de mudanças (migração 12 em diante): cada transação tem uma
+# linha em mudancas com o seq da sua última alteração; excluida = 1 é a
+# lápide de uma exclusão. seq só cresce (AUTOINCREMENT), então "tudo o que
+# mudou desde seq N" é um intervalo do índice (user_id, seq).
+SQL_MUDANCA = '''
+    DELETE FROM mudancas WHERE transacao_id = {linha}id;
+    INSERT INTO mudancas (user_id, transacao_id, excluida) VALUES ({usuario}, {linha}id, {excluida});
+'''
+
+# Anos fechados (migração 13 em diante, ver arquivamento.py): as transações
+# saem do banco e os totais ficam em resumo_arquivado (por mês e categoria)
+# e totais_arquivados (por dia e tipo). A reconstrução e a conferência dos
+# resumos somam as duas partes; as migrações antigas continuam com as
+# versões acima.
+# Movimento (receita - despesa) de uma linha de totais_arquivados
+MOVIMENTO_ARQUIVADO = "CASE tipo WHEN 'receita' THEN total WHEN 'despesa' THEN -total ELSE 0 END"
+
+SQL_AGREGAR_RESUMO_COMPLETO = f'''
+    {SQL_AGREGAR_RESUMO}
+    UNION ALL
+    SELECT user_id, mes, tipo, categoria, quantidade, total FROM resumo_arquivado
+'''
+
+SQL_AGREGAR_SALDO_COMPLETO = f'''
+    SELECT user_id, dia, SUM(quantidade) AS quantidade, ROUND(SUM(movimento), 2) AS movimento,
+           ROUND(SUM(SUM(movimento)) OVER (PARTITION BY user_id ORDER BY dia), 2) AS saldo
+    FROM (
+        SELECT {USUARIO_RESUMO.format(linha='')} AS user_id, {DIA_SALDO.format(data='data')} AS dia,
+               COUNT(*) AS quantidade, ROUND(SUM({MOVIMENTO_SALDO.format(linha='')}), 2) AS movimento
+        FROM transacoes GROUP BY 1, 2
+        UNION ALL
+        SELECT user_id, dia, quantidade, {MOVIMENTO_ARQUIVADO}
+        FROM totais_arquivados
+    )
+    GROUP BY user_id, dia
+'''
+
+# Transações em anos fechados são recusadas: o total guardado do ano não
+# mudaria e a transação não apareceria nos relatórios do arquivo
+SQL_ANO_FECHADO = '''
+    WHEN EXISTS (SELECT 1 FROM anos_fechados WHERE ano = substr(NEW.data, 1, 4)) BEGIN
+        SELECT RAISE(ABORT, 'Este ano já foi fechado e não aceita lançamentos.');
+    END;
+'''
+
+def rebuild_resumo(conn):
+    conn.executescript(f'''
+        BEGIN;
+        DELETE FROM resumo_mensal;
+        INSERT INTO resumo_mensal (user_id, mes, tipo, categoria, quantidade, total) {SQL_AGREGAR_RESUMO_COMPLETO};
+        DELETE FROM saldo_diario;
+        DELETE FROM saldo_pendente;
+        INSERT INTO saldo_diario (user_id, dia, quantidade, movimento, saldo) {SQL_AGREGAR_SALDO_COMPLETO};
+        COMMIT;
     ''')
-    
-    # Inserir dados de exemplo
-    transacoes_exemplo = [
-        ('Salário', 5000.00, 'receita', 'Salário', '2024-01-05'),
-        ('Aluguel', 1500.00, 'despesa', 'Moradia', '2024-01-10'),
-        ('Supermercado', 450.00, 'despesa', 'Alimentação', '2024-01-12'),
-        ('Freelance', 1200.00, 'receita', 'Trabalho Extra', '2024-01-15'),
-        ('Academia', 120.00, 'despesa', 'Saúde', '2024-01-20')
-    ]
-    
-    for transacao in transacoes_exemplo:
-        conn.execute('''
-            INSERT OR IGNORE INTO transacoes (descricao, valor, tipo, categoria, data)
-            VALUES (?, ?, ?, ?, ?)
-        ''', transacao)
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+
+def atualizar_saldo_diario(conn, user_id, ate=None):
+    # Recalcula o saldo acumulado invalidado por escritas desde a última
+    # leitura. Com "ate", não faz nada se a invalidação começa depois dessa
+    # data (os saldos até ela continuam certos).
+    row = conn.execute('SELECT desde FROM saldo_pendente WHERE user_id = ?', (user_id,)).fetchone()
+    if row is None or (ate is not None and row['desde'] > ate):
+        return
+    # IMMEDIATE: outro processo não altera transacoes entre a leitura de
+    # "desde" e a remoção da pendência
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT desde FROM saldo_pendente WHERE user_id = ?', (user_id,)).fetchone()
+        if row is not None:
+            anterior = conn.execute(
+                'SELECT saldo FROM saldo_diario WHERE user_id = ? AND dia < ? ORDER BY dia DESC LIMIT 1',
+                (user_id, row['desde'])
+            ).fetchone()
+            conn.execute(SQL_SALDO_RECALCULAR, {'user_id': user_id, 'desde': row['desde'], 'base': anterior['saldo'] if anterior else 0})
+            conn.execute('DELETE FROM saldo_pendente WHERE user_id = ?', (user_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def verify_resumo(conn):
+    # Compara resumo_mensal com uma agregação completa de transacoes e
+    # devolve as chaves (user_id, mes, tipo, categoria) que divergem
+    esperado = {
+        (row['user_id'], row['mes'], row['tipo'], row['categoria']): (row['quantidade'], row['total'])
+        for row in conn.execute(SQL_AGREGAR_RESUMO_COMPLETO)
+    }
+    atual = {
+        (row['user_id'], row['mes'], row['tipo'], row['categoria']): (row['quantidade'], row['total'])
+        for row in conn.execute('SELECT * FROM resumo_mensal')
+    }
+    divergencias = []
+    for chave in sorted(esperado.keys() | atual.keys()):
+        quantidade_esperada, total_esperado = esperado.get(chave, (0, 0.0))
+        quantidade_atual, total_atual = atual.get(chave, (0, 0.0))
+        if quantidade_esperada != quantidade_atual or abs(total_esperado - total_atual) > 0.005:
+            divergencias.append((chave, esperado.get(chave), atual.get(chave)))
+    return divergencias + verify_saldo_diario(conn)
+
+def verify_saldo_diario(conn):
+    # Mesma conferência para saldo_diario, com chaves (user_id, dia). O
+    # saldo acumulado só é comparado antes do dia pendente de recálculo.
+    pendentes = {row['user_id']: row['desde'] for row in conn.execute('SELECT * FROM saldo_pendente')}
+    esperado = {
+        (row['user_id'], row['dia']): (row['quantidade'], row['movimento'], row['saldo'])
+        for row in conn.execute(SQL_AGREGAR_SALDO_COMPLETO)
+    }
+    atual = {
+        (row['user_id'], row['dia']): (row['quantidade'], row['movimento'], row['saldo'])
+        for row in conn.execute('SELECT * FROM saldo_diario')
+    }
+    divergencias = []
+    for chave in sorted(esperado.keys() | atual.keys()):
+        quantidade_esperada, movimento_esperado, saldo_esperado = esperado.get(chave, (0, 0.0, None))
+        quantidade_atual, movimento_atual, saldo_atual = atual.get(chave, (0, 0.0, None))
+        desde = pendentes.get(chave[0])
+        saldo_divergente = (desde is None or chave[1] < desde) and (
+            saldo_esperado is None or saldo_atual is None or abs(saldo_esperado - saldo_atual) > 0.005
+        )
+        if quantidade_esperada != quantidade_atual or abs(movimento_esperado - movimento_atual) > 0.005 or saldo_divergente:
+            divergencias.append((chave, esperado.get(chave), atual.get(chave)))
+    return divergencias
+
+# --- Migrações de esquema (versionadas por PRAGMA user_version) ---
+
+# Cada item é um script SQL; a posição na lista (a partir de 1) é a versão
+# do esquema depois que ele é aplicado. Nunca altere um item já publicado:
+# acrescente uma nova migração no fim da lista.
+MIGRATIONS = [
+    # 1: índices para os relatórios, o dashboard e a checagem de duplicadas.
+    # O índice de deduplicação não é UNIQUE porque lançamentos manuais
+    # idênticos no mesmo dia são legítimos e já existem em bancos em uso.
+    '''
+    CREATE INDEX IF NOT EXISTS idx_transacoes_dedupe ON transacoes (data, descricao, valor, tipo);
+    CREATE INDEX IF NOT EXISTS idx_transacoes_tipo_data ON transacoes (tipo, data);
+    CREATE INDEX IF NOT EXISTS idx_transacoes_tipo_categoria ON transacoes (tipo, categoria, valor);
+    ''',
+    # 2: paginação por cursor em (data, id) na listagem de transações
+    '''
+    CREATE INDEX IF NOT EXISTS idx_transacoes_data ON transacoes (data);
+    ''',
+    # 3: totais por mês, tipo e categoria mantidos por triggers para o dashboard
+    f'''
+    CREATE TABLE IF NOT EXISTS resumo_mensal (
+        mes TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (mes, tipo, categoria)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_insert AFTER INSERT ON transacoes BEGIN
+        {SQL_RESUMO_INSERT_V3}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_delete AFTER DELETE ON transacoes BEGIN
+        {SQL_RESUMO_DELETE_V3}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_update AFTER UPDATE OF data, tipo, categoria, valor ON transacoes BEGIN
+        {SQL_RESUMO_DELETE_V3}
+        {SQL_RESUMO_INSERT_V3}
+    END;
+
+    DELETE FROM resumo_mensal;
+    INSERT INTO resumo_mensal (mes, tipo, categoria, quantidade, total) {SQL_AGREGAR_RESUMO_V3};
+    ''',
+    # 4: contador de versão dos dados, incrementado a cada escrita em transacoes
+    '''
+    CREATE TABLE IF NOT EXISTS versao_dados (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        versao INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO versao_dados (id, versao) VALUES (1, 0);
+
+    CREATE TRIGGER IF NOT EXISTS trg_versao_insert AFTER INSERT ON transacoes BEGIN
+        UPDATE versao_dados SET versao = versao + 1 WHERE id = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_versao_delete AFTER DELETE ON transacoes BEGIN
+        UPDATE versao_dados SET versao = versao + 1 WHERE id = 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_versao_update AFTER UPDATE ON transacoes BEGIN
+        UPDATE versao_dados SET versao = versao + 1 WHERE id = 1;
+    END;
+    ''',
+    # 5: progresso e relatório das importações de planilhas
+    '''
+    CREATE TABLE IF NOT EXISTS importacoes (
+        id TEXT PRIMARY KEY,
+        arquivo TEXT NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('processando', 'concluida', 'erro')),
+        total_linhas INTEGER,
+        linhas_lidas INTEGER NOT NULL DEFAULT 0,
+        importadas INTEGER NOT NULL DEFAULT 0,
+        rejeitadas INTEGER NOT NULL DEFAULT 0,
+        relatorio TEXT,
+        erro TEXT,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    # 6: jobs de OCR processados em segundo plano
+    '''
+    CREATE TABLE IF NOT EXISTS ocr_jobs (
+        id TEXT PRIMARY KEY,
+        arquivo TEXT NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('processando', 'concluido', 'erro')),
+        valor REAL,
+        erro TEXT,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        concluido_em TIMESTAMP
+    );
+    ''',
+    # 7: contagem de referências dos anexos e cache de resultados do OCR
+    '''
+    CREATE TABLE IF NOT EXISTS anexos (
+        arquivo TEXT PRIMARY KEY,
+        referencias INTEGER NOT NULL DEFAULT 0,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT OR IGNORE INTO anexos (arquivo, referencias)
+    SELECT anexo, COUNT(*) FROM transacoes WHERE anexo IS NOT NULL GROUP BY anexo;
+
+    CREATE TRIGGER IF NOT EXISTS trg_anexos_insert AFTER INSERT ON transacoes
+    WHEN NEW.anexo IS NOT NULL BEGIN
+        INSERT INTO anexos (arquivo, referencias) VALUES (NEW.anexo, 1)
+        ON CONFLICT (arquivo) DO UPDATE SET referencias = referencias + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_anexos_delete AFTER DELETE ON transacoes
+    WHEN OLD.anexo IS NOT NULL BEGIN
+        UPDATE anexos SET referencias = referencias - 1 WHERE arquivo = OLD.anexo;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_anexos_update AFTER UPDATE OF anexo ON transacoes
+    WHEN OLD.anexo IS NOT NEW.anexo BEGIN
+        UPDATE anexos SET referencias = referencias - 1 WHERE arquivo = OLD.anexo;
+        INSERT INTO anexos (arquivo, referencias) SELECT NEW.anexo, 1 WHERE NEW.anexo IS NOT NULL
+        ON CONFLICT (arquivo) DO UPDATE SET referencias = referencias + 1;
+    END;
+
+    CREATE TABLE IF NOT EXISTS ocr_cache (
+        chave TEXT PRIMARY KEY,
+        valor REAL NOT NULL,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    # 8: relatórios em PDF gerados em segundo plano
+    '''
+    CREATE TABLE IF NOT EXISTS relatorios_pdf (
+        chave TEXT PRIMARY KEY,
+        status TEXT NOT NULL CHECK(status IN ('processando', 'concluido', 'erro')),
+        linhas INTEGER,
+        erro TEXT,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        concluido_em TIMESTAMP
+    );
+    ''',
+    # 9: transações por usuário. Até aqui havia um livro só, compartilhado:
+    # as transações existentes passam para o primeiro usuário cadastrado.
+    # Índices, resumo_mensal e a versão dos dados passam a começar por
+    # user_id, para que cada consulta leia só as linhas de quem a fez.
+    f'''
+    ALTER TABLE transacoes ADD COLUMN user_id INTEGER REFERENCES users (id);
+    UPDATE transacoes SET user_id = (SELECT MIN(id) FROM users);
+
+    DROP INDEX IF EXISTS idx_transacoes_dedupe;
+    DROP INDEX IF EXISTS idx_transacoes_tipo_data;
+    DROP INDEX IF EXISTS idx_transacoes_tipo_categoria;
+    DROP INDEX IF EXISTS idx_transacoes_data;
+    CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_data ON transacoes (user_id, data);
+    CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_tipo_data ON transacoes (user_id, tipo, data);
+    CREATE INDEX IF NOT EXISTS idx_transacoes_usuario_dedupe ON transacoes (user_id, data, descricao, valor, tipo);
+
+    DROP TRIGGER IF EXISTS trg_resumo_insert;
+    DROP TRIGGER IF EXISTS trg_resumo_delete;
+    DROP TRIGGER IF EXISTS trg_resumo_update;
+    DROP TABLE IF EXISTS resumo_mensal;
+    CREATE TABLE resumo_mensal (
+        user_id INTEGER NOT NULL,
+        mes TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (user_id, mes, tipo, categoria)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER trg_resumo_insert AFTER INSERT ON transacoes BEGIN
+        {SQL_RESUMO_INSERT}
+    END;
+
+    CREATE TRIGGER trg_resumo_delete AFTER DELETE ON transacoes BEGIN
+        {SQL_RESUMO_DELETE}
+    END;
+
+    CREATE TRIGGER trg_resumo_update AFTER UPDATE OF user_id, data, tipo, categoria, valor ON transacoes BEGIN
+        {SQL_RESUMO_DELETE}
+        {SQL_RESUMO_INSERT}
+    END;
+
+    INSERT INTO resumo_mensal (user_id, mes, tipo, categoria, quantidade, total) {SQL_AGREGAR_RESUMO};
+
+    CREATE TABLE IF NOT EXISTS versao_usuario (
+        user_id INTEGER PRIMARY KEY,
+        versao INTEGER NOT NULL
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_versao_usuario_insert AFTER INSERT ON transacoes BEGIN
+        {SQL_VERSAO_USUARIO.format(usuario=USUARIO_RESUMO.format(linha='NEW.'))}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_versao_usuario_delete AFTER DELETE ON transacoes BEGIN
+        {SQL_VERSAO_USUARIO.format(usuario=USUARIO_RESUMO.format(linha='OLD.'))}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_versao_usuario_update AFTER UPDATE ON transacoes BEGIN
+        {SQL_VERSAO_USUARIO.format(usuario=USUARIO_RESUMO.format(linha='OLD.'))}
+        {SQL_VERSAO_USUARIO.format(usuario=USUARIO_RESUMO.format(linha='NEW.'))}
+    END;
+    ''',
+    # 10: busca textual em descrição, observações e categoria. O índice FTS5
+    # usa transacoes como conteúdo externo (não guarda outra cópia dos
+    # textos); remove_diacritics faz "agua" encontrar "Água" e os índices de
+    # prefixo aceleram a busca enquanto se digita. No ranking (bm25) a
+    # descrição pesa mais que a categoria e as observações.
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS transacoes_busca USING fts5(
+        descricao, observacoes, categoria,
+        content = 'transacoes', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    );
+    INSERT INTO transacoes_busca (transacoes_busca, rank) VALUES ('rank', 'bm25(10.0, 2.0, 5.0)');
+
+    CREATE TRIGGER IF NOT EXISTS trg_busca_insert AFTER INSERT ON transacoes BEGIN
+        {SQL_BUSCA_INSERT}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_busca_delete AFTER DELETE ON transacoes BEGIN
+        {SQL_BUSCA_DELETE}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_busca_update AFTER UPDATE OF descricao, observacoes, categoria ON transacoes BEGIN
+        {SQL_BUSCA_DELETE}
+        {SQL_BUSCA_INSERT}
+    END;
+
+    INSERT INTO transacoes_busca (transacoes_busca) VALUES ('rebuild');
+    ''',
+    # 11: saldo diário com soma de prefixos, para o saldo em uma data e a
+    # série do saldo acumulado sem somar todas as transações anteriores.
+    # saldo fica NULL nos dias ainda não recalculados (a partir de
+    # saldo_pendente.desde).
+    f'''
+    CREATE TABLE IF NOT EXISTS saldo_diario (
+        user_id INTEGER NOT NULL,
+        dia TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        movimento REAL NOT NULL,
+        saldo REAL,
+        PRIMARY KEY (user_id, dia)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS saldo_pendente (
+        user_id INTEGER PRIMARY KEY,
+        desde TEXT NOT NULL
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_saldo_insert AFTER INSERT ON transacoes BEGIN
+        {SQL_SALDO_INSERT}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_saldo_delete AFTER DELETE ON transacoes BEGIN
+        {SQL_SALDO_DELETE}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_saldo_update AFTER UPDATE OF user_id, data, tipo, valor ON transacoes BEGIN
+        {SQL_SALDO_DELETE}
+        {SQL_SALDO_INSERT}
+    END;
+
+    INSERT INTO saldo_diario (user_id, dia, quantidade, movimento, saldo) {SQL_AGREGAR_SALDO};
+    ''',
+    # 12: registro de mudanças para a sincronização incremental da lista de
+    # transações (/api/transacoes/mudancas). Começa vazio: quem sincroniza
+    # parte do seq devolvido junto com a primeira página da lista.
+    f'''
+    CREATE TABLE IF NOT EXISTS mudancas (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        transacao_id INTEGER NOT NULL UNIQUE,
+        excluida INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_mudancas_usuario_seq ON mudancas (user_id, seq);
+
+    CREATE TRIGGER IF NOT EXISTS trg_mudancas_insert AFTER INSERT ON transacoes BEGIN
+        {SQL_MUDANCA.format(linha='NEW.', usuario=USUARIO_RESUMO.format(linha='NEW.'), excluida=0)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_mudancas_delete AFTER DELETE ON transacoes BEGIN
+        {SQL_MUDANCA.format(linha='OLD.', usuario=USUARIO_RESUMO.format(linha='OLD.'), excluida=1)}
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_mudancas_update AFTER UPDATE ON transacoes BEGIN
+        {SQL_MUDANCA.format(linha='NEW.', usuario=USUARIO_RESUMO.format(linha='NEW.'), excluida=0)}
+    END;
+    ''',
+    # 13: fechamento de ano. anos_fechados.arquivo é o banco de arquivo que
+    # recebeu as transações do ano (relativo à pasta deste banco).
+    f'''
+    CREATE TABLE IF NOT EXISTS anos_fechados (
+        ano TEXT PRIMARY KEY,
+        arquivo TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        fechado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS resumo_arquivado (
+        user_id INTEGER NOT NULL,
+        mes TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (user_id, mes, tipo, categoria)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS totais_arquivados (
+        user_id INTEGER NOT NULL,
+        dia TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        quantidade INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (user_id, dia, tipo)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS trg_ano_fechado_insert BEFORE INSERT ON transacoes
+    {SQL_ANO_FECHADO}
+
+    CREATE TRIGGER IF NOT EXISTS trg_ano_fechado_update BEFORE UPDATE OF data ON transacoes
+    {SQL_ANO_FECHADO}
+    ''',
+    # 14: dono de cada relatório em PDF, conferido no download (a chave do
+    # cache é um hash previsível dos filtros). Relatórios gerados antes disso
+    # ficam sem dono e são gerados de novo.
+    '''
+    ALTER TABLE relatorios_pdf ADD COLUMN user_id INTEGER REFERENCES users (id);
+    ''',
+    # 15: dono dos jobs de OCR e das importações, filtrado em toda consulta
+    # por id (os ids circulam nas URLs de acompanhamento)
+    '''
+    ALTER TABLE ocr_jobs ADD COLUMN user_id INTEGER REFERENCES users (id);
+    ALTER TABLE importacoes ADD COLUMN user_id INTEGER REFERENCES users (id);
+    ''',
+    # 16: arquivos segurados por jobs de OCR em andamento (anexos.liberar_anexos)
+    '''
+    CREATE INDEX IF NOT EXISTS idx_ocr_jobs_pendentes ON ocr_jobs (arquivo) WHERE status = 'processando';
+    ''',
+]
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    versao = schema_version(conn)
+    for numero, script in enumerate(MIGRATIONS[versao:], start=versao + 1):
+        # executescript faz commit do que estiver pendente, então o BEGIN/COMMIT
+        # explícito garante que a migração e o novo user_version sejam atômicos
+        conn.executescript(f'BEGIN;\n{script}\nPRAGMA user_version = {numero};\nCOMMIT;')
+    if versao < len(MIGRATIONS):
+        conn.execute('PRAGMA optimize')
+    return schema_version(conn)
+
+def data_version(conn, user_id=None):
+    # Muda sempre que transacoes é alterada, em qualquer processo; com
+    # user_id, só quando mudam as transações daquele usuário
+    if user_id is None:
+        return conn.execute('SELECT versao FROM versao_dados WHERE id = 1').fetchone()[0]
+    row = conn.execute('SELECT versao FROM versao_usuario WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def query_plan_scans(conn, consultas, tabela='transacoes'):
+    # Devolve as consultas cujo plano faz varredura completa da tabela
+    # (SCAN sem índice). Varrer um índice de cobertura é aceito, assim como
+    # varrer tabelas pequenas de resumo.
+    problemas = []
+    for nome, sql, params in consultas:
+        for linha in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+            detalhe = linha['detail']
+            if detalhe.startswith(f'SCAN {tabela}') and 'INDEX' not in detalhe:
+                problemas.append((nome, detalhe))
+    return problemas
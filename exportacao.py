@@ -0,0 +1,137 @@
+import csv
+import io
+import os
+import tempfile
+import zlib
+from datetime import date
+
+# Colunas exportadas; os cabeçalhos das cinco primeiras são os mesmos que a
+# importação exige, então um arquivo exportado pode ser importado de volta
+COLUNAS = [
+    ('data', 'Data'),
+    ('descricao', 'Descricao'),
+    ('valor', 'Valor'),
+    ('tipo', 'Tipo'),
+    ('categoria', 'Categoria'),
+    ('forma_pagamento', 'Forma de Pagamento'),
+    ('observacoes', 'Observacoes'),
+]
+
+# Linhas lidas do cursor por vez
+LINHAS_POR_LEITURA = 500
+
+# Pedaços lidos do arquivo .xlsx temporário ao enviá-lo
+TAMANHO_PEDACO = 64 * 1024
+
+def consulta(user_id, data_inicio, data_fim, tipo, tabela='transacoes'):
+    # Mesmos filtros de /api/relatorios/detalhado; "tabela" é a fonte das
+    # linhas (arquivamento.fonte_transacoes, com os anos fechados do período)
+    query = f"SELECT {', '.join(coluna for coluna, _ in COLUNAS)} FROM {tabela} WHERE user_id = ? AND data BETWEEN ? AND ?"
+    params = [user_id, data_inicio, data_fim]
+
+    if tipo != 'todos':
+        query += ' AND tipo = ?'
+        params.append(tipo)
+
+    query += ' ORDER BY data DESC, id DESC'
+    return query, params
+
+def ler_linhas(cursor, lote=LINHAS_POR_LEITURA):
+    while True:
+        linhas = cursor.fetchmany(lote)
+        if not linhas:
+            break
+        yield linhas
+
+def formatar_valor(valor):
+    # Valores numéricos com duas casas; um valor gravado como texto (o
+    # lançamento avulso aceita "10,5") sai como está, em vez de interromper
+    # no meio um arquivo que já está sendo enviado
+    if isinstance(valor, (int, float)):
+        return round(valor, 2)
+    return None if valor is None else str(valor)
+
+# --- CSV ---
+
+def formatar_csv(valor):
+    valor = formatar_valor(valor)
+    return f'{valor:.2f}'.replace('.', ',') if isinstance(valor, (int, float)) else valor
+
+def gerar_csv(cursor):
+    # Gera o CSV aos pedaços, um lote de linhas por vez. Usa ";" e vírgula
+    # decimal, como o Excel em português espera, e BOM para o UTF-8 ser
+    # reconhecido ao abrir o arquivo com dois cliques.
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';', lineterminator='\r\n')
+
+    escritor.writerow([cabecalho for _, cabecalho in COLUNAS])
+    yield '﻿' + buffer.getvalue()
+
+    for linhas in ler_linhas(cursor):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in linhas:
+            escritor.writerow([
+                formatar_csv(valor) if coluna == 'valor' else valor
+                for (coluna, _), valor in zip(COLUNAS, row)
+            ])
+        yield buffer.getvalue()
+
+def comprimir(pedacos):
+    # gzip em streaming: cada pedaço é comprimido assim que é gerado
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for pedaco in pedacos:
+        dados = compressor.compress(pedaco.encode('utf-8'))
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+# --- XLSX ---
+
+def gerar_xlsx(cursor):
+    # O modo write_only do openpyxl grava cada linha num arquivo temporário
+    # em vez de montar a planilha na memória; o .xlsx final também vai para o
+    # disco e é enviado aos pedaços.
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet('Transações')
+    cabecalho = []
+    for _, titulo in COLUNAS:
+        celula = WriteOnlyCell(planilha, value=titulo)
+        celula.font = Font(bold=True)
+        cabecalho.append(celula)
+    planilha.append(cabecalho)
+
+    for linhas in ler_linhas(cursor):
+        for row in linhas:
+            valores = list(row)
+            # Datas como data de verdade, para o Excel ordenar e filtrar
+            try:
+                valores[0] = date.fromisoformat(valores[0])
+            except (TypeError, ValueError):
+                pass
+            valores[2] = formatar_valor(valores[2])
+            planilha.append(valores)
+
+    descritor, caminho = tempfile.mkstemp(suffix='.xlsx')
+    os.close(descritor)
+    try:
+        workbook.save(caminho)
+    except Exception:
+        os.remove(caminho)
+        raise
+    return enviar_arquivo(caminho)
+
+def enviar_arquivo(caminho):
+    try:
+        with open(caminho, 'rb') as arquivo:
+            while True:
+                pedaco = arquivo.read(TAMANHO_PEDACO)
+                if not pedaco:
+                    break
+                yield pedaco
+    finally:
+        os.remove(caminho)
@@ -0,0 +1,58 @@
+# Configuração do gunicorn (servidor de produção no Linux). "gunicorn
+# wsgi:app" na pasta do projeto carrega este arquivo sozinho.
+#
+# O mestre não importa o app: ele só prepara o banco (flask init-db, num
+# subprocesso) e cria os workers; cada worker carrega o código depois do
+# fork, aquece banco e caches (app.aquecer) e atende as requisições. O SQLite
+# em WAL deixa os workers lerem em paralelo; as escritas continuam em fila no
+# lock do banco.
+#
+# Variáveis de ambiente (além das LIVRO_CAIXA_* lidas por create_app):
+#   LIVRO_CAIXA_BIND      endereço (padrão 0.0.0.0:5000)
+#   LIVRO_CAIXA_WORKERS   processos do servidor (padrão: núcleos + 1)
+#   LIVRO_CAIXA_THREADS   threads por worker (padrão 4)
+# O pool de OCR (OCR_WORKERS) é de cada worker: com N workers, até
+# N * OCR_WORKERS processos de OCR.
+#
+# Recarga sem derrubar requisições: kill -HUP <pid do mestre> roda as
+# migrações, relê este arquivo e o código, sobe workers novos e encerra os
+# antigos depois que terminam o que estão atendendo (até graceful_timeout).
+import os
+import subprocess
+import sys
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.environ.get('LIVRO_CAIXA_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('LIVRO_CAIXA_WORKERS', (os.cpu_count() or 1) + 1))
+threads = int(os.environ.get('LIVRO_CAIXA_THREADS', 4))
+worker_class = 'gthread'
+chdir = PASTA
+
+# Cada worker importa o código depois do fork: é o que faz o HUP carregar
+# o código novo
+preload_app = False
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+def preparar_banco(server):
+    # Migrações uma vez só, antes dos workers, pelo mesmo comando da CLI
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'wsgi', 'init-db'], cwd=PASTA, check=True)
+
+def on_starting(server):
+    preparar_banco(server)
+
+def on_reload(server):
+    preparar_banco(server)
+
+def post_worker_init(worker):
+    import app
+
+    app.aquecer(worker.wsgi)
+
+def worker_exit(server, worker):
+    # O pool de OCR do worker não sobrevive a ele
+    if 'ocr' in sys.modules:
+        sys.modules['ocr'].encerrar_pool()
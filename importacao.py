@@ -0,0 +1,276 @@
+import gzip
+import json
+import os
+
+import database
+
+# pandas e openpyxl são importados dentro das funções que leem as planilhas,
+# para não pesar na inicialização do servidor
+
+COLUNAS_OBRIGATORIAS = ['Data', 'Descricao', 'Valor', 'Tipo', 'Categoria']
+EXTENSOES_PERMITIDAS = ('.xlsx', '.csv', '.csv.gz')
+
+# Linhas enviadas ao SQLite por chamada de executemany
+TAMANHO_LOTE = 1000
+
+# Linhas lidas do arquivo (e gravadas com commit) por vez; limita a memória
+# usada, seja qual for o tamanho do arquivo
+LINHAS_POR_LEITURA = 5000
+
+# Quantas linhas rejeitadas guardar no relatório de cada importação
+LIMITE_RELATORIO = 1000
+
+def validar_colunas(df):
+    for coluna in COLUNAS_OBRIGATORIAS:
+        if coluna not in df.columns:
+            return f'A coluna obrigatória "{coluna}" não foi encontrada na planilha.'
+    return None
+
+def converter_datas(coluna):
+    # Datas ISO (AAAA-MM-DD, com ou sem hora) e as células de data do .xlsx
+    # primeiro; o que sobrar é lido como DD/MM/AAAA, o formato das planilhas
+    # brasileiras. Sem formato fixo o pandas lê "05/01/2024" como 1º de maio
+    # e rejeita "13/01/2024".
+    import pandas as pd
+
+    iso = pd.to_datetime(coluna, errors='coerce', format='ISO8601')
+    brasileiro = pd.to_datetime(coluna, errors='coerce', format='%d/%m/%Y')
+    return iso.fillna(brasileiro).dt.strftime('%Y-%m-%d')
+
+def preparar_lote(df, primeira_linha=2):
+    # Valida e normaliza um DataFrame inteiro de uma vez (sem iterrows).
+    # Devolve (validas, rejeitadas): validas é um DataFrame com as colunas já
+    # no formato do banco e rejeitadas é uma lista de {'linha', 'motivo'}.
+    # primeira_linha é o número, na planilha, da primeira linha de dados.
+    import pandas as pd
+
+    lote = pd.DataFrame({
+        'linha': range(primeira_linha, primeira_linha + len(df)),
+        'data': converter_datas(df['Data']),
+        'descricao': df['Descricao'].fillna('').astype(str).str.strip(),
+        'valor': pd.to_numeric(df['Valor'], errors='coerce').round(2),
+        'tipo': df['Tipo'].fillna('').astype(str).str.strip().str.lower(),
+        'categoria': df['Categoria'].fillna('').astype(str).str.strip(),
+    })
+
+    motivo = pd.Series(None, index=lote.index, dtype=object)
+    # Aplicadas da menos para a mais importante: o último motivo prevalece
+    regras = [
+        (lote['categoria'] == '', 'Categoria vazia'),
+        (~lote['tipo'].isin(['receita', 'despesa']), 'Tipo deve ser "receita" ou "despesa"'),
+        (lote['descricao'] == '', 'Descrição vazia'),
+        (lote['valor'].isna(), 'Valor inválido'),
+        (lote['data'].isna(), 'Data inválida'),
+    ]
+    for mascara, texto in regras:
+        motivo[mascara] = texto
+
+    # Linhas repetidas dentro da própria planilha: mantém só a primeira
+    repetidas = motivo.isna() & lote.duplicated(subset=['data', 'descricao', 'valor', 'tipo'])
+    motivo[repetidas] = 'Duplicada na planilha'
+
+    rejeitadas = [
+        {'linha': int(linha), 'motivo': texto}
+        for linha, texto in zip(lote['linha'][motivo.notna()], motivo[motivo.notna()])
+    ]
+    return lote[motivo.isna()], rejeitadas
+
+# --- Importação de um lote (pela tabela temporária temp.importacao) ---
+# Consultas em constantes: flask verificar-planos confere os planos das
+# mesmas que importar_lote executa.
+
+# Anos fechados não aceitam lançamentos (trigger trg_ano_fechado_insert):
+# essas linhas são rejeitadas em vez de abortar o lote inteiro
+ANO_FECHADO = 'substr(i.data, 1, 4) IN (SELECT ano FROM anos_fechados)'
+
+JA_EXISTE = '''EXISTS (
+    SELECT 1 FROM transacoes t
+    WHERE t.user_id = :user_id AND t.data = i.data AND t.descricao = i.descricao AND t.valor = i.valor AND t.tipo = i.tipo
+)'''
+
+SQL_DUPLICADAS = f'SELECT i.linha FROM temp.importacao i WHERE NOT {ANO_FECHADO} AND {JA_EXISTE} ORDER BY i.linha'
+
+SQL_INSERIR = f'''
+    INSERT INTO transacoes (user_id, data, descricao, valor, tipo, categoria)
+    SELECT :user_id, i.data, i.descricao, i.valor, i.tipo, i.categoria FROM temp.importacao i
+    WHERE NOT {ANO_FECHADO} AND NOT {JA_EXISTE}
+    ORDER BY i.linha
+'''
+
+def criar_tabela_importacao(conn):
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS importacao (
+            linha INTEGER PRIMARY KEY,
+            data TEXT, descricao TEXT, valor REAL, tipo TEXT, categoria TEXT
+        )
+    ''')
+
+def importar_lote(conn, user_id, df, primeira_linha=2):
+    # Importa um DataFrame em uma passada: as linhas válidas vão para uma
+    # tabela temporária e as duplicadas (entre as transações do mesmo
+    # usuário) são detectadas com um único SELECT contra o índice
+    # idx_transacoes_usuario_dedupe. Não faz commit: quem chama decide o
+    # tamanho da transação. Devolve (importadas, rejeitadas).
+    validas, rejeitadas = preparar_lote(df, primeira_linha)
+    if validas.empty:
+        return 0, rejeitadas
+
+    criar_tabela_importacao(conn)
+    conn.execute('DELETE FROM temp.importacao')
+
+    registros = list(validas[['linha', 'data', 'descricao', 'valor', 'tipo', 'categoria']].itertuples(index=False, name=None))
+    for inicio in range(0, len(registros), TAMANHO_LOTE):
+        conn.executemany(
+            'INSERT INTO temp.importacao (linha, data, descricao, valor, tipo, categoria) VALUES (?, ?, ?, ?, ?, ?)',
+            registros[inicio:inicio + TAMANHO_LOTE]
+        )
+
+    fechadas = conn.execute(f'SELECT i.linha FROM temp.importacao i WHERE {ANO_FECHADO} ORDER BY i.linha').fetchall()
+    rejeitadas.extend({'linha': row[0], 'motivo': 'Ano já fechado'} for row in fechadas)
+
+    duplicadas = conn.execute(SQL_DUPLICADAS, {'user_id': user_id}).fetchall()
+    rejeitadas.extend({'linha': row[0], 'motivo': 'Transação já existente'} for row in duplicadas)
+
+    cursor = conn.execute(SQL_INSERIR, {'user_id': user_id})
+    conn.execute('DELETE FROM temp.importacao')
+
+    rejeitadas.sort(key=lambda rejeitada: rejeitada['linha'])
+    return cursor.rowcount, rejeitadas
+
+# --- Leitura em streaming de .xlsx e .csv/.csv.gz ---
+
+def extensao_permitida(nome):
+    return nome.lower().endswith(EXTENSOES_PERMITIDAS)
+
+def ler_xlsx(caminho, tamanho):
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    # read_only percorre as linhas sem carregar a pasta de trabalho inteira
+    workbook = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = workbook.active.iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = [str(coluna).strip() if coluna is not None else '' for coluna in cabecalho]
+        largura = len(colunas)
+
+        lote = []
+        lotes_enviados = 0
+        for linha in linhas:
+            if all(valor is None for valor in linha):
+                continue
+            lote.append(tuple(linha[:largura]) + (None,) * (largura - len(linha)))
+            if len(lote) == tamanho:
+                yield pd.DataFrame(lote, columns=colunas)
+                lotes_enviados += 1
+                lote = []
+        # Uma planilha só com cabeçalho ainda gera um lote vazio, para que as
+        # colunas sejam validadas
+        if lote or not lotes_enviados:
+            yield pd.DataFrame(lote, columns=colunas)
+    finally:
+        workbook.close()
+
+def total_linhas_xlsx(caminho):
+    from openpyxl import load_workbook
+
+    # Lido das dimensões gravadas na planilha, sem percorrer as linhas
+    workbook = load_workbook(caminho, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+        return max_row - 1 if max_row else None
+    finally:
+        workbook.close()
+
+def ler_csv(caminho, tamanho):
+    import pandas as pd
+
+    abrir = gzip.open if caminho.lower().endswith('.gz') else open
+    with abrir(caminho, 'rt', encoding='utf-8-sig', errors='replace') as arquivo:
+        primeira_linha = arquivo.readline()
+
+    # Planilhas exportadas no Brasil costumam usar ";", vírgula decimal e
+    # ponto de milhar (1.234,50)
+    separador = ';' if primeira_linha.count(';') > primeira_linha.count(',') else ','
+    decimal, milhar = (',', '.') if separador == ';' else ('.', None)
+    yield from pd.read_csv(caminho, sep=separador, decimal=decimal, thousands=milhar, chunksize=tamanho,
+                           compression='infer', encoding='utf-8-sig', skipinitialspace=True)
+
+def ler_em_lotes(caminho, nome, tamanho=LINHAS_POR_LEITURA):
+    if nome.lower().endswith('.xlsx'):
+        return ler_xlsx(caminho, tamanho)
+    return ler_csv(caminho, tamanho)
+
+# --- Importação em lotes, com progresso gravado na tabela importacoes ---
+
+def criar_importacao(conn, importacao_id, nome, user_id):
+    conn.execute(
+        "INSERT INTO importacoes (id, arquivo, status, user_id) VALUES (?, ?, 'processando', ?)",
+        (importacao_id, nome, user_id)
+    )
+    conn.commit()
+
+def obter_importacao(conn, importacao_id, user_id):
+    row = conn.execute('SELECT * FROM importacoes WHERE id = ? AND user_id = ?', (importacao_id, user_id)).fetchone()
+    if row is None:
+        return None
+    resultado = dict(row)
+    resultado['relatorio'] = json.loads(resultado['relatorio']) if resultado['relatorio'] else []
+    return resultado
+
+def importar_arquivo(conn, user_id, importacao_id, caminho, nome):
+    # Lê o arquivo em lotes de LINHAS_POR_LEITURA e faz commit de cada lote
+    # junto com a atualização do progresso, para que outra requisição possa
+    # acompanhar a importação enquanto ela acontece.
+    total = total_linhas_xlsx(caminho) if nome.lower().endswith('.xlsx') else None
+    conn.execute('UPDATE importacoes SET total_linhas = ? WHERE id = ?', (total, importacao_id))
+
+    linhas_lidas = 0
+    importadas = 0
+    total_rejeitadas = 0
+    relatorio = []
+
+    for df in ler_em_lotes(caminho, nome):
+        if linhas_lidas == 0:
+            erro = validar_colunas(df)
+            if erro:
+                raise ValueError(erro)
+
+        importadas_lote, rejeitadas = importar_lote(conn, user_id, df, primeira_linha=2 + linhas_lidas)
+        linhas_lidas += len(df)
+        importadas += importadas_lote
+        total_rejeitadas += len(rejeitadas)
+        relatorio.extend(rejeitadas[:LIMITE_RELATORIO - len(relatorio)])
+
+        conn.execute('''
+            UPDATE importacoes SET linhas_lidas = ?, importadas = ?, rejeitadas = ?,
+                   atualizado_em = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (linhas_lidas, importadas, total_rejeitadas, importacao_id))
+        conn.commit()
+
+    conn.execute('''
+        UPDATE importacoes SET status = 'concluida', relatorio = ?, atualizado_em = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (json.dumps(relatorio, ensure_ascii=False), importacao_id))
+    conn.commit()
+
+def executar_importacao(caminho_db, user_id, importacao_id, caminho, nome):
+    # Ponto de entrada usado tanto na própria requisição quanto em uma thread
+    # de fundo: abre a sua conexão e sempre remove o arquivo temporário.
+    conn = database.connect(caminho_db)
+    try:
+        importar_arquivo(conn, user_id, importacao_id, caminho, nome)
+    except Exception as e:
+        conn.rollback()
+        conn.execute('''
+            UPDATE importacoes SET status = 'erro', erro = ?, atualizado_em = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (str(e), importacao_id))
+        conn.commit()
+    finally:
+        conn.close()
+        if os.path.exists(caminho):
+            os.remove(caminho)
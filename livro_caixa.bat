@@ -1,5 +1,6 @@
 @echo off
-cd /d "C:\Users\arten\OneDrive\Documentos\livro_caixa"
+rem Servidor de desenvolvimento (Windows). Em producao, no Linux, use o gunicorn: veja o README.
+cd /d "%~dp0"
 call .\.venv\Scripts\Activate 
 python app.py
 pause
\ No newline at end of file
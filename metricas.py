@@ -0,0 +1,118 @@
+# Métricas do app em memória (por processo), expostas em /metrics no
+# formato texto do Prometheus: histogramas de duração por rota, das
+# consultas SQL e das etapas do OCR, e alguns contadores.
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# Limites (em segundos) dos baldes de cada histograma
+BALDES_REQUISICAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BALDES_SQL = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+BALDES_OCR = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# nome: (tipo, descrição, baldes)
+METRICAS = {
+    'livro_caixa_requisicao_segundos': ('histogram', 'Duração das requisições HTTP por rota.', BALDES_REQUISICAO),
+    'livro_caixa_requisicao_sql_segundos': ('histogram', 'Tempo gasto no SQLite por requisição, por rota.', BALDES_REQUISICAO),
+    'livro_caixa_requisicao_consultas_total': ('counter', 'Consultas SQL executadas pelas requisições, por rota.', None),
+    'livro_caixa_sql_segundos': ('histogram', 'Duração das consultas SQL (execução e leitura das linhas).', BALDES_SQL),
+    'livro_caixa_sql_linhas_total': ('counter', 'Linhas lidas ou alteradas pelas consultas SQL.', None),
+    'livro_caixa_sql_lentas_total': ('counter', 'Consultas SQL acima do limite de consulta lenta.', None),
+    'livro_caixa_ocr_etapa_segundos': ('histogram', 'Duração das etapas do OCR por documento.', BALDES_OCR),
+    'livro_caixa_ocr_jobs_total': ('counter', 'Jobs de OCR concluídos, por status.', None),
+    'livro_caixa_dashboard_cache_total': ('counter', 'Pedidos do dashboard, por resultado no cache (hit ou miss).', None),
+}
+
+_lock = threading.Lock()
+# (nome, rótulos) -> [contagem por balde..., soma, total] ou valor do contador
+_series = {}
+
+def _chave(nome, rotulos):
+    return nome, tuple(sorted(rotulos.items()))
+
+def observar(nome, valor, **rotulos):
+    baldes = METRICAS[nome][2]
+    chave = _chave(nome, rotulos)
+    with _lock:
+        serie = _series.get(chave)
+        if serie is None:
+            serie = _series[chave] = [0] * len(baldes) + [0.0, 0]
+        for i, limite in enumerate(baldes):
+            if valor <= limite:
+                serie[i] += 1
+                break
+        serie[-2] += valor
+        serie[-1] += 1
+
+def incrementar(nome, valor=1, **rotulos):
+    chave = _chave(nome, rotulos)
+    with _lock:
+        _series[chave] = _series.get(chave, 0) + valor
+
+def _formatar_rotulos(rotulos, extra=()):
+    pares = [
+        (nome, str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for nome, valor in tuple(rotulos) + tuple(extra)
+    ]
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{valor}"' for nome, valor in pares) + '}'
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+def texto_prometheus():
+    with _lock:
+        series = {chave: list(serie) if isinstance(serie, list) else serie for chave, serie in _series.items()}
+
+    linhas = []
+    for nome, (tipo, descricao, baldes) in METRICAS.items():
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for (serie_nome, rotulos), serie in sorted(series.items()):
+            if serie_nome != nome:
+                continue
+            if tipo == 'counter':
+                linhas.append(f'{nome}{_formatar_rotulos(rotulos)} {_numero(serie)}')
+                continue
+            # Os baldes do Prometheus são cumulativos
+            acumulado = 0
+            for limite, contagem in zip(baldes, serie):
+                acumulado += contagem
+                linhas.append(f'{nome}_bucket{_formatar_rotulos(rotulos, [("le", limite)])} {acumulado}')
+            linhas.append(f'{nome}_bucket{_formatar_rotulos(rotulos, [("le", "+Inf")])} {serie[-1]}')
+            linhas.append(f'{nome}_sum{_formatar_rotulos(rotulos)} {_numero(serie[-2])}')
+            linhas.append(f'{nome}_count{_formatar_rotulos(rotulos)} {serie[-1]}')
+    return '\n'.join(linhas) + '\n'
+
+# --- Cronometragem por etapa ---
+
+_etapas_lock = threading.Lock()
+
+@contextmanager
+def cronometrar(etapas, etapa):
+    # Soma a duração do bloco em etapas[etapa]; etapas=None não mede nada.
+    # Páginas processadas em paralelo somam os tempos de todas as threads.
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        if etapas is not None:
+            with _etapas_lock:
+                etapas[etapa] = etapas.get(etapa, 0.0) + time.perf_counter() - inicio
+
+# --- Perfis (cProfile) das requisições lentas ---
+
+def gravar_perfil(perfil, pasta, metodo, rota, duracao):
+    # Grava as estatísticas num .prof (abra com "python -m pstats" ou snakeviz)
+    os.makedirs(pasta, exist_ok=True)
+    nome_rota = re.sub(r'\W+', '_', rota).strip('_') or 'raiz'
+    nome = f'{datetime.now():%Y%m%d_%H%M%S}_{metodo}_{nome_rota}_{duracao * 1000:.0f}ms_{uuid.uuid4().hex[:6]}.prof'
+    caminho = os.path.join(pasta, nome)
+    perfil.dump_stats(caminho)
+    print(f"✓ Perfil de {metodo} {rota} ({duracao * 1000:.0f} ms) gravado em {caminho}")
+    return caminho
@@ -0,0 +1,530 @@
+import collections
+import functools
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import anexos
+import database
+import metricas
+
+# --- Bibliotecas para OCR ---
+# PIL, pytesseract e pdf2image só são importados no primeiro OCR (nos
+# processos de OCR); o processo web não paga por eles ao iniciar.
+
+# Caminho do Tesseract: a variável de ambiente TESSERACT_CMD (ou a chave
+# TESSERACT_CMD da configuração do app, que create_app repassa para ela);
+# sem ela, o "tesseract" do PATH. No Windows o instalador não põe o
+# Tesseract no PATH, então o caminho de instalação padrão é usado se existir.
+TESSERACT_WINDOWS = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+def caminho_tesseract():
+    caminho = os.environ.get('TESSERACT_CMD')
+    if caminho:
+        return caminho
+    if os.name == 'nt' and os.path.exists(TESSERACT_WINDOWS):
+        return TESSERACT_WINDOWS
+    return 'tesseract'
+
+@functools.lru_cache(maxsize=None)
+def _pytesseract():
+    import pytesseract
+
+    pytesseract.pytesseract.tesseract_cmd = caminho_tesseract()
+    return pytesseract
+
+@functools.lru_cache(maxsize=None)
+def tesseract_disponivel():
+    # Verificar se o Tesseract está acessível; roda uma vez por processo
+    try:
+        import PIL
+        import pdf2image
+        pytesseract = _pytesseract()
+    except ImportError as e:
+        print(f"✗ Bibliotecas OCR não disponíveis: {e}. Para usar a função de anexo, instale-as com 'pip install pytesseract pillow pdf2image'.")
+        return False
+
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        print(f"✗ Erro ao acessar Tesseract: {e}")
+        print("✗ Dica: Verifique se o Tesseract-OCR está instalado e no PATH, ou informe o executável em TESSERACT_CMD.")
+        return False
+    print("✓ Tesseract OCR configurado com sucesso!")
+    print(f"✓ Caminho: {pytesseract.pytesseract.tesseract_cmd}")
+    return True
+
+# Parâmetros que influenciam o valor extraído; fazem parte da chave do cache,
+# então mudar qualquer um deles invalida os resultados guardados.
+#   camada_texto: usa o texto embutido no PDF (pdftotext) e só rasteriza as
+#                 páginas que não têm texto
+#   parada_antecipada: para de ler o PDF assim que uma página traz um total
+#                      confiável (ex.: "VALOR TOTAL R$ 1.234,56")
+#   preprocessamento: etapas aplicadas à imagem antes do Tesseract, na ordem
+#                     de ETAPAS_PREPROCESSAMENTO ('' desliga)
+#   lado_maximo: maior lado, em pixels, depois da redução
+PARAMETROS_OCR = {
+    'lang': 'por',
+    'dpi': 200,
+    'camada_texto': True,
+    'parada_antecipada': True,
+    'preprocessamento': 'rotacao,cinza,reducao,binarizacao,recorte',
+    'lado_maximo': 2000,
+}
+
+ETAPAS_PREPROCESSAMENTO = ('rotacao', 'cinza', 'reducao', 'binarizacao', 'recorte')
+
+# Margem, em pixels, mantida em volta da região de texto no recorte
+MARGEM_RECORTE = 20
+
+# Páginas de um mesmo PDF processadas ao mesmo tempo dentro de um job. O
+# trabalho pesado acontece nos subprocessos pdftoppm/tesseract, então threads
+# bastam para ocupar vários núcleos.
+THREADS_POR_PDF = min(4, os.cpu_count() or 1)
+
+# Valor logo depois de uma palavra-chave de total
+PADRAO_TOTAL = re.compile(
+    r'(?:valor\s+(?:total|a\s+pagar|cobrado|do\s+documento)|total(?:\s+a\s+pagar|\s+geral)?)'
+    r'[^\d\n]{0,20}(\d{1,3}(?:\.\d{3})+,\d{2}|\d+[.,]\d{2})',
+    re.IGNORECASE
+)
+
+# --- Extração (executada nos processos de OCR) ---
+
+def restante(prazo):
+    # prazo é o instante (time.monotonic) em que o job deve desistir; cada
+    # chamada externa recebe só o tempo que resta, e o pytesseract/pdf2image
+    # matam o processo filho quando ele estoura.
+    segundos = prazo - time.monotonic()
+    if segundos <= 0:
+        raise TimeoutError('Tempo limite do OCR excedido.')
+    return max(1, int(segundos))
+
+# --- Pré-processamento das imagens ---
+# O tempo do Tesseract cresce com a quantidade de pixels; fotos de celular
+# chegam coloridas, grandes e com muito fundo em volta do cupom.
+
+def limiar_otsu(imagem):
+    # Limiar que melhor separa o histograma em duas classes (texto e fundo)
+    histograma = imagem.histogram()[:256]
+    total = sum(histograma)
+    soma_total = sum(nivel * quantidade for nivel, quantidade in enumerate(histograma))
+    soma_fundo = peso_fundo = 0
+    melhor_limiar, melhor_variancia = 127, 0
+    for nivel, quantidade in enumerate(histograma):
+        peso_fundo += quantidade
+        if peso_fundo == 0:
+            continue
+        peso_frente = total - peso_fundo
+        if peso_frente == 0:
+            break
+        soma_fundo += nivel * quantidade
+        media_fundo = soma_fundo / peso_fundo
+        media_frente = (soma_total - soma_fundo) / peso_frente
+        variancia = peso_fundo * peso_frente * (media_fundo - media_frente) ** 2
+        if variancia > melhor_variancia:
+            melhor_limiar, melhor_variancia = nivel, variancia
+    return melhor_limiar
+
+def preprocessar(imagem, etapas=None):
+    from PIL import Image, ImageFilter, ImageOps
+
+    if etapas is None:
+        etapas = [etapa for etapa in PARAMETROS_OCR['preprocessamento'].split(',') if etapa]
+
+    if 'rotacao' in etapas:
+        # Fotos de celular guardam a orientação no EXIF em vez de girar os pixels
+        imagem = ImageOps.exif_transpose(imagem)
+    if 'cinza' in etapas or 'binarizacao' in etapas:
+        imagem = imagem.convert('L')
+    if 'reducao' in etapas:
+        # Reduz para o DPI de trabalho quando a imagem informa o seu, e nunca
+        # deixa o maior lado passar de lado_maximo
+        escala = 1.0
+        dpi = imagem.info.get('dpi')
+        if dpi and dpi[0] > PARAMETROS_OCR['dpi']:
+            escala = PARAMETROS_OCR['dpi'] / dpi[0]
+        escala = min(escala, PARAMETROS_OCR['lado_maximo'] / max(imagem.size))
+        if escala < 1:
+            tamanho = (max(1, round(imagem.width * escala)), max(1, round(imagem.height * escala)))
+            imagem = imagem.resize(tamanho, Image.LANCZOS)
+    if 'binarizacao' in etapas:
+        imagem = ImageOps.autocontrast(imagem)
+        limiar = limiar_otsu(imagem)
+        imagem = imagem.point(lambda nivel: 255 if nivel > limiar else 0)
+    if 'recorte' in etapas:
+        # A região de texto é a caixa que contém os pixels escuros; o filtro
+        # de mediana ignora pontos isolados de ruído
+        tinta = ImageOps.invert(imagem.convert('L')).filter(ImageFilter.MedianFilter(3))
+        caixa = tinta.point(lambda nivel: 255 if nivel > 128 else 0).getbbox()
+        if caixa:
+            esquerda, topo, direita, base = caixa
+            imagem = imagem.crop((
+                max(0, esquerda - MARGEM_RECORTE), max(0, topo - MARGEM_RECORTE),
+                min(imagem.width, direita + MARGEM_RECORTE), min(imagem.height, base + MARGEM_RECORTE),
+            ))
+    return imagem
+
+# As funções abaixo recebem "etapas" (dict etapa -> segundos, ou None) e
+# somam nele o tempo de cada etapa do OCR; o processo de OCR devolve esses tempos ao
+# processo web junto com o valor (ver processar_com_etapas)
+
+def ocr_imagem(imagem, prazo, etapas=None):
+    with metricas.cronometrar(etapas, 'preprocessar'):
+        imagem = preprocessar(imagem)
+    with metricas.cronometrar(etapas, 'tesseract'):
+        return _pytesseract().image_to_string(imagem, lang=PARAMETROS_OCR['lang'], timeout=restante(prazo))
+
+def extrair_texto_imagem(caminho, prazo, etapas=None):
+    from PIL import Image
+
+    with Image.open(caminho) as imagem:
+        return ocr_imagem(imagem, prazo, etapas)
+
+def camada_de_texto(caminho, pagina, prazo):
+    # pdftotext vem do mesmo Poppler que o pdf2image já exige
+    try:
+        resultado = subprocess.run(
+            ['pdftotext', '-layout', '-f', str(pagina), '-l', str(pagina), caminho, '-'],
+            capture_output=True, timeout=restante(prazo), check=True
+        )
+    except (OSError, subprocess.SubprocessError):
+        return ''
+    return resultado.stdout.decode('utf-8', errors='replace')
+
+def texto_da_pagina(caminho, pagina, prazo, etapas=None):
+    from pdf2image import convert_from_path
+
+    if PARAMETROS_OCR['camada_texto']:
+        with metricas.cronometrar(etapas, 'camada_texto'):
+            texto = camada_de_texto(caminho, pagina, prazo)
+        if re.search(r'\d', texto):
+            return texto
+
+    # Rasteriza só esta página: a memória fica limitada a uma imagem por thread
+    with metricas.cronometrar(etapas, 'rasterizar'):
+        imagens = convert_from_path(caminho, PARAMETROS_OCR['dpi'], first_page=pagina, last_page=pagina, timeout=restante(prazo))
+    try:
+        return ''.join(ocr_imagem(imagem, prazo, etapas) for imagem in imagens)
+    finally:
+        for imagem in imagens:
+            imagem.close()
+
+def ordem_das_paginas(total):
+    # Totais costumam estar na primeira ou na última página
+    return list(dict.fromkeys([1, total] + list(range(2, total))))
+
+def processar_pdf(caminho, prazo, etapas=None):
+    from pdf2image import pdfinfo_from_path
+
+    total = pdfinfo_from_path(caminho, timeout=restante(prazo))['Pages']
+    executor = ThreadPoolExecutor(max_workers=THREADS_POR_PDF)
+    try:
+        pendentes = {executor.submit(texto_da_pagina, caminho, pagina, prazo, etapas) for pagina in ordem_das_paginas(total)}
+        textos = []
+        while pendentes:
+            concluidos, pendentes = wait(pendentes, timeout=restante(prazo), return_when=FIRST_COMPLETED)
+            if not concluidos:
+                raise TimeoutError('Tempo limite do OCR excedido.')
+            for future in concluidos:
+                texto = future.result()
+                textos.append(texto)
+                with metricas.cronometrar(etapas, 'regex'):
+                    confiavel = valor_confiavel(texto)
+                if PARAMETROS_OCR['parada_antecipada'] and confiavel is not None:
+                    return confiavel
+        with metricas.cronometrar(etapas, 'regex'):
+            return extrair_valor('\n'.join(textos))
+    finally:
+        # Páginas que ainda não começaram são canceladas; as que estão rodando
+        # terminam sozinhas dentro do prazo
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def converter_valor(texto):
+    # Aceita "1.234,56", "1234,56" e "1234.56"
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto)
+
+def valor_confiavel(texto):
+    valores = [converter_valor(match) for match in PADRAO_TOTAL.findall(texto)]
+    return max(valores) if valores else None
+
+def extrair_valor(texto):
+    # Um total identificado por palavra-chave tem prioridade; sem ele, vale o
+    # maior valor monetário do documento
+    confiavel = valor_confiavel(texto)
+    if confiavel is not None:
+        return confiavel
+
+    matches = re.findall(r'(\d+[.,]\d{2})', texto)
+    valor_encontrado = 0.0
+    if matches:
+        max_valor = 0
+        for match in matches:
+            try:
+                valor_numerico = float(match.replace(',', '.'))
+                if valor_numerico > max_valor:
+                    max_valor = valor_numerico
+            except ValueError:
+                continue
+        valor_encontrado = max_valor
+    return valor_encontrado
+
+def processar_arquivo(caminho, timeout, etapas=None):
+    prazo = time.monotonic() + timeout
+    try:
+        if caminho.lower().endswith('.pdf'):
+            return processar_pdf(caminho, prazo, etapas)
+        texto = extrair_texto_imagem(caminho, prazo, etapas)
+    except Exception as e:
+        # Algumas exceções do pytesseract não podem ser serializadas de volta
+        # ao processo web; devolve só a mensagem
+        raise RuntimeError(str(e) or e.__class__.__name__) from None
+    with metricas.cronometrar(etapas, 'regex'):
+        return extrair_valor(texto)
+
+def processar_com_etapas(caminho, timeout):
+    # Roda num processo de OCR: as métricas dele não chegam ao /metrics do processo
+    # web, então os tempos por etapa voltam junto com o valor
+    etapas = {}
+    valor = processar_arquivo(caminho, timeout, etapas)
+    return valor, etapas
+
+# --- Processos de OCR com limite de fila ---
+# Processos próprios (spawn, que não herda threads e conexões abertas do
+# servidor web), cada um atendendo um job por vez. Uma thread gerente passa
+# os jobs da fila aos processos livres, recebe os resultados e encerra o
+# processo cujo job passou do limite: só ele, e os programas que ele abriu
+# (tesseract, pdftoppm), morrem; os jobs dos outros processos continuam.
+
+class FilaCheia(Exception):
+    pass
+
+# O job tem o próprio prazo (timeout), repassado ao tesseract, ao pdftotext e
+# ao pdftoppm; um que passa de FATOR_LIMITE vezes isso executando travou
+# fora deles. A gerente confere a cada INTERVALO_VIGIA segundos.
+FATOR_LIMITE = 2
+INTERVALO_VIGIA = 1
+
+_lock = threading.Lock()
+_fila = collections.deque()  # jobs esperando processo: (future, caminho, timeout)
+_processos = []              # {'processo', 'conexao', 'future', 'limite'}
+_maximo_processos = 1
+_gerente = None
+_despertador = None          # Pipe que acorda a gerente quando chega um job
+
+def _atender(conexao, tarefa):
+    # Laço de um processo de OCR: um job por vez, até o servidor fechar a conexão
+    if hasattr(os, 'setpgrp'):
+        # Grupo de processos próprio: ao expirar, o tesseract morre junto
+        os.setpgrp()
+    while True:
+        try:
+            caminho, timeout = conexao.recv()
+        except EOFError:
+            return
+        try:
+            resposta = (True, tarefa(caminho, timeout))
+        except Exception as e:
+            resposta = (False, str(e) or e.__class__.__name__)
+        conexao.send(resposta)
+
+def _iniciar_processo():
+    contexto = multiprocessing.get_context('spawn')
+    conexao, conexao_processo = contexto.Pipe()
+    processo = contexto.Process(target=_atender, args=(conexao_processo, processar_com_etapas), name='ocr', daemon=True)
+    processo.start()
+    conexao_processo.close()
+    return {'processo': processo, 'conexao': conexao, 'future': None, 'limite': None}
+
+def _matar(entrada):
+    # Encerra o processo e os que ele abriu: o grupo de processos no Linux,
+    # a árvore (taskkill /T) no Windows
+    processo = entrada['processo']
+    if processo.is_alive():
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(processo.pid)], capture_output=True)
+        else:
+            try:
+                if os.getpgid(processo.pid) == processo.pid:
+                    os.killpg(processo.pid, signal.SIGKILL)
+                else:
+                    processo.kill()
+            except ProcessLookupError:
+                pass
+    processo.join(5)
+    entrada['conexao'].close()
+
+def _distribuir(concluidos):
+    # Com _lock: passa os jobs da fila aos processos livres, criando
+    # processos até o máximo
+    while _fila:
+        livre = next((entrada for entrada in _processos if entrada['future'] is None), None)
+        if livre is None and len(_processos) >= _maximo_processos:
+            return
+        future, caminho, timeout = _fila.popleft()
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            if livre is None:
+                livre = _iniciar_processo()
+                _processos.append(livre)
+            livre['conexao'].send((caminho, timeout))
+        except Exception as e:
+            # Processo que não sobe ou já morreu: o job termina em erro
+            concluidos.append((future, RuntimeError(f'Falha ao iniciar o OCR: {e}')))
+            continue
+        livre['future'] = future
+        livre['limite'] = time.monotonic() + timeout * FATOR_LIMITE
+
+def _gerenciar():
+    concluidos = []
+    while True:
+        # Os futures são resolvidos fora do lock: os callbacks gravam no banco
+        for future, resultado in concluidos:
+            if isinstance(resultado, Exception):
+                future.set_exception(resultado)
+            else:
+                future.set_result(resultado)
+        concluidos = []
+
+        with _lock:
+            if _gerente is not threading.current_thread():
+                return  # encerrar_pool
+            _distribuir(concluidos)
+            ocupados = {entrada['conexao']: entrada for entrada in _processos if entrada['future'] is not None}
+            aguardados = list(ocupados) + [entrada['processo'].sentinel for entrada in _processos] + [_despertador[0]]
+        try:
+            prontos = multiprocessing.connection.wait(aguardados, timeout=INTERVALO_VIGIA)
+        except OSError:
+            continue  # conexão fechada por encerrar_pool
+
+        with _lock:
+            while _despertador[0].poll():
+                _despertador[0].recv_bytes()
+            for pronto in prontos:
+                entrada = ocupados.get(pronto)
+                if entrada is None or entrada['future'] is None:
+                    continue
+                try:
+                    ok, resposta = pronto.recv()
+                except (EOFError, OSError):
+                    continue  # o processo morreu; tratado abaixo
+                concluidos.append((entrada['future'], resposta if ok else RuntimeError(resposta)))
+                entrada['future'] = None
+
+            agora = time.monotonic()
+            for entrada in list(_processos):
+                if entrada['future'] is not None and agora > entrada['limite']:
+                    _matar(entrada)
+                    concluidos.append((entrada['future'], TimeoutError('Tempo limite do OCR excedido.')))
+                elif not entrada['processo'].is_alive():
+                    # Ex.: falta de memória; o próximo job abre outro processo
+                    entrada['conexao'].close()
+                    if entrada['future'] is not None:
+                        concluidos.append((entrada['future'], RuntimeError('O processo do OCR terminou inesperadamente.')))
+                else:
+                    continue
+                _processos.remove(entrada)
+
+def submeter(caminho, timeout, workers, max_pendentes, ao_concluir):
+    global _maximo_processos, _gerente, _despertador
+    with _lock:
+        pendentes = len(_fila) + sum(entrada['future'] is not None for entrada in _processos)
+        if pendentes >= max_pendentes:
+            raise FilaCheia('Fila de OCR cheia, tente novamente em instantes.')
+        _maximo_processos = workers
+        future = Future()
+        _fila.append((future, caminho, timeout))
+        if _despertador is None:
+            _despertador = multiprocessing.Pipe(duplex=False)
+        if _gerente is None:
+            _gerente = threading.Thread(target=_gerenciar, name='ocr-gerente', daemon=True)
+            _gerente.start()
+        _despertador[1].send_bytes(b'.')
+    future.add_done_callback(ao_concluir)
+    return future
+
+def encerrar_pool():
+    # Encerra os processos de OCR e a gerente; os jobs pendentes terminam em erro
+    global _gerente
+    with _lock:
+        _gerente = None
+        fila = list(_fila)
+        _fila.clear()
+        processos = list(_processos)
+        _processos.clear()
+        if _despertador is not None:
+            _despertador[1].send_bytes(b'.')
+    for entrada in processos:
+        _matar(entrada)
+    for future in [future for future, _, _ in fila] + [entrada['future'] for entrada in processos if entrada['future'] is not None]:
+        if not future.done():
+            future.set_exception(RuntimeError('Servidor de OCR encerrado.'))
+
+# --- Cache de resultados por conteúdo (tabela ocr_cache) ---
+
+def chave_cache(sha256):
+    parametros = ','.join(f'{nome}={valor}' for nome, valor in sorted(PARAMETROS_OCR.items()))
+    return f'{sha256}:{parametros}'
+
+def obter_cache(conn, chave):
+    row = conn.execute('SELECT valor FROM ocr_cache WHERE chave = ?', (chave,)).fetchone()
+    return row['valor'] if row else None
+
+# --- Jobs de OCR (estado gravado na tabela ocr_jobs) ---
+
+def criar_job(conn, arquivo, user_id):
+    job_id = uuid.uuid4().hex
+    conn.execute("INSERT INTO ocr_jobs (id, arquivo, status, user_id) VALUES (?, ?, 'processando', ?)", (job_id, arquivo, user_id))
+    conn.commit()
+    return job_id
+
+def registrar_resultado(caminho_db, pasta, job_id, chave, future):
+    # Chamado numa thread do processo web quando o job termina; o arquivo
+    # enviado para o OCR sai do disco se nenhuma transação o usa
+    try:
+        (valor, etapas), erro, status = future.result(), None, 'concluido'
+    except Exception as e:
+        valor, etapas, erro, status = None, {}, str(e) or e.__class__.__name__, 'erro'
+    for etapa, segundos in etapas.items():
+        metricas.observar('livro_caixa_ocr_etapa_segundos', segundos, etapa=etapa)
+    metricas.incrementar('livro_caixa_ocr_jobs_total', status=status)
+
+    conn = database.connect(caminho_db)
+    try:
+        conn.execute('''
+            UPDATE ocr_jobs SET status = ?, valor = ?, erro = ?, concluido_em = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, valor, erro, job_id))
+        if status == 'concluido':
+            conn.execute('INSERT OR REPLACE INTO ocr_cache (chave, valor) VALUES (?, ?)', (chave, valor))
+        conn.commit()
+        arquivo = conn.execute('SELECT arquivo FROM ocr_jobs WHERE id = ?', (job_id,)).fetchone()
+        if arquivo is not None:
+            anexos.liberar_anexos(conn, [arquivo['arquivo']], pasta)
+    finally:
+        conn.close()
+
+def obter_job(conn, job_id, user_id, timeout):
+    row = conn.execute('''
+        SELECT *, (julianday('now') - julianday(criado_em)) * 86400 AS idade FROM ocr_jobs WHERE id = ? AND user_id = ?
+    ''', (job_id, user_id)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    idade = job.pop('idade')
+    # Um job que nunca respondeu (processo do servidor reiniciado, worker
+    # travado) é dado como expirado em vez de ficar "processando" para sempre
+    if job['status'] == 'processando' and idade > timeout * 2:
+        job['status'] = 'erro'
+        job['erro'] = 'Tempo limite do OCR excedido.'
+    return job
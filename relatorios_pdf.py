@@ -0,0 +1,255 @@
+import functools
+import hashlib
+import os
+import tempfile
+from datetime import datetime
+
+import arquivamento
+import database
+
+# O ReportLab é importado dentro das funções que montam o PDF, para não pesar
+# na inicialização do servidor
+
+# Linhas de transações por tabela: cabe numa página A4 com as margens do
+# relatório. O ReportLab fica lento (e guloso em memória) para dividir uma
+# tabela enorme; várias tabelas do tamanho de uma página saem rápido. A
+# primeira divide a página com o título e o resumo, então é menor.
+LINHAS_POR_TABELA = 35
+LINHAS_PRIMEIRA_TABELA = 25
+
+# Linhas lidas do banco por vez
+LINHAS_POR_LEITURA = 1000
+
+# Quantos PDFs manter na pasta de cache
+MAX_ARQUIVOS_CACHE = 50
+
+# Um job "processando" mais antigo que isso é dado como perdido (processo
+# reiniciado no meio da geração) e pode ser disparado de novo
+TEMPO_MAXIMO_GERACAO = 600
+
+CABECALHO_TRANSACOES = ['Data', 'Descrição', 'Categoria', 'Tipo', 'Valor (R$)']
+
+@functools.lru_cache(maxsize=None)
+def estilo_transacoes():
+    from reportlab.platypus import TableStyle
+    from reportlab.lib import colors
+
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('ALIGN', (-1, 1), (-1, -1), 'RIGHT'), # Alinha a coluna de valor à direita
+    ])
+
+# --- Consultas ---
+
+def consulta_transacoes(user_id, data_inicio, data_fim, tipo, tabela='transacoes', ordenar=False):
+    query = f'SELECT data, descricao, categoria, tipo, valor FROM {tabela} WHERE user_id = ? AND data BETWEEN ? AND ?'
+    params = [user_id, data_inicio, data_fim]
+
+    if tipo != 'todos':
+        query += ' AND tipo = ?'
+        params.append(tipo)
+
+    if ordenar:
+        query += ' ORDER BY data DESC'
+    return query, params
+
+def contar_transacoes(conn, user_id, data_inicio, data_fim, tipo):
+    tabela = arquivamento.fonte_transacoes(conn, data_inicio, data_fim)
+    query, params = consulta_transacoes(user_id, data_inicio, data_fim, tipo, tabela)
+    return conn.execute(f'SELECT COUNT(*) FROM ({query})', params).fetchone()[0]
+
+def ler_transacoes(conn, user_id, data_inicio, data_fim, tipo):
+    tabela = arquivamento.fonte_transacoes(conn, data_inicio, data_fim)
+    query, params = consulta_transacoes(user_id, data_inicio, data_fim, tipo, tabela, ordenar=True)
+    cursor = conn.execute(query, params)
+    while True:
+        linhas = cursor.fetchmany(LINHAS_POR_LEITURA)
+        if not linhas:
+            break
+        yield from linhas
+
+def totais_periodo(conn, user_id, data_inicio, data_fim):
+    # Calcula totais para o período (com os totais guardados dos anos fechados)
+    totais = arquivamento.totais_por_tipo(conn, user_id, data_inicio, data_fim)
+    return totais['receita']['total'], totais['despesa']['total']
+
+# --- Geração do PDF ---
+
+def tabelas_transacoes(transacoes):
+    # Uma tabela por página, cada uma com o próprio cabeçalho e separada da
+    # anterior por uma quebra de página; repeatRows só entra em ação se uma
+    # tabela ainda assim não couber (descrições longas)
+    from reportlab.platypus import PageBreak, Table
+
+    def tabela(linhas, primeira):
+        transacoes_table = Table([CABECALHO_TRANSACOES] + linhas, colWidths=[60, '*', 100, 60, 80], repeatRows=1)
+        transacoes_table.setStyle(estilo_transacoes())
+        return [transacoes_table] if primeira else [PageBreak(), transacoes_table]
+
+    linhas = []
+    primeira = True
+    for t in transacoes:
+        linhas.append([datetime.strptime(t['data'], '%Y-%m-%d').strftime('%d/%m/%Y'), t['descricao'], t['categoria'], t['tipo'].capitalize(), f"{t['valor']:,.2f}"])
+        if len(linhas) == (LINHAS_PRIMEIRA_TABELA if primeira else LINHAS_POR_TABELA):
+            yield from tabela(linhas, primeira)
+            linhas = []
+            primeira = False
+    if linhas:
+        yield from tabela(linhas, primeira)
+
+def gerar_pdf(conn, user_id, data_inicio, data_fim, tipo, destino):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+
+    receitas, despesas = totais_periodo(conn, user_id, data_inicio, data_fim)
+    saldo = receitas - despesas
+
+    doc = SimpleDocTemplate(destino, pagesize=A4, leftMargin=30, rightMargin=30, topMargin=30, bottomMargin=30)
+    elements = []
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('CustomTitle', parent=styles['h1'], alignment=1, spaceAfter=20)
+
+    elements.append(Paragraph(f'Relatório Financeiro', title_style))
+    elements.append(Paragraph(f"<b>Período:</b> {datetime.strptime(data_inicio, '%Y-%m-%d').strftime('%d/%m/%Y')} a {datetime.strptime(data_fim, '%Y-%m-%d').strftime('%d/%m/%Y')}", styles['Normal']))
+    elements.append(Paragraph(f"<b>Tipo:</b> {tipo.capitalize()}", styles['Normal']))
+    elements.append(Spacer(1, 20))
+
+    # Tabela de Resumo
+    resumo_data = [
+        ['Total de Receitas:', f'R$ {receitas:,.2f}'],
+        ['Total de Despesas:', f'R$ {despesas:,.2f}'],
+        ['Saldo do Período:', f'R$ {saldo:,.2f}']
+    ]
+    resumo_table = Table(resumo_data, colWidths=['*', 120])
+    resumo_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('BACKGROUND', (0, 0), (0, 0), colors.Color(0.2, 0.4, 0.6)), # Azul para Receita
+        ('BACKGROUND', (0, 1), (0, 1), colors.Color(0.8, 0.2, 0.2)), # Vermelho para Despesa
+        ('BACKGROUND', (0, 2), (0, 2), colors.Color(0.5, 0.5, 0.5)), # Cinza para Saldo
+        ('TEXTCOLOR', (0,0), (0,2), colors.white),
+    ]))
+    elements.append(resumo_table)
+    elements.append(Spacer(1, 20))
+
+    tabelas = list(tabelas_transacoes(ler_transacoes(conn, user_id, data_inicio, data_fim, tipo)))
+    if tabelas:
+        elements.extend(tabelas)
+    else:
+        elements.append(Paragraph('Nenhuma transação encontrada para o período.', styles['Normal']))
+
+    doc.build(elements)
+
+# --- Cache em disco ---
+# A chave inclui o usuário e a versão dos dados dele (versao_usuario): cada
+# usuário tem os seus PDFs, e qualquer alteração nas transações dele gera um
+# PDF novo e o antigo deixa de ser servido.
+
+def chave_cache(conn, user_id, data_inicio, data_fim, tipo):
+    partes = f'{user_id}|{data_inicio}|{data_fim}|{tipo}|{database.data_version(conn, user_id)}'
+    return hashlib.sha256(partes.encode('utf-8')).hexdigest()
+
+def caminho_cache(pasta, chave):
+    return os.path.join(pasta, f'relatorio_{chave}.pdf')
+
+def salvar_no_cache(conn, pasta, chave, user_id, data_inicio, data_fim, tipo):
+    # Gera num arquivo temporário e renomeia no fim: quem lê o cache nunca
+    # encontra um PDF pela metade
+    os.makedirs(pasta, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(suffix='.pdf.tmp', dir=pasta)
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            gerar_pdf(conn, user_id, data_inicio, data_fim, tipo, destino)
+        os.replace(temporario, caminho_cache(pasta, chave))
+    except Exception:
+        os.remove(temporario)
+        raise
+    limpar_cache(conn, pasta)
+    return caminho_cache(pasta, chave)
+
+def limpar_cache(conn, pasta, maximo=MAX_ARQUIVOS_CACHE):
+    # Apaga os PDFs mais antigos e, no mesmo passo, os registros em
+    # relatorios_pdf dos relatórios que não estão mais no cache; erros
+    # antigos também saem (os recentes ficam para o cliente ver a mensagem)
+    arquivos = [
+        os.path.join(pasta, nome) for nome in os.listdir(pasta)
+        if nome.startswith('relatorio_') and nome.endswith('.pdf')
+    ]
+    arquivos.sort(key=os.path.getmtime, reverse=True)
+    for caminho in arquivos[maximo:]:
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+    mantidas = [os.path.basename(caminho)[len('relatorio_'):-len('.pdf')] for caminho in arquivos[:maximo]]
+    conn.execute(f'''
+        DELETE FROM relatorios_pdf
+        WHERE (status = 'concluido' AND chave NOT IN ({', '.join('?' * len(mantidas))}))
+           OR (status = 'erro' AND criado_em < datetime('now', '-{TEMPO_MAXIMO_GERACAO} seconds'))
+    ''', mantidas)
+    conn.commit()
+
+# --- Geração em segundo plano (estado gravado na tabela relatorios_pdf) ---
+
+def iniciar_geracao(conn, chave, user_id, linhas, caminho):
+    # Devolve True se quem chamou deve disparar a geração: o job não existia,
+    # terminou em erro, ficou perdido ou foi concluído mas o PDF saiu do cache
+    # (limpar_cache). Pedidos repetidos do mesmo relatório enquanto ele é
+    # gerado não disparam uma segunda geração.
+    arquivo_ausente = not os.path.exists(caminho)
+    cursor = conn.execute(f'''
+        INSERT INTO relatorios_pdf (chave, user_id, status, linhas) VALUES (?, ?, 'processando', ?)
+        ON CONFLICT (chave) DO UPDATE SET
+            user_id = excluded.user_id, status = 'processando', erro = NULL,
+            criado_em = CURRENT_TIMESTAMP, concluido_em = NULL
+        WHERE status = 'erro' OR user_id IS NOT excluded.user_id
+           OR (status = 'processando' AND criado_em < datetime('now', '-{TEMPO_MAXIMO_GERACAO} seconds'))
+           OR (status = 'concluido' AND ?)
+    ''', (chave, user_id, linhas, arquivo_ausente))
+    conn.commit()
+    return cursor.rowcount == 1
+
+def registrar_concluido(conn, chave, user_id, linhas):
+    # PDFs pequenos são gerados na própria requisição; o registro guarda o dono
+    conn.execute('''
+        INSERT INTO relatorios_pdf (chave, user_id, status, linhas, concluido_em) VALUES (?, ?, 'concluido', ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (chave) DO UPDATE SET
+            user_id = excluded.user_id, status = 'concluido', erro = NULL, linhas = excluded.linhas,
+            concluido_em = CURRENT_TIMESTAMP
+    ''', (chave, user_id, linhas))
+    conn.commit()
+
+def obter_geracao(conn, chave, user_id):
+    row = conn.execute('SELECT * FROM relatorios_pdf WHERE chave = ? AND user_id = ?', (chave, user_id)).fetchone()
+    return dict(row) if row else None
+
+def executar_geracao(caminho_db, pasta, chave, user_id, data_inicio, data_fim, tipo):
+    # Roda numa thread de fundo, com a sua própria conexão
+    conn = database.connect(caminho_db)
+    try:
+        salvar_no_cache(conn, pasta, chave, user_id, data_inicio, data_fim, tipo)
+        conn.execute('''
+            UPDATE relatorios_pdf SET status = 'concluido', concluido_em = CURRENT_TIMESTAMP WHERE chave = ?
+        ''', (chave,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        conn.execute("UPDATE relatorios_pdf SET status = 'erro', erro = ? WHERE chave = ?", (str(e), chave))
+        conn.commit()
+    finally:
+        conn.close()
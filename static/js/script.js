@@ -1,5 +1,9 @@
 // Variáveis globais
 let transacoes = [];
+let proximoCursor = null; // Cursor da próxima página de transações (null = fim da lista)
+let carregandoTransacoes = false;
+let termoBusca = ''; // Texto da busca no histórico ('' = lista completa)
+let seqMudancas = null; // Último seq de /api/transacoes/mudancas refletido na lista (null = sem lista carregada)
 let anexoModal = null; // Para guardar a instância do modal
 
 // Inicialização
@@ -18,6 +22,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const formTransacao = document.getElementById('form-transacao');
     if (formTransacao) {
         configurarFormulario();
+        configurarImportacao();
+        configurarRolagemTransacoes();
+        configurarBuscaTransacoes();
         carregarTransacoes(); 
         anexoModal = new bootstrap.Modal(document.getElementById('anexoModal'));
     }
@@ -56,18 +63,31 @@ function configurarThemeSwitcher() {
             themeIcon.className = newTheme === 'dark' ? 'fas fa-sun' : 'fas fa-moon';
         }
         
-        // Se estiver na dashboard, recarrega os gráficos para aplicar as cores do novo tema
+        // Se estiver na dashboard, redesenha os gráficos para aplicar as cores do novo tema
         if (document.getElementById('grafico-mensal')) {
-            carregarGraficos();
+            exibirGraficos();
         }
     });
 }
 
 
-// Carrega os dados APENAS para o dashboard
-function carregarDadosDashboard() {
-    carregarSaldo();
-    carregarGraficos();
+// Carrega os dados APENAS para o dashboard, numa única requisição.
+// O servidor responde com ETag, então recargas sem mudanças voltam como 304.
+let dadosDashboard = null;
+
+async function carregarDadosDashboard() {
+    try {
+        const response = await fetch('/api/dashboard');
+        const dados = await response.json();
+
+        if (dadosDashboard && dadosDashboard.versao === dados.versao) return;
+        dadosDashboard = dados;
+
+        exibirSaldo(dadosDashboard.saldo);
+        exibirGraficos();
+    } catch (error) {
+        console.error('Erro ao carregar dashboard:', error);
+    }
 }
 
 // Configurar formulário de lançamento
@@ -93,6 +113,78 @@ function configurarFormulario() {
     });
 }
 
+// --- Importação de planilhas com acompanhamento de progresso ---
+function configurarImportacao() {
+    const form = document.getElementById('form-importacao');
+    if (!form) return;
+
+    form.addEventListener('submit', async function(e) {
+        e.preventDefault();
+        const botao = form.querySelector('button[type="submit"]');
+        botao.disabled = true;
+
+        try {
+            const response = await fetch(form.action, {
+                method: 'POST',
+                body: new FormData(form),
+                headers: { 'Accept': 'application/json' }
+            });
+            const result = await response.json();
+            if (!result.success) {
+                throw new Error(result.error);
+            }
+            await acompanharImportacao(result.id);
+            form.reset();
+        } catch (error) {
+            console.error('Erro na importação:', error);
+            mostrarMensagem(`Erro ao importar planilha: ${error.message}`, 'danger');
+        } finally {
+            botao.disabled = false;
+        }
+    });
+}
+
+async function acompanharImportacao(id) {
+    const progresso = document.getElementById('progresso-importacao');
+    const barra = progresso.querySelector('.progress-bar');
+    const texto = document.getElementById('progresso-importacao-texto');
+    progresso.style.display = 'block';
+
+    try {
+        while (true) {
+            const response = await fetch(`/api/importacoes/${id}`);
+            const status = await response.json();
+            if (!status.success) {
+                throw new Error(status.error);
+            }
+
+            if (status.total_linhas) {
+                barra.style.width = `${Math.min(100, Math.round(100 * status.linhas_lidas / status.total_linhas))}%`;
+            }
+            texto.textContent = `${status.linhas_lidas} linhas lidas, ${status.importadas} importadas, ${status.rejeitadas} ignoradas`;
+
+            if (status.status === 'erro') {
+                throw new Error(status.erro);
+            }
+            if (status.status === 'concluida') {
+                let mensagem = `${status.importadas} transações importadas com sucesso!`;
+                if (status.rejeitadas > 0) {
+                    const detalhes = status.relatorio.slice(0, 10).map(r => `linha ${r.linha}: ${r.motivo}`).join('; ');
+                    mensagem += ` ${status.rejeitadas} foram ignoradas: ${detalhes}`;
+                }
+                mostrarMensagem(mensagem, status.importadas > 0 ? 'success' : 'warning');
+                carregarTransacoes();
+                return;
+            }
+
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    } finally {
+        progresso.style.display = 'none';
+        barra.style.width = '100%';
+    }
+}
+
 // Função para processar o anexo com OCR
 async function processarAnexo(file) {
     const formData = new FormData();
@@ -105,7 +197,12 @@ async function processarAnexo(file) {
             method: 'POST',
             body: formData
         });
-        const result = await response.json();
+        const envio = await response.json();
+        if (!envio.success) {
+            throw new Error(envio.error);
+        }
+        // Documentos já lidos antes vêm do cache do servidor, sem job
+        const result = envio.job_id ? await aguardarJobOcr(envio.job_id) : envio;
 
         if (result.success && result.valor > 0) {
             document.getElementById('valor').value = result.valor.toFixed(2);
@@ -121,93 +218,211 @@ async function processarAnexo(file) {
     }
 }
 
+// O OCR roda em segundo plano no servidor; consulta o job até ele terminar
+async function aguardarJobOcr(jobId) {
+    while (true) {
+        const response = await fetch(`/api/ocr/jobs/${jobId}`);
+        const job = await response.json();
+        if (!job.success) {
+            return job;
+        }
+        if (job.status === 'concluido') {
+            return { success: true, valor: job.valor };
+        }
+        if (job.status === 'erro') {
+            return { success: false, error: job.erro };
+        }
+        await new Promise(resolve => setTimeout(resolve, 700));
+    }
+}
+
 // API Calls
 async function carregarTransacoes() {
+    transacoes = [];
+    proximoCursor = null;
+    seqMudancas = null;
+    await carregarPaginaTransacoes();
+}
+
+// Busca a próxima página e acrescenta à lista (paginação por cursor)
+async function carregarPaginaTransacoes() {
+    if (carregandoTransacoes) return;
+    carregandoTransacoes = true;
+    const termo = termoBusca;
+    let desatualizada = false;
+
     try {
-        const response = await fetch('/api/transacoes');
-        transacoes = await response.json();
-        exibirTransacoes();
+        const params = new URLSearchParams();
+        if (termoBusca) params.set('q', termoBusca);
+        if (proximoCursor) params.set('cursor', proximoCursor);
+        const base = termoBusca ? '/api/transacoes/busca' : '/api/transacoes';
+        const response = await fetch(params.toString() ? `${base}?${params}` : base);
+        const pagina = await response.json();
+
+        // A busca mudou enquanto a página carregava: descarta e recarrega
+        if (termo !== termoBusca) {
+            desatualizada = true;
+            return;
+        }
+
+        const primeiraPagina = transacoes.length === 0;
+        // A sincronização incremental parte do seq da primeira página da lista
+        if (primeiraPagina && !termoBusca) seqMudancas = pagina.seq ?? null;
+        transacoes = transacoes.concat(pagina.transacoes || []);
+        proximoCursor = pagina.proximo_cursor;
+        exibirTransacoes(primeiraPagina ? transacoes : pagina.transacoes, !primeiraPagina);
     } catch (error) {
         console.error('Erro ao carregar transações:', error);
+    } finally {
+        carregandoTransacoes = false;
+        if (desatualizada) carregarTransacoes();
     }
 }
 
-async function carregarSaldo() {
+// Aplica à lista carregada só o que mudou desde a última sincronização, em
+// vez de baixar e redesenhar o histórico inteiro
+async function sincronizarTransacoes() {
+    // Resultados de busca seguem a ordem de relevância: esses recarregam
+    if (termoBusca || seqMudancas === null || carregandoTransacoes) {
+        return carregarTransacoes();
+    }
+
     try {
-        const response = await fetch('/api/relatorios/saldo');
-        const saldo = await response.json();
-        
-        let receitas = saldo.receitas || 0;
-        let despesas = saldo.despesas || 0;
-        let saldoTotal = saldo.saldo || (receitas - despesas);
-        
-        document.getElementById('total-receitas').textContent = formatarMoeda(receitas);
-        document.getElementById('total-despesas').textContent = formatarMoeda(despesas);
-        document.getElementById('saldo-total').textContent = formatarMoeda(saldoTotal);
-            
-        const cardSaldo = document.querySelector('.card-saldo');
-        if (cardSaldo) {
-            if (saldoTotal >= 0) {
-                cardSaldo.classList.remove('negative-saldo');
-                cardSaldo.classList.add('positive-saldo');
-            } else {
-                cardSaldo.classList.remove('positive-saldo');
-                cardSaldo.classList.add('negative-saldo');
+        let mais = true;
+        while (mais) {
+            const response = await fetch(`/api/transacoes/mudancas?desde=${seqMudancas}`);
+            const mudancas = await response.json();
+            if (!response.ok || mudancas.recarregar) {
+                return carregarTransacoes();
             }
+            aplicarMudancas(mudancas.transacoes, mudancas.excluidas);
+            seqMudancas = mudancas.seq;
+            mais = mudancas.mais;
         }
-            
     } catch (error) {
-        console.error('Erro ao carregar saldo:', error);
+        console.error('Erro ao sincronizar transações:', error);
+        carregarTransacoes();
     }
 }
 
-async function carregarGraficos() {
-    await carregarGraficoMensal();
-    await carregarGraficoCategorias();
+// Mesma ordem da API: data mais recente primeiro, depois o maior id
+function compararTransacoes(a, b) {
+    if (a.data !== b.data) return a.data < b.data ? 1 : -1;
+    return b.id - a.id;
 }
 
-async function carregarGraficoMensal() {
-    try {
-        const response = await fetch('/api/relatorios/mensal');
-        const dados = await response.json();
-        
-        const meses = dados.map(item => formatarMes(item.mes));
-        const receitas = dados.map(item => item.receitas);
-        const despesas = dados.map(item => item.despesas);
-        const saldos = dados.map(item => item.saldo);
-        
-        const trace1 = { x: meses, y: receitas, name: 'Receitas', type: 'bar', marker: { color: '#27ae60' } };
-        const trace2 = { x: meses, y: despesas, name: 'Despesas', type: 'bar', marker: { color: '#e74c3c' } };
-        const trace3 = { x: meses, y: saldos, name: 'Saldo', type: 'line', marker: { color: '#3498db' }, line: { width: 4 } };
-        
-        const layout = getLayoutGrafico();
-        layout.barmode = 'group';
-        
-        Plotly.newPlot('grafico-mensal', [trace1, trace2, trace3], layout, { responsive: true, displayModeBar: false });
-        
-    } catch (error) {
-        console.error('Erro ao carregar gráfico mensal:', error);
+function aplicarMudancas(alteradas, excluidas) {
+    const container = document.getElementById('lista-transacoes');
+    const removidas = new Set(excluidas.concat(alteradas.map(transacao => transacao.id)));
+    transacoes = transacoes.filter(transacao => !removidas.has(transacao.id));
+    removidas.forEach(id => container?.querySelector(`[data-id="${id}"]`)?.remove());
+
+    // Com mais páginas por carregar, só entra o que cabe antes da última
+    // transação já exibida; o resto chega pela rolagem
+    const ultima = transacoes[transacoes.length - 1];
+    const novas = alteradas.filter(transacao => !proximoCursor || !ultima || compararTransacoes(transacao, ultima) < 0);
+
+    if (transacoes.length === 0 || !container?.querySelector('[data-id]')) {
+        transacoes = novas.sort(compararTransacoes);
+        exibirTransacoes();
+        return;
     }
+
+    novas.forEach(transacao => {
+        let posicao = transacoes.findIndex(existente => compararTransacoes(transacao, existente) < 0);
+        if (posicao === -1) posicao = transacoes.length;
+        const seguinte = transacoes[posicao];
+        transacoes.splice(posicao, 0, transacao);
+        const elemento = seguinte && container.querySelector(`[data-id="${seguinte.id}"]`);
+        if (elemento) {
+            elemento.insertAdjacentHTML('beforebegin', htmlTransacao(transacao));
+        } else {
+            container.insertAdjacentHTML('beforeend', htmlTransacao(transacao));
+        }
+    });
 }
 
-async function carregarGraficoCategorias() {
-    try {
-        const response = await fetch('/api/relatorios/categorias');
-        const dados = await response.json();
-        
-        const trace1 = { labels: dados.receitas.map(item => item.categoria), values: dados.receitas.map(item => item.total), name: 'Receitas', type: 'pie', hole: 0.4, domain: { row: 0, column: 0 }, marker: { colors: ['#27ae60', '#2ecc71', '#1abc9c', '#16a085'] } };
-        const trace2 = { labels: dados.despesas.map(item => item.categoria), values: dados.despesas.map(item => item.total), name: 'Despesas', type: 'pie', hole: 0.4, domain: { row: 0, column: 1 }, marker: { colors: ['#e74c3c', '#c0392b', '#d35400', '#e67e22'] } };
-        
-        const layout = getLayoutGrafico();
-        layout.grid = { rows: 1, columns: 2 };
-        
-        Plotly.newPlot('grafico-categorias', [trace1, trace2], layout, { responsive: true, displayModeBar: false });
+// Carrega mais transações quando o histórico é rolado até perto do fim
+function configurarRolagemTransacoes() {
+    const container = document.getElementById('lista-transacoes');
+    if (!container) return;
+
+    container.addEventListener('scroll', () => {
+        const pertoDoFim = container.scrollTop + container.clientHeight >= container.scrollHeight - 200;
+        if (pertoDoFim && proximoCursor) {
+            carregarPaginaTransacoes();
+        }
+    });
+}
+
+// Busca no histórico enquanto se digita, com uma pausa curta entre as teclas
+function configurarBuscaTransacoes() {
+    const campo = document.getElementById('busca-transacoes');
+    if (!campo) return;
+
+    let espera = null;
+    campo.addEventListener('input', () => {
+        clearTimeout(espera);
+        espera = setTimeout(() => {
+            termoBusca = campo.value.trim();
+            carregarTransacoes();
+        }, 300);
+    });
+}
+
+function exibirSaldo(saldo) {
+    let receitas = saldo.receitas || 0;
+    let despesas = saldo.despesas || 0;
+    let saldoTotal = saldo.saldo || (receitas - despesas);
+    
+    document.getElementById('total-receitas').textContent = formatarMoeda(receitas);
+    document.getElementById('total-despesas').textContent = formatarMoeda(despesas);
+    document.getElementById('saldo-total').textContent = formatarMoeda(saldoTotal);
         
-    } catch (error) {
-        console.error('Erro ao carregar gráfico de categorias:', error);
+    const cardSaldo = document.querySelector('.card-saldo');
+    if (cardSaldo) {
+        if (saldoTotal >= 0) {
+            cardSaldo.classList.remove('negative-saldo');
+            cardSaldo.classList.add('positive-saldo');
+        } else {
+            cardSaldo.classList.remove('positive-saldo');
+            cardSaldo.classList.add('negative-saldo');
+        }
     }
 }
 
+function exibirGraficos() {
+    if (!dadosDashboard) return;
+    exibirGraficoMensal(dadosDashboard.mensal);
+    exibirGraficoCategorias(dadosDashboard.categorias);
+}
+
+function exibirGraficoMensal(dados) {
+    const meses = dados.map(item => formatarMes(item.mes));
+    const receitas = dados.map(item => item.receitas);
+    const despesas = dados.map(item => item.despesas);
+    const saldos = dados.map(item => item.saldo);
+    
+    const trace1 = { x: meses, y: receitas, name: 'Receitas', type: 'bar', marker: { color: '#27ae60' } };
+    const trace2 = { x: meses, y: despesas, name: 'Despesas', type: 'bar', marker: { color: '#e74c3c' } };
+    const trace3 = { x: meses, y: saldos, name: 'Saldo', type: 'line', marker: { color: '#3498db' }, line: { width: 4 } };
+    
+    const layout = getLayoutGrafico();
+    layout.barmode = 'group';
+    
+    Plotly.newPlot('grafico-mensal', [trace1, trace2, trace3], layout, { responsive: true, displayModeBar: false });
+}
+
+function exibirGraficoCategorias(dados) {
+    const trace1 = { labels: dados.receitas.map(item => item.categoria), values: dados.receitas.map(item => item.total), name: 'Receitas', type: 'pie', hole: 0.4, domain: { row: 0, column: 0 }, marker: { colors: ['#27ae60', '#2ecc71', '#1abc9c', '#16a085'] } };
+    const trace2 = { labels: dados.despesas.map(item => item.categoria), values: dados.despesas.map(item => item.total), name: 'Despesas', type: 'pie', hole: 0.4, domain: { row: 0, column: 1 }, marker: { colors: ['#e74c3c', '#c0392b', '#d35400', '#e67e22'] } };
+    
+    const layout = getLayoutGrafico();
+    layout.grid = { rows: 1, columns: 2 };
+    
+    Plotly.newPlot('grafico-categorias', [trace1, trace2], layout, { responsive: true, displayModeBar: false });
+}
+
 function getLayoutGrafico() {
     const isDarkMode = document.documentElement.getAttribute('data-theme') === 'dark';
     const textColor = isDarkMode ? '#e0e0e0' : '#212529';
@@ -262,7 +477,7 @@ async function adicionarTransacao() {
             form.reset();
             document.getElementById('data').value = new Date().toISOString().split('T')[0];
             mostrarMensagem('Transação adicionada com sucesso!', 'success');
-            carregarTransacoes(); 
+            sincronizarTransacoes();
         } else {
             throw new Error(result.error);
         }
@@ -285,7 +500,7 @@ async function excluirTransacao(id) {
         const result = await response.json();
         
         if (result.success) {
-            carregarTransacoes();
+            sincronizarTransacoes();
             mostrarMensagem('Transação excluída com sucesso!', 'success');
         } else {
             throw new Error(result.error);
@@ -296,7 +511,7 @@ async function excluirTransacao(id) {
     }
 }
 
-function exibirTransacoes() {
+function exibirTransacoes(lista = transacoes, acrescentar = false) {
     const container = document.getElementById('lista-transacoes');
     if (!container) return;
 
@@ -310,41 +525,49 @@ function exibirTransacoes() {
         return;
     }
     
-    container.innerHTML = transacoes.map(transacao => {
-        const anexoIcon = transacao.anexo 
-            ? `<button class="btn btn-sm btn-outline-secondary btn-action ms-2" 
-                       onclick="mostrarAnexo('${transacao.anexo}')"
-                       title="Ver Anexo">
-                   <i class="fas fa-paperclip"></i>
-               </button>`
-            : '';
-
-        return `
-            <div class="transacao-item fade-in ${transacao.tipo === 'receita' ? 'transacao-receita' : 'transacao-despesa'}">
-                <div class="d-flex justify-content-between align-items-center">
-                    <div class="flex-grow-1">
-                        <h6 class="mb-1">${transacao.descricao}</h6>
-                        <small class="text-muted">
-                            ${transacao.categoria} • ${formatarData(transacao.data)}
-                        </small>
+    const html = lista.map(htmlTransacao).join('');
+
+    if (acrescentar) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+}
+
+function htmlTransacao(transacao) {
+    const anexoIcon = transacao.anexo 
+        ? `<button class="btn btn-sm btn-outline-secondary btn-action ms-2" 
+                   onclick="mostrarAnexo('${transacao.anexo}')"
+                   title="Ver Anexo">
+               <i class="fas fa-paperclip"></i>
+           </button>`
+        : '';
+
+    return `
+        <div class="transacao-item fade-in ${transacao.tipo === 'receita' ? 'transacao-receita' : 'transacao-despesa'}" data-id="${transacao.id}">
+            <div class="d-flex justify-content-between align-items-center">
+                <div class="flex-grow-1">
+                    <h6 class="mb-1">${transacao.descricao}</h6>
+                    <small class="text-muted">
+                        ${transacao.categoria} • ${formatarData(transacao.data)}
+                    </small>
+                </div>
+                <div class="text-end d-flex align-items-center">
+                    <div class="fw-bold me-2 ${transacao.tipo === 'receita' ? 'text-success' : 'text-danger'}">
+                        ${transacao.tipo === 'receita' ? '+' : '-'} ${formatarMoeda(transacao.valor)}
                     </div>
-                    <div class="text-end d-flex align-items-center">
-                        <div class="fw-bold me-2 ${transacao.tipo === 'receita' ? 'text-success' : 'text-danger'}">
-                            ${transacao.tipo === 'receita' ? '+' : '-'} ${formatarMoeda(transacao.valor)}
-                        </div>
-                        <div class="d-flex">
-                            <button class="btn btn-sm btn-outline-danger btn-action" 
-                                    onclick="excluirTransacao(${transacao.id})"
-                                    title="Excluir">
-                                <i class="fas fa-trash"></i>
-                            </button>
-                            ${anexoIcon} 
-                        </div>
+                    <div class="d-flex">
+                        <button class="btn btn-sm btn-outline-danger btn-action" 
+                                onclick="excluirTransacao(${transacao.id})"
+                                title="Excluir">
+                            <i class="fas fa-trash"></i>
+                        </button>
+                        ${anexoIcon} 
                     </div>
                 </div>
             </div>
-        `;
-    }).join('');
+        </div>
+    `;
 }
 
 function mostrarAnexo(filename) {
@@ -424,6 +647,7 @@ async function gerarRelatorio() {
     const dataInicio = document.getElementById('data-inicio').value;
     const dataFim = document.getElementById('data-fim').value;
     const tipo = document.getElementById('tipo-relatorio').value;
+    document.getElementById('link-pdf').style.display = 'none';
     
     if (!dataInicio || !dataFim) {
         mostrarMensagem('Selecione as datas de início e fim!', 'warning');
@@ -539,7 +763,55 @@ function exibirRelatorio() {
     rodapeTabela.innerHTML = rodapeTabelaHtml;
 }
 
-function exportarPDF() {
+async function exportarPDF() {
+    if (!dadosRelatorio) {
+        mostrarMensagem('Gere um relatório primeiro!', 'warning');
+        return;
+    }
+    const dados = new FormData();
+    dados.append('data_inicio', document.getElementById('data-inicio').value);
+    dados.append('data_fim', document.getElementById('data-fim').value);
+    dados.append('tipo', document.getElementById('tipo-relatorio').value);
+
+    const botao = document.getElementById('botao-exportar-pdf');
+    const link = document.getElementById('link-pdf');
+    link.style.display = 'none';
+    botao.disabled = true;
+
+    try {
+        // Períodos grandes são gerados em segundo plano; a mesma chamada
+        // informa o andamento até o PDF ficar pronto
+        let avisado = false;
+        while (true) {
+            const response = await fetch('/api/relatorios/pdf', { method: 'POST', body: dados });
+            const resultado = await response.json();
+            if (!resultado.success) {
+                throw new Error(resultado.error);
+            }
+            if (resultado.status === 'concluido') {
+                link.href = resultado.url;
+                link.style.display = 'inline-block';
+                if (avisado) {
+                    mostrarMensagem('Relatório em PDF pronto para download.', 'success');
+                } else {
+                    window.open(resultado.url, '_blank');
+                }
+                return;
+            }
+            if (!avisado) {
+                mostrarMensagem(`Gerando PDF com ${resultado.linhas} transações, aguarde...`, 'info');
+                avisado = true;
+            }
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+    } catch (error) {
+        mostrarMensagem(error.message || 'Erro ao gerar o PDF.', 'danger');
+    } finally {
+        botao.disabled = false;
+    }
+}
+
+function exportarArquivo(formato) {
     if (!dadosRelatorio) {
         mostrarMensagem('Gere um relatório primeiro!', 'warning');
         return;
@@ -547,8 +819,7 @@ function exportarPDF() {
     const dataInicio = document.getElementById('data-inicio').value;
     const dataFim = document.getElementById('data-fim').value;
     const tipo = document.getElementById('tipo-relatorio').value;
-    const url = `/relatorio/pdf?data_inicio=${dataInicio}&data_fim=${dataFim}&tipo=${tipo}`;
-    window.open(url, '_blank');
+    window.location.href = `/relatorio/export?data_inicio=${dataInicio}&data_fim=${dataFim}&tipo=${tipo}&formato=${formato}`;
 }
 
 function imprimirRelatorio() {
@@ -0,0 +1,37 @@
+# Fixtures dos testes: cada teste recebe um app com um banco novo, criado
+# pelo mesmo caminho de flask init-db, numa pasta temporária.
+#
+# Uso: python -m pytest tests
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A raiz vem antes de benchmarks/, que tem um importacao.py próprio
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+sys.path.insert(0, RAIZ)
+
+import app as aplicacao
+
+@pytest.fixture
+def app(tmp_path):
+    app = aplicacao.create_app({
+        'DATABASE': str(tmp_path / 'livro_caixa.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'RELATORIOS_CACHE': str(tmp_path / 'relatorios_cache'),
+        'BACKUP_PASTA': str(tmp_path / 'backups'),
+        'TESTING': True,
+    })
+    with app.app_context():
+        aplicacao.init_db()
+    return app
+
+
+@pytest.fixture
+def cliente(app):
+    # Cliente já logado com um usuário novo
+    cliente = app.test_client()
+    cliente.post('/register', data={'username': 'teste', 'password': 'teste'})
+    cliente.post('/login', data={'username': 'teste', 'password': 'teste'})
+    return cliente
@@ -0,0 +1,102 @@
+# Backup com anos fechados: as transações de um ano fechado só existem no
+# banco de arquivo, então snapshot, restauração e download levam os dois.
+import gzip
+import io
+import os
+import sqlite3
+import zipfile
+
+import pytest
+
+import arquivamento
+import backup as backups
+import database
+
+def lancar(cliente, descricao, data):
+    cliente.post('/api/transacoes', data={
+        'descricao': descricao, 'valor': '10', 'tipo': 'despesa', 'categoria': 'Outros', 'data': data
+    }).close()
+
+@pytest.fixture
+def fechado(app, cliente):
+    # Um usuário com transações em 2022 (fechado) e 2023 (aberto) e outro
+    # usuário com uma transação arquivada
+    lancar(cliente, 'Arquivada', '2022-05-01')
+    lancar(cliente, 'Aberta', '2023-05-01')
+    outro = app.test_client()
+    outro.post('/register', data={'username': 'outro', 'password': 'outro'})
+    outro.post('/login', data={'username': 'outro', 'password': 'outro'})
+    lancar(outro, 'Do outro', '2022-06-01')
+    conn = database.connect(app.config['DATABASE'])
+    try:
+        arquivamento.fechar_ano(conn, 2022, app.config['ARQUIVO_DATABASE'])
+    finally:
+        conn.close()
+    return app
+
+def contar(caminho, tabela='transacoes'):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {tabela}').fetchone()[0]
+    finally:
+        conn.close()
+
+def test_snapshot_e_restauracao_levam_o_banco_de_arquivo(fechado, tmp_path):
+    principal = fechado.config['DATABASE']
+    arquivo = arquivamento.resolver_arquivo(principal, fechado.config['ARQUIVO_DATABASE'])
+    pasta = str(tmp_path / 'snapshots')
+
+    criados = backups.criar_snapshot(principal, pasta, 7)
+    assert len(criados) == 2
+    assert backups.criar_snapshot(principal, pasta, 7) == []
+    snapshot = backups.listar_snapshots(pasta)[0]
+    assert backups.verificar_snapshot(snapshot) == []
+
+    # Perde o banco de arquivo e uma transação do principal
+    os.remove(arquivo)
+    conn = database.connect(principal)
+    conn.execute('DELETE FROM transacoes')
+    conn.commit()
+    conn.close()
+
+    assert backups.restaurar(snapshot, principal) == []
+    assert contar(principal) == 1
+    assert contar(arquivo) == 2
+
+def test_restauracao_sem_o_snapshot_do_arquivo_nao_toca_no_banco(fechado, tmp_path):
+    principal = fechado.config['DATABASE']
+    pasta = str(tmp_path / 'snapshots')
+    backups.criar_snapshot(principal, pasta, 7)
+    for caminho in backups.listar_snapshots(pasta, backups.prefixo_arquivo(fechado.config['ARQUIVO_DATABASE'])):
+        os.remove(caminho)
+    snapshot = backups.listar_snapshots(pasta)[0]
+
+    assert backups.verificar_snapshot(snapshot)
+    conn = database.connect(principal)
+    conn.execute('DELETE FROM transacoes')
+    conn.commit()
+    conn.close()
+    assert backups.restaurar(snapshot, principal)
+    assert contar(principal) == 0
+
+def test_download_leva_o_banco_de_arquivo_so_com_o_usuario(fechado, cliente, tmp_path):
+    resposta = cliente.get('/backup')
+    assert resposta.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(resposta.get_data())) as pacote:
+        pacote.extractall(tmp_path / 'download')
+    resposta.close()
+
+    principal = str(tmp_path / 'download' / 'livro_caixa.db')
+    arquivo = str(tmp_path / 'download' / os.path.basename(fechado.config['ARQUIVO_DATABASE']))
+    assert contar(principal) == 1
+    assert contar(principal, 'users') == 1
+    conn = sqlite3.connect(arquivo)
+    assert [row[0] for row in conn.execute('SELECT descricao FROM transacoes')] == ['Arquivada']
+    conn.close()
+
+def test_download_sem_anos_fechados_continua_gz(cliente):
+    lancar(cliente, 'Aberta', '2023-05-01')
+    resposta = cliente.get('/backup')
+    assert resposta.mimetype == 'application/gzip'
+    assert gzip.decompress(resposta.get_data()).startswith(b'SQLite format 3')
+    resposta.close()
@@ -0,0 +1,45 @@
+# Nenhuma requisição pode deixar conexão com o banco aberta: depois de
+# muitas requisições (leituras, escritas, erros, respostas em streaming lidas
+# pela metade) o número de arquivos do banco abertos pelo processo volta ao
+# que era antes. Conta os descritores em /proc/self/fd (Linux), o que pega
+# também conexões abertas fora de database.connect.
+import os
+
+import pytest
+
+REPETICOES = 100
+
+def conexoes_abertas(caminho):
+    pasta = '/proc/self/fd'
+    abertas = 0
+    for descritor in os.listdir(pasta):
+        try:
+            if os.readlink(os.path.join(pasta, descritor)) == caminho:
+                abertas += 1
+        except OSError:
+            pass
+    return abertas
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='conta os descritores em /proc/self/fd')
+def test_requisicoes_fecham_as_conexoes(app, cliente):
+    caminho = os.path.realpath(app.config['DATABASE'])
+    cliente.post('/api/transacoes', data={
+        'descricao': 'Mercado', 'valor': '10', 'tipo': 'despesa', 'categoria': 'Alimentação', 'data': '2024-01-05'
+    }).close()
+    inicio = conexoes_abertas(caminho)
+
+    for i in range(REPETICOES):
+        for rota in ('/', '/lancamentos', '/relatorios', '/api/dashboard', '/api/relatorios/mensal',
+                     '/api/transacoes/busca?q=mercado', '/api/transacoes/mudancas', '/rota-inexistente'):
+            cliente.get(rota).close()
+        cliente.post('/api/transacoes', data={
+            'descricao': f'Compra {i}', 'valor': '1,5', 'tipo': 'despesa', 'categoria': 'Outros', 'data': '2024-01-06'
+        }).close()
+        cliente.post('/api/transacoes', data={'descricao': '', 'valor': 'x'}).close()
+        cliente.delete('/api/transacoes/999999').close()
+        # Resposta em streaming abandonada antes do fim
+        resposta = cliente.get('/api/transacoes', buffered=False)
+        next(resposta.response, None)
+        resposta.close()
+
+    assert conexoes_abertas(caminho) == inicio
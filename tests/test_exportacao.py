@@ -0,0 +1,30 @@
+# Exportação de linhas com valor gravado como texto: o lançamento avulso
+# (POST /api/transacoes) grava o valor como veio, e "10,5" não vira REAL.
+import io
+
+import pytest
+
+FILTROS = 'data_inicio=2024-01-01&data_fim=2024-12-31'
+
+@pytest.fixture
+def valor_texto(cliente):
+    for descricao, valor, data in (('Texto', '10,5', '2024-01-02'), ('Numero', '12', '2024-01-01')):
+        cliente.post('/api/transacoes', data={
+            'descricao': descricao, 'valor': valor, 'tipo': 'despesa', 'categoria': 'Outros', 'data': data
+        }).close()
+    return cliente
+
+def test_csv_exporta_valor_em_texto(valor_texto):
+    resposta = valor_texto.get(f'/relatorio/export?{FILTROS}&formato=csv')
+    linhas = resposta.get_data(as_text=True).lstrip('﻿').splitlines()
+    resposta.close()
+    assert linhas[1].startswith('2024-01-02;Texto;10,5;')
+    assert linhas[2].startswith('2024-01-01;Numero;12,00;')
+
+def test_xlsx_exporta_valor_em_texto(valor_texto):
+    from openpyxl import load_workbook
+
+    resposta = valor_texto.get(f'/relatorio/export?{FILTROS}&formato=xlsx')
+    planilha = load_workbook(io.BytesIO(resposta.get_data())).active
+    resposta.close()
+    assert [linha[2] for linha in planilha.iter_rows(min_row=2, values_only=True)] == ['10,5', 12]
@@ -0,0 +1,55 @@
+# Job de OCR travado: só o processo dele (e o que ele abriu) é encerrado;
+# o job que roda em outro processo termina normalmente.
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import ocr
+
+def tarefa(caminho, timeout):
+    # Simula o tesseract travado: abre um filho que não termina e espera por ele
+    if os.path.basename(caminho) == 'trava.txt':
+        filho = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(1000)'])
+        with open(caminho, 'w') as f:
+            f.write(str(filho.pid))
+        filho.wait()
+    return 1.0, {}
+
+def vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # Zumbi (já morto, esperando o pai) não conta
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().split(') ')[1][0] != 'Z'
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='usa /proc para ver o processo filho')
+def test_job_travado_nao_derruba_os_outros(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, 'processar_com_etapas', tarefa)
+    monkeypatch.setattr(ocr, 'INTERVALO_VIGIA', 0.1)
+    travado = str(tmp_path / 'trava.txt')
+    try:
+        job_travado = ocr.submeter(travado, 1, 2, 4, lambda future: None)
+        # O job normal começa depois que o travado já abriu o filho
+        while not os.path.exists(travado) or not open(travado).read():
+            time.sleep(0.05)
+        job_normal = ocr.submeter(str(tmp_path / 'normal.txt'), 30, 2, 4, lambda future: None)
+
+        assert job_normal.result(timeout=30) == (1.0, {})
+        with pytest.raises(TimeoutError):
+            job_travado.result(timeout=30)
+        pid = int(open(travado).read())
+        for _ in range(50):
+            if not vivo(pid):
+                break
+            time.sleep(0.1)
+        assert not vivo(pid)
+        # O processo do job normal continua servindo a fila
+        assert len(ocr._processos) == 1
+        assert ocr.submeter(str(tmp_path / 'outro.txt'), 30, 2, 4, lambda future: None).result(timeout=30) == (1.0, {})
+    finally:
+        ocr.encerrar_pool()
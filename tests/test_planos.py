@@ -0,0 +1,22 @@
+# As consultas frequentes (app.consultas_frequentes) não podem varrer a
+# tabela transacoes inteira: o mesmo que flask verificar-planos confere, num
+# banco recém-criado e num banco com transações e estatísticas (ANALYZE),
+# onde o planejador pode escolher outro índice.
+import pytest
+
+import app as aplicacao
+import database
+import gerador
+
+@pytest.mark.parametrize('linhas', [0, 5000])
+def test_consultas_frequentes_usam_indice(app, linhas):
+    conn = database.connect(app.config['DATABASE'])
+    try:
+        if linhas:
+            user_id = gerador.obter_usuario(conn, 'planos')
+            gerador.preencher(conn, linhas, user_id=user_id)
+            conn.execute('ANALYZE')
+        problemas = database.query_plan_scans(conn, aplicacao.consultas_frequentes(conn))
+    finally:
+        conn.close()
+    assert problemas == [], '\n'.join(f'{nome}: {detalhe}' for nome, detalhe in problemas)
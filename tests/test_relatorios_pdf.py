@@ -0,0 +1,47 @@
+# PDF do relatório: uma tabela de transações por página, e o cache apaga os
+# registros em relatorios_pdf junto com os PDFs que saem dele.
+import io
+import math
+import os
+import re
+
+import database
+import relatorios_pdf
+
+def paginas(pdf):
+    return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+def test_uma_tabela_por_pagina(app, cliente):
+    conn = database.connect(app.config['DATABASE'])
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'teste'").fetchone()['id']
+    total = relatorios_pdf.LINHAS_PRIMEIRA_TABELA + 3 * relatorios_pdf.LINHAS_POR_TABELA + 1
+    conn.executemany(
+        'INSERT INTO transacoes (user_id, data, descricao, valor, tipo, categoria) VALUES (?, ?, ?, ?, ?, ?)',
+        [(user_id, '2024-01-01', f'Transação com uma descrição comprida {i}', 1234.56, 'despesa', 'Alimentação') for i in range(total)]
+    )
+    conn.commit()
+
+    pdf = io.BytesIO()
+    relatorios_pdf.gerar_pdf(conn, user_id, '2024-01-01', '2024-12-31', 'todos', pdf)
+    conn.close()
+    # Se alguma tabela fosse quebrada entre páginas, sobraria uma página a mais
+    restantes = total - relatorios_pdf.LINHAS_PRIMEIRA_TABELA
+    assert paginas(pdf.getvalue()) == 1 + math.ceil(restantes / relatorios_pdf.LINHAS_POR_TABELA)
+
+def test_limpar_cache_apaga_os_registros(app, cliente):
+    pasta = app.config['RELATORIOS_CACHE']
+    os.makedirs(pasta)
+    conn = database.connect(app.config['DATABASE'])
+    user_id = conn.execute("SELECT id FROM users WHERE username = 'teste'").fetchone()['id']
+    for i, chave in enumerate(('antiga', 'nova')):
+        with open(relatorios_pdf.caminho_cache(pasta, chave), 'wb') as f:
+            f.write(b'%PDF')
+        os.utime(relatorios_pdf.caminho_cache(pasta, chave), (i, i))
+        relatorios_pdf.registrar_concluido(conn, chave, user_id, 1)
+    conn.execute("INSERT INTO relatorios_pdf (chave, user_id, status) VALUES ('gerando', ?, 'processando')", (user_id,))
+    conn.commit()
+
+    relatorios_pdf.limpar_cache(conn, pasta, maximo=1)
+    assert os.listdir(pasta) == ['relatorio_nova.pdf']
+    assert [row['chave'] for row in conn.execute('SELECT chave FROM relatorios_pdf ORDER BY chave')] == ['gerando', 'nova']
+    conn.close()
@@ -0,0 +1,10 @@
+# Ponto de entrada WSGI para o servidor de produção (Linux), na pasta do projeto:
+#
+#   gunicorn wsgi:app
+#
+# O gunicorn lê gunicorn.conf.py desta pasta (workers, threads, endereço,
+# migrações e aquecimento). A configuração do app vem de LIVRO_CAIXA_CONFIG
+# e das variáveis LIVRO_CAIXA_*; ver create_app.
+from app import create_app
+
+app = create_app()